@@ -0,0 +1,123 @@
+"""
+Microbenchmark for cozmo_fsm.evbase.EventRouter dispatch.
+
+Registers thousands of listeners, the way a large state machine's
+transitions would: each one listens for CompletionEvent or DataEvent
+from its own source node, plus ten listening with source None and a
+few wildcards.  Then measures:
+
+  lookup       time to find the listeners for an event
+  post         time for EventRouter.post to find and schedule listeners
+  deliver      time per event including running the scheduled handlers
+  latency      mean delay from post to delivery (EventRouter.delivery_stats)
+  churn        time to add and remove one listener (as when a state
+               is entered and exited)
+
+No Cozmo is required.
+
+Usage:
+    python3 benchmarks/bench_erouter.py [--listeners 1000,5000] [--events 20000]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from cozmo_fsm.evbase import EventRouter
+from cozmo_fsm.events import CompletionEvent, DataEvent
+
+class Source():
+    def __init__(self, i):
+        self.name = 'node%d' % i
+
+class Listener():
+    def __init__(self):
+        self.count = 0
+
+    def handle_event(self, event):
+        self.count += 1
+
+class BenchRobot():
+    def __init__(self, loop):
+        self.loop = loop
+
+def setup(num_listeners, loop):
+    erouter = EventRouter()
+    erouter.robot = BenchRobot(loop)
+    sources = [Source(i) for i in range(num_listeners)]
+    listeners = []
+    for (i, source) in enumerate(sources):
+        listener = Listener()
+        event_class = CompletionEvent if i % 2 == 0 else DataEvent
+        erouter.add_listener(listener, event_class, source)
+        listeners.append(listener)
+    for i in range(10):
+        erouter.add_listener(Listener(), DataEvent, None)
+    for i in range(3):
+        erouter.add_wildcard_listener(Listener(), DataEvent, None)
+    return (erouter, sources)
+
+def run(num_listeners, num_events):
+    loop = asyncio.new_event_loop()
+    (erouter, sources) = setup(num_listeners, loop)
+    events = [DataEvent(sources[(2*i+1) % num_listeners], i)
+              for i in range(num_events)]
+
+    # Post in batches, draining the ready queue after each batch as the
+    # event loop would.  post_time covers only finding and scheduling
+    # the listeners; total_time includes running them.
+    post_time = 0.
+    t0 = time.perf_counter()
+    for i in range(0, num_events, 100):
+        t = time.perf_counter()
+        for event in events[i:i+100]:
+            erouter.post(event)
+        post_time += time.perf_counter() - t
+        loop.run_until_complete(asyncio.sleep(0))
+    total_time = time.perf_counter() - t0
+    latency = erouter.delivery_stats.mean_latency
+
+    t = time.perf_counter()
+    for event in events:
+        erouter._get_listeners(event)
+    lookup_time = time.perf_counter() - t
+
+    # add/remove churn on a busy router
+    listener = Listener()
+    source = sources[0]
+    n = min(num_events, 10000)
+    t3 = time.perf_counter()
+    for i in range(n):
+        erouter.add_listener(listener, CompletionEvent, source)
+        erouter.post(CompletionEvent(source))
+        erouter.remove_all_listener_entries(listener)
+    t4 = time.perf_counter()
+    loop.run_until_complete(asyncio.sleep(0))
+    loop.close()
+    return dict(listeners = num_listeners,
+                lookup_us = 1e6 * lookup_time / num_events,
+                post_us = 1e6 * post_time / num_events,
+                deliver_us = 1e6 * total_time / num_events,
+                latency_us = 1e6 * latency,
+                churn_us = 1e6 * (t4-t3) / n)
+
+def main():
+    parser = argparse.ArgumentParser(description='EventRouter dispatch benchmark')
+    parser.add_argument('--listeners', default='100,1000,5000',
+                        help='comma-separated listener counts')
+    parser.add_argument('--events', type=int, default=20000)
+    args = parser.parse_args()
+    print('%10s %10s %10s %12s %12s %10s' %
+          ('listeners', 'lookup us', 'post us', 'deliver us', 'latency us', 'churn us'))
+    for n in [int(x) for x in args.listeners.split(',')]:
+        r = run(n, args.events)
+        print('%10d %10.2f %10.2f %12.2f %12.2f %10.2f' %
+              (r['listeners'], r['lookup_us'], r['post_us'], r['deliver_us'],
+               r['latency_us'], r['churn_us']))
+
+if __name__ == '__main__':
+    main()
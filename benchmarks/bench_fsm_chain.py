@@ -0,0 +1,90 @@
+"""
+Transition hop latency benchmark.
+
+Builds a chain of logic-only state nodes, each one posting a completion
+as soon as it starts, linked by CompletionTrans, and measures the time
+from starting the chain to the last node starting.  Runs it twice: with
+Transition.zero_delay_firing disabled, so every hop waits
+Transition.action_cancel_delay, and enabled, so hops whose source nodes
+have no action to cancel start their destinations on the next loop
+iteration.
+
+No Cozmo is required.
+
+Usage:
+    python3 benchmarks/bench_fsm_chain.py [--nodes 100]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import cozmo_fsm.evbase as evbase
+from cozmo_fsm.evbase import EventRouter
+
+class BenchRobot():
+    def __init__(self, loop):
+        self.loop = loop
+        self.erouter = EventRouter()
+        self.erouter.robot = self
+
+loop = asyncio.new_event_loop()
+evbase.robot_for_loading = BenchRobot(loop)
+
+from cozmo_fsm.base import StateNode, Transition
+from cozmo_fsm.transitions import CompletionTrans
+
+class Step(StateNode):
+    def start(self, event=None):
+        if self.running: return
+        super().start(event)
+        self.post_completion()
+
+class Last(StateNode):
+    def start(self, event=None):
+        if self.running: return
+        super().start(event)
+        self.parent.done.set_result(time.perf_counter())
+
+class Chain(StateNode):
+    def __init__(self, num_nodes):
+        self.num_nodes = num_nodes
+        self.done = None
+        super().__init__()
+
+    def setup(self):
+        nodes = [Step().set_name('step%d' % i).set_parent(self)
+                 for i in range(self.num_nodes - 1)]
+        nodes.append(Last().set_name('last').set_parent(self))
+        for (src, dest) in zip(nodes, nodes[1:]):
+            CompletionTrans().set_name('trans_'+src.name).add_sources(src).add_destinations(dest)
+
+def run(chain, zero_delay):
+    Transition.zero_delay_firing = zero_delay
+    chain.done = loop.create_future()
+    t0 = time.perf_counter()
+    chain.start()
+    t1 = loop.run_until_complete(chain.done)
+    chain.stop()
+    return t1 - t0
+
+def main():
+    parser = argparse.ArgumentParser(description='Transition hop latency benchmark')
+    parser.add_argument('--nodes', type=int, default=100)
+    args = parser.parse_args()
+    chain = Chain(args.nodes)
+    hops = args.nodes - 1
+    print('%-12s %10s %12s' % ('firing', 'total ms', 'per hop us'))
+    for zero_delay in (False, True):
+        elapsed = run(chain, zero_delay)
+        print('%-12s %10.2f %12.2f' %
+              ('zero-delay' if zero_delay else 'delayed', 1000*elapsed, 1e6*elapsed/hops))
+    Transition.zero_delay_firing = True
+    loop.close()
+
+if __name__ == '__main__':
+    main()
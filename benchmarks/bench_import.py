@@ -0,0 +1,105 @@
+"""
+Cold-start import time benchmark.
+
+Each scenario runs in a fresh interpreter, so nothing is cached in
+sys.modules, and times the imports a program needs before it can
+start:
+
+  cozmo        the Cozmo SDK alone, for reference
+  cozmo_fsm    import cozmo_fsm
+  program      what a minimal StateMachineProgram needs
+  simple_cli   everything simple_cli imports (the script is loaded
+               as a module, so it doesn't connect to a robot)
+
+For each scenario it also lists the deferred modules (viewers, speech,
+perched cameras, map sharing) that were loaded anyway; normally there
+should be none.
+
+No Cozmo is required.
+
+Usage:
+    python3 benchmarks/bench_import.py [--repeat 5] [--importtime 15]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+top_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+deferred_modules = ['OpenGL', 'speech_recognition'] + \
+    ['cozmo_fsm.' + name for name in
+     ('particle_viewer', 'path_viewer', 'worldmap_viewer', 'opengl',
+      'speech', 'perched', 'sharedmap')]
+
+scenarios = dict(
+    cozmo = 'import cozmo',
+    cozmo_fsm = 'import cozmo_fsm',
+    program = 'from cozmo_fsm.program import StateMachineProgram',
+    simple_cli = ('import importlib.machinery\n'
+                  'importlib.machinery.SourceFileLoader("simple_cli", "simple_cli").load_module()')
+    )
+
+child_template = """
+import json, sys, time
+t0 = time.perf_counter()
+%s
+t1 = time.perf_counter()
+print(json.dumps(dict(seconds=t1-t0,
+                      loaded=[m for m in %r if m in sys.modules])))
+"""
+
+def run_child(code, extra_args=()):
+    return subprocess.run([sys.executable] + list(extra_args) + ['-c', code],
+                          cwd=top_dir, capture_output=True, text=True,
+                          stdin=subprocess.DEVNULL)
+
+def time_scenario(name, repeat):
+    code = child_template % (scenarios[name], deferred_modules)
+    times = []
+    loaded = []
+    for i in range(repeat):
+        result = run_child(code)
+        if result.returncode != 0:
+            raise RuntimeError('%s failed:\n%s' % (name, result.stderr))
+        data = json.loads(result.stdout.strip().splitlines()[-1])
+        times.append(data['seconds'])
+        loaded = data['loaded']
+    return (min(times), statistics.median(times), loaded)
+
+def importtime_report(count):
+    """The slowest cozmo_fsm modules, by cumulative import time."""
+    result = run_child('import cozmo_fsm', ['-X', 'importtime'])
+    rows = []
+    for line in result.stderr.splitlines():
+        fields = line.split('|')
+        if len(fields) != 3 or not fields[0].startswith('import time:'):
+            continue
+        module = fields[2].strip()
+        if module.startswith('cozmo_fsm'):
+            rows.append((int(fields[1]), module))
+    print('\n%10s  %s' % ('cum. ms', 'module'))
+    for (usec, module) in sorted(rows, reverse=True)[:count]:
+        print('%10.1f  %s' % (usec / 1000, module))
+
+def main():
+    parser = argparse.ArgumentParser(description='Cold-start import time benchmark')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--scenarios', default=','.join(scenarios),
+                        help='comma-separated scenario names')
+    parser.add_argument('--importtime', type=int, default=0, metavar='N',
+                        help='also list the N slowest cozmo_fsm modules')
+    args = parser.parse_args()
+    print('%-12s %10s %10s  %s' % ('scenario', 'min ms', 'median ms', 'deferred modules loaded'))
+    for name in args.scenarios.split(','):
+        (best, median, loaded) = time_scenario(name, args.repeat)
+        print('%-12s %10.1f %10.1f  %s' %
+              (name, 1000*best, 1000*median, ', '.join(loaded) or '-'))
+    if args.importtime:
+        importtime_report(args.importtime)
+
+if __name__ == '__main__':
+    main()
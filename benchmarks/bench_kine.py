@@ -0,0 +1,86 @@
+"""
+Microbenchmark for cozmo_fsm.kine forward kinematics.
+
+Uses CozmoKinematics with a simulated robot and measures, per call:
+
+  get_pose        reading all joint values (no change)
+  warm query      link_to_base / base_to_link with nothing changed
+  head moved      link_to_base('camera') after the head angle changes
+  cold query      link_to_base('camera') with every cache cleared,
+                  i.e. the full chain product and inversion
+  batch           links_to_base for every joint with a collision model,
+                  as rrt.make_robot_parts needs
+
+No Cozmo is required.
+
+Usage:
+    python3 benchmarks/bench_kine.py [--iterations 20000]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from cozmo_fsm.cozmo_kin import CozmoKinematics
+
+class Attributes():
+    pass
+
+class BenchRobot():
+    def __init__(self):
+        self.head_angle = Attributes()
+        self.head_angle.radians = 0.1
+        self.lift_height = Attributes()
+        self.lift_height.distance_mm = 50.
+        self.world = Attributes()
+        self.world.particle_filter = Attributes()
+        self.world.particle_filter.pose_version = 0
+        self.world.particle_filter.current_pose = lambda: (100., 50., 0.5)
+
+def timeit(function, iterations):
+    t = time.perf_counter()
+    for i in range(iterations):
+        function(i)
+    return 1e6 * (time.perf_counter() - t) / iterations
+
+def main():
+    parser = argparse.ArgumentParser(description='Forward kinematics benchmark')
+    parser.add_argument('--iterations', type=int, default=20000)
+    args = parser.parse_args()
+    n = args.iterations
+    robot = BenchRobot()
+    kine = CozmoKinematics(robot)
+    camera = kine.joints['camera']
+    colliders = [j for j in kine.joints.values() if j.collision_model]
+
+    def get_pose(i):
+        kine.get_pose()
+
+    def warm(i):
+        kine.link_to_base(camera)
+        kine.base_to_link('world')
+
+    def head_moved(i):
+        robot.head_angle.radians = 0.1 + 1e-6 * (i % 2)
+        kine.get_pose()
+        kine.link_to_base(camera)
+
+    def cold(i):
+        for joint in kine.joints.values():
+            joint.cache.clear()
+        kine.link_to_base(camera)
+
+    def batch(i):
+        kine.links_to_base(colliders)
+
+    print('%-12s %10s' % ('query', 'us/call'))
+    for (name, function) in (('get_pose', get_pose), ('warm query', warm),
+                             ('head moved', head_moved), ('cold query', cold),
+                             ('batch', batch)):
+        print('%-12s %10.2f' % (name, timeit(function, n)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,226 @@
+"""
+Multi-robot simulation harness for cozmo_fsm.sharedmap
+
+Launches one simulated server robot and N-1 simulated client robots in
+a single process, connected over loopback sockets through the real
+ServerThread / ClientThread / FusionThread code.  Each simulated robot
+has its own odometry frame, drives in a circle, and sees the same set
+of perched cameras (with noise) as landmarks.  No Cozmo is required.
+
+For each robot count the harness reports:
+  sync latency   mean round trip of one server<->client exchange
+  throughput     bytes per second over all links
+  cpu/robot      CPU fraction per robot (client thread + its handler)
+  fusion error   distance between each fused foreign robot pose on the
+                 server and its ground truth pose in the server's frame
+
+Usage:
+    python3 benchmarks/sharedmap_harness.py [--robots 2,5,10,20]
+            [--duration 5] [--cameras 3] [--walls 4] [--noise 5]
+"""
+
+import argparse
+import os
+import random
+import socket
+import sys
+import time
+from math import pi, sin, cos, sqrt
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from cozmo_fsm.sharedmap import ServerThread, ClientThread
+from cozmo_fsm.worldmap import WallObj, WorldMap, WorldObjectStore
+from cozmo_fsm.transform import wrap_angle
+
+#________________ Simulated robot ________________
+
+class SimSensorModel():
+    def __init__(self):
+        self.landmarks = dict()
+
+class SimParticleFilter():
+    def __init__(self):
+        self.pose = (0., 0., 0.)
+        self.sensor_model = SimSensorModel()
+
+class SimPerched():
+    def __init__(self):
+        self.cameras = dict()
+        self.camera_pool = dict()
+
+class SimWorldMap():
+    def __init__(self):
+        self.objects = WorldObjectStore()
+        self.shared_objects = dict()
+
+    update_object = WorldMap.update_object
+
+class SimWorld():
+    def __init__(self):
+        self.light_cubes = dict()
+        self.perched = SimPerched()
+        self.world_map = SimWorldMap()
+        self.particle_filter = SimParticleFilter()
+        self.is_server = True
+
+class SimRobot():
+    """Just enough of a robot for the sharedmap threads."""
+    def __init__(self, aruco_id, origin):
+        self.aruco_id = aruco_id
+        self.origin = origin    # (x, y, theta) of this robot's map frame in the world
+        self.world = SimWorld()
+        self.world.server = ServerThread(self)
+        self.world.client = ClientThread(self)
+        self.true_pose = (0., 0., 0.)
+
+    def to_local(self, x, y, theta=0.):
+        """Convert world coordinates into this robot's map frame."""
+        (ox, oy, otheta) = self.origin
+        dx = x - ox
+        dy = y - oy
+        c = cos(otheta)
+        s = sin(otheta)
+        return (c*dx + s*dy, -s*dx + c*dy, wrap_angle(theta - otheta))
+
+    def set_true_pose(self, x, y, theta):
+        self.true_pose = (x, y, theta)
+        self.world.particle_filter.pose = self.to_local(x, y, theta)
+
+#________________ Synthetic arena ________________
+
+class SimArena():
+    def __init__(self, num_robots, num_cameras=3, num_walls=4, noise=5., seed=0):
+        self.rng = random.Random(seed)
+        self.noise = noise
+        self.cameras = []
+        for i in range(num_cameras):
+            angle = 2*pi*i/num_cameras
+            self.cameras.append(('<VideoCapture %d>' % i,
+                                 800*cos(angle), 800*sin(angle), 600.,
+                                 wrap_angle(angle+pi), -pi/4))
+        self.robots = []
+        for i in range(num_robots):
+            origin = (self.rng.uniform(-500,500), self.rng.uniform(-500,500),
+                      self.rng.uniform(-pi,pi))
+            robot = SimRobot(100+i, origin)
+            self.robots.append(robot)
+            for w in range(num_walls):
+                key = 'Wall-%d' % (10*i+w)
+                robot.world.world_map.objects[key] = \
+                    WallObj(id=10*i+w, x=self.rng.uniform(-1000,1000),
+                            y=self.rng.uniform(-1000,1000),
+                            theta=self.rng.uniform(-pi,pi))
+        self.step(0.)
+
+    def camera_landmarks(self, robot):
+        """Noisy perched camera landmarks in robot's map frame, in the
+        format produced by SLAMParticle.add_landmark_cam."""
+        landmarks = dict()
+        for (key, x, y, z, phi, pitch) in self.cameras:
+            (lx, ly, lphi) = robot.to_local(x, y, phi)
+            sigma = np.eye(5) * self.rng.uniform(1, 10)
+            lx += self.rng.gauss(0, self.noise)
+            ly += self.rng.gauss(0, self.noise)
+            landmarks[key] = (np.array([[lx], [ly]]), (z, lphi, pitch), sigma)
+        return landmarks
+
+    def step(self, t):
+        """Drive every robot around its own circle."""
+        for (i, robot) in enumerate(self.robots):
+            angle = 0.5*t + 2*pi*i/len(self.robots)
+            robot.set_true_pose(300*cos(angle), 300*sin(angle), wrap_angle(angle+pi/2))
+            robot.world.particle_filter.sensor_model.landmarks = self.camera_landmarks(robot)
+
+    def fusion_errors(self):
+        server = self.robots[0]
+        errors = []
+        for robot in self.robots[1:]:
+            obj = server.world.world_map.objects.get('Foreign-'+str(robot.aruco_id))
+            if obj is None: continue
+            (x, y, _) = server.to_local(*robot.true_pose)
+            errors.append(sqrt((obj.x-x)**2 + (obj.y-y)**2))
+        return errors
+
+#________________ Harness ________________
+
+def free_port():
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+def run_trial(num_robots, duration=5., num_cameras=3, num_walls=4, noise=5., tick=0.025):
+    arena = SimArena(num_robots, num_cameras, num_walls, noise)
+    server_robot = arena.robots[0]
+    server = server_robot.world.server
+    server.port = free_port()
+    server.start_server_thread()
+    while not server.started:
+        time.sleep(0.01)
+    for robot in arena.robots[1:]:
+        robot.world.client.start_client_thread('127.0.0.1', server.port)
+    while len(server.threads) < num_robots-1:
+        time.sleep(0.01)
+
+    cpu0 = time.process_time()
+    t0 = time.time()
+    errors = []
+    while time.time() - t0 < duration:
+        arena.step(time.time()-t0)
+        errors += arena.fusion_errors()
+        time.sleep(tick)
+    elapsed = time.time() - t0
+    cpu_total = time.process_time() - cpu0
+
+    handlers = list(server.threads)
+    clients = [robot.world.client for robot in arena.robots[1:]]
+    for client in clients:
+        client.stop_client_thread()
+    server.stop_server_thread()
+
+    exchanges = sum(h.stats.exchanges for h in handlers)
+    latency = sum(h.stats.total_latency for h in handlers) / max(1, exchanges)
+    nbytes = sum(h.stats.bytes_sent + h.stats.bytes_received for h in handlers)
+    robot_cpu = [(c.stats.cpu_time + h.stats.cpu_time) / elapsed
+                 for (c,h) in zip(clients, handlers)]
+    return dict(robots = num_robots,
+                exchanges = exchanges,
+                latency_ms = 1000 * latency,
+                kbytes_per_sec = nbytes / elapsed / 1024,
+                cpu_per_robot = sum(robot_cpu) / max(1, len(robot_cpu)),
+                fusion_cpu = server.fusion.cpu_time / elapsed,
+                process_cpu = cpu_total / elapsed,
+                fusion_error_mm = np.mean(errors) if errors else float('nan'),
+                fusion_samples = len(errors))
+
+def print_table(results):
+    print('%6s %10s %11s %10s %10s %10s %12s' %
+          ('robots', 'exchanges', 'latency ms', 'KB/s', 'cpu/robot', 'fusion cpu', 'fusion err mm'))
+    for r in results:
+        print('%6d %10d %11.2f %10.1f %9.1f%% %9.1f%% %12.1f' %
+              (r['robots'], r['exchanges'], r['latency_ms'], r['kbytes_per_sec'],
+               100*r['cpu_per_robot'], 100*r['fusion_cpu'], r['fusion_error_mm']))
+
+def main():
+    parser = argparse.ArgumentParser(description='Shared map scaling harness')
+    parser.add_argument('--robots', default='2,5,10,20',
+                        help='comma-separated robot counts (server included)')
+    parser.add_argument('--duration', type=float, default=5.)
+    parser.add_argument('--cameras', type=int, default=3)
+    parser.add_argument('--walls', type=int, default=4)
+    parser.add_argument('--noise', type=float, default=5., help='landmark noise in mm')
+    args = parser.parse_args()
+    results = []
+    for n in [int(x) for x in args.robots.split(',')]:
+        if n < 2:
+            raise ValueError('Need at least two robots (one server, one client).')
+        results.append(run_trial(n, args.duration, args.cameras, args.walls, args.noise))
+    print()
+    print_table(results)
+
+if __name__ == '__main__':
+    main()
@@ -1,19 +1,57 @@
+import importlib
+
 from cozmo.util import radians, degrees, Pose, Rotation
+from cozmo.objects import LightCube
 
 from .nodes import *
 from .transitions import *
 from .program import *
 from .trace import tracefsm
+from .instrument import INSTR
 from .particle import *
-from .particle_viewer import ParticleViewer
 from .cozmo_kin import *
 from .rrt import *
-from .path_viewer import PathViewer
-from .speech import *
-from .worldmap import WorldMap
-from .worldmap_viewer import WorldMapViewer
+from .worldmap import WorldMap, LightCubeForeignObj
+from .mapfile import save_map, load_map
+from .calibration import microsoft_HD_webcam_cameraMatrix, microsoft_HD_webcam_distCoeffs
 from .pilot import *
 from .pickup import *
 from .doorpass import *
 from . import wall_defs
 from . import custom_objs
+
+# The viewers (OpenGL), speech recognition, perched cameras, and map
+# sharing are slow to import and often unused, so their modules are
+# loaded the first time one of their names is looked up.  They are
+# left out of "from cozmo_fsm import *", which would load them all;
+# refer to them as cozmo_fsm.ParticleViewer etc. or import them by
+# name, e.g. "from cozmo_fsm import ParticleViewer".
+lazy_modules = dict(
+    particle_viewer = ('ParticleViewer',),
+    path_viewer = ('PathViewer',),
+    worldmap_viewer = ('WorldMapViewer',),
+    speech = ('Thesaurus', 'SpeechListener'),
+    perched = ('Cam', 'CaptureThread', 'PerchedCameraThread'),
+    sharedmap = ('ServerThread', 'ClientThread', 'ClientHandlerThread',
+                 'FusionThread', 'LinkStats'),
+    opengl = ()
+    )
+
+lazy_names = dict((name, module) for (module, names) in lazy_modules.items()
+                  for name in names)
+
+def __getattr__(name):
+    if name in lazy_modules:
+        return importlib.import_module('.' + name, __name__)
+    module = lazy_names.get(name)
+    if module is None:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    value = getattr(importlib.import_module('.' + module, __name__), name)
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(lazy_names) | set(lazy_modules))
+
+__all__ = sorted(set(name for name in globals() if not name.startswith('_')) -
+                 {'importlib', 'lazy_modules', 'lazy_names'})
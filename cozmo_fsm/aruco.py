@@ -1,5 +1,8 @@
-import cv2, math
-from numpy import sqrt, arctan2, array, multiply
+import asyncio
+import cv2, math, time
+from numpy import sqrt, arctan2, array, multiply, concatenate
+
+from .events import ArucoEvent
 
 class ArucoMarker(object):
     def __init__(self,marker_id,bbox,translation,rotation):
@@ -39,8 +42,166 @@ class ArucoMarker(object):
 
         return array([x, y, z])
 
+class PyramidDetector(object):
+    """Multi-scale Aruco detection.  Marker candidates are found on a
+    downsampled copy of the image, and their corners are then refined
+    with cornerSubPix on the full-resolution image, so only small
+    windows around each corner are examined at full size.
+
+    If target_fps is given, the detector moves between pyramid levels
+    to keep its own running time within 1/target_fps."""
+    levels = (1.0, 0.5, 0.25, 0.125)
+
+    def __init__(self, aruco_lib, aruco_params, scale=0.5, target_fps=None):
+        self.aruco_lib = aruco_lib
+        self.aruco_params = aruco_params
+        self.level = min(range(len(self.levels)),
+                         key=lambda i: abs(self.levels[i]-scale))
+        self.target_fps = target_fps
+        self.criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.01)
+        self.last_duration = 0.
+
+    @property
+    def scale(self):
+        return self.levels[self.level]
+
+    def __call__(self, gray):
+        start = time.time()
+        result = self.detect(gray, self.scale)
+        self.last_duration = time.time() - start
+        if self.target_fps:
+            self.adapt(self.last_duration)
+        return result
+
+    def adapt(self, duration):
+        budget = 1 / self.target_fps
+        if duration > budget and self.level < len(self.levels)-1:
+            self.level += 1
+        elif self.level > 0:
+            # Cost scales with pixel count: the next level up costs
+            # about (ratio of scales)**2 times as much.
+            ratio = self.levels[self.level-1] / self.levels[self.level]
+            if duration * ratio * ratio < 0.8 * budget:
+                self.level -= 1
+
+    def detect(self, gray, scale):
+        if scale >= 1:
+            (corners, ids, _) = \
+                cv2.aruco.detectMarkers(gray, self.aruco_lib, parameters=self.aruco_params)
+            return (corners, ids)
+        small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        (small_corners, ids, _) = \
+            cv2.aruco.detectMarkers(small, self.aruco_lib, parameters=self.aruco_params)
+        if ids is None:
+            return ([], None)
+        half_win = max(3, int(round(1/scale)) + 1)
+        corners = []
+        for corner in small_corners:
+            # Pixel centers: small u maps to full-size (u+0.5)/scale - 0.5
+            pts = ((corner.reshape(-1,1,2) + 0.5) / scale - 0.5).astype('float32')
+            cv2.cornerSubPix(gray, pts, (half_win,half_win), (-1,-1), self.criteria)
+            corners.append(pts.reshape(1,-1,2))
+        return (corners, ids)
+
+class MarkerTracker(object):
+    """Region-of-interest Aruco detection.  Markers found in the previous
+    frame are searched for only in padded boxes around their predicted
+    positions; a full-frame scan runs every full_scan_interval frames
+    to pick up new markers, and whenever a tracked marker is lost."""
+    def __init__(self, aruco_lib, aruco_params, padding=0.5, min_padding=20,
+                 full_scan_interval=10, detector=None):
+        self.aruco_lib = aruco_lib
+        self.aruco_params = aruco_params
+        self.detector = detector          # used for full scans, e.g. a PyramidDetector
+        self.padding = padding            # fraction of marker size
+        self.min_padding = min_padding    # pixels
+        self.full_scan_interval = full_scan_interval
+        self.frames_since_scan = full_scan_interval
+        self.corners = []
+        self.ids = None
+        self.full_scans = 0
+        self.roi_scans = 0
+
+    def reset(self):
+        self.frames_since_scan = self.full_scan_interval
+        self.corners = []
+        self.ids = None
+
+    def full_frame_detect(self, gray):
+        (corners, ids, _) = \
+            cv2.aruco.detectMarkers(gray, self.aruco_lib, parameters=self.aruco_params)
+        return (corners, ids)
+
+    def detect(self, gray, shift=(0,0)):
+        """Returns (corners, ids) in the format of cv2.aruco.detectMarkers.
+        shift is the predicted image motion (dx,dy) in pixels since the
+        previous frame."""
+        if self.ids is None or self.frames_since_scan >= self.full_scan_interval:
+            result = self.scan(gray)
+        else:
+            self.frames_since_scan += 1
+            result = self.roi_detect(gray, shift)
+            if result[1] is None or len(result[1]) < len(self.ids):
+                # Lost a marker (or all of them): look everywhere.
+                result = self.scan(gray)
+        (self.corners, self.ids) = result
+        return result
+
+    def scan(self, gray):
+        self.full_scans += 1
+        self.frames_since_scan = 0
+        if self.detector:
+            return self.detector(gray)
+        return self.full_frame_detect(gray)
+
+    def predicted_rois(self, shape, shift):
+        (height, width) = shape[0:2]
+        rois = []
+        for corner in self.corners:
+            pts = corner.reshape(-1,2)
+            (x0, y0) = pts.min(axis=0) + shift
+            (x1, y1) = pts.max(axis=0) + shift
+            pad = max(self.min_padding, self.padding * max(x1-x0, y1-y0))
+            rois.append([max(0, int(x0-pad)), max(0, int(y0-pad)),
+                         min(width, int(x1+pad)+1), min(height, int(y1+pad)+1)])
+        # Merge overlapping boxes so no marker is detected twice.  A
+        # box that grows can overlap boxes already kept, so repeat
+        # until no two boxes overlap.
+        merged = [roi for roi in rois if roi[0] < roi[2] and roi[1] < roi[3]]  # drop boxes off image
+        changed = True
+        while changed:
+            changed = False
+            boxes = merged
+            merged = []
+            for roi in boxes:
+                for other in merged:
+                    if roi[0] < other[2] and other[0] < roi[2] and \
+                       roi[1] < other[3] and other[1] < roi[3]:
+                        other[0] = min(other[0],roi[0]); other[1] = min(other[1],roi[1])
+                        other[2] = max(other[2],roi[2]); other[3] = max(other[3],roi[3])
+                        changed = True
+                        break
+                else:
+                    merged.append(roi)
+        return merged
+
+    def roi_detect(self, gray, shift):
+        self.roi_scans += 1
+        all_corners = []
+        all_ids = []
+        for (x0, y0, x1, y1) in self.predicted_rois(gray.shape, shift):
+            (corners, ids) = self.full_frame_detect(gray[y0:y1, x0:x1])
+            if ids is None: continue
+            offset = array([x0, y0], dtype=corners[0].dtype)
+            all_corners += [corner + offset for corner in corners]
+            all_ids.append(ids)
+        if not all_ids:
+            return ([], None)
+        return (all_corners, concatenate(all_ids))
+
 class Aruco(object):
-    def __init__(self, robot, arucolibname, marker_size=50):
+    def __init__(self, robot, arucolibname, marker_size=50, roi_tracking=False):
+        self.robot = robot
         self.arucolibname = arucolibname
         self.aruco_lib = cv2.aruco.Dictionary_get(arucolibname)
         self.aruco_params = cv2.aruco.DetectorParameters_create()
@@ -48,6 +209,7 @@ class Aruco(object):
         self.seen_marker_objects = dict()
         self.ids = []
         self.corners = []
+        self.detection = ([], None)
 
         #added for pose estimation
         self.marker_size = marker_size #these units will be pose est units!!
@@ -59,31 +221,89 @@ class Aruco(object):
                          [0,             0,            1]]).astype(float)
         self.distortion_array = array([[0,0,0,0,0]]).astype(float)
 
+        self.tracker = MarkerTracker(self.aruco_lib, self.aruco_params) \
+                       if roi_tracking else None
+        self.last_heading = None
+        self.last_head_angle = None
+
+    def predicted_shift(self):
+        """Image motion in pixels due to body and head rotation since the
+        previous frame.  Turning left moves the scene right; raising the
+        head moves it down."""
+        heading = self.robot.pose.rotation.angle_z.radians
+        head_angle = self.robot.head_angle.radians
+        if self.last_heading is None:
+            shift = (0., 0.)
+        else:
+            dtheta = math.atan2(math.sin(heading - self.last_heading),
+                                math.cos(heading - self.last_heading))
+            shift = (self.camera_matrix[0,0] * dtheta,
+                     -self.camera_matrix[1,1] * (head_angle - self.last_head_angle))
+        self.last_heading = heading
+        self.last_head_angle = head_angle
+        return shift
+
     def process_image(self,gray):
-        self.seen_marker_ids = []
-        self.seen_marker_objects = dict()
-        (self.corners,self.ids,_) = \
-            cv2.aruco.detectMarkers(gray,self.aruco_lib,parameters=self.aruco_params)
-        if self.ids is None: return
-
-        # Estimate poses
-        # Warning: OpenCV 3.2 estimate returns a pair; 3.3 returns a triplet
-        estimate = \
-            cv2.aruco.estimatePoseSingleMarkers(self.corners,
-                                                self.marker_size,
-                                                self.camera_matrix,
-                                                self.distortion_array)
-
-        self.rvecs = estimate[0]
-        self.tvecs = estimate[1]
-        for i in range(len(self.ids)):
-            marker = ArucoMarker(self.ids[i][0], self.corners[i],self.tvecs[i][0],self.rvecs[i][0])
-            self.seen_marker_ids.append(marker.id)
-            self.seen_marker_objects[marker.id] = marker
+        # Results are built in locals and published at the end, so readers
+        # on other threads (see pipeline.py) never see a partial update.
+        seen_marker_ids = []
+        seen_marker_objects = dict()
+        if self.tracker:
+            (corners,ids) = self.tracker.detect(gray, self.predicted_shift())
+        else:
+            (corners,ids,_) = \
+                cv2.aruco.detectMarkers(gray,self.aruco_lib,parameters=self.aruco_params)
+        if ids is not None:
+            # Estimate poses
+            # Warning: OpenCV 3.2 estimate returns a pair; 3.3 returns a triplet
+            estimate = \
+                cv2.aruco.estimatePoseSingleMarkers(corners,
+                                                    self.marker_size,
+                                                    self.camera_matrix,
+                                                    self.distortion_array)
+
+            self.rvecs = estimate[0]
+            self.tvecs = estimate[1]
+            for i in range(len(ids)):
+                marker = ArucoMarker(ids[i][0], corners[i],self.tvecs[i][0],self.rvecs[i][0])
+                seen_marker_ids.append(marker.id)
+                seen_marker_objects[marker.id] = marker
+        self.detection = (corners, ids)
+        (self.corners, self.ids) = self.detection
+        self.seen_marker_objects = seen_marker_objects
+        self.seen_marker_ids = seen_marker_ids
+        if seen_marker_ids:
+            self.post_events(seen_marker_objects)
+
+    def post_events(self, markers):
+        """Post an ArucoEvent for each marker seen, if anyone is listening.
+        On the event loop, which is where process_image runs unless
+        pipelined_vision is on, the events are posted right away, while
+        this frame is being processed.  From a vision pipeline thread
+        they are handed to the event loop with call_soon_threadsafe and
+        posted on its next iteration."""
+        erouter = getattr(self.robot, 'erouter', None)
+        if erouter is None or not erouter.dispatch_table.get(ArucoEvent):
+            return
+        events = [ArucoEvent(marker) for marker in markers.values()]
+        try:
+            on_loop = asyncio.get_running_loop() is self.robot.loop
+        except RuntimeError:   # no loop running in this thread
+            on_loop = False
+        if on_loop:
+            self._post_events(erouter, events)
+        else:
+            self.robot.loop.call_soon_threadsafe(self._post_events, erouter, events)
+
+    @staticmethod
+    def _post_events(erouter, events):
+        for event in events:
+            erouter.post(event)
 
     def annotate(self, image, scale_factor):
-        scaled_corners = [ multiply(corner, scale_factor) for corner in self.corners ]
-        displayim = cv2.aruco.drawDetectedMarkers(image, scaled_corners, self.ids)
+        (corners, ids) = self.detection
+        scaled_corners = [ multiply(corner, scale_factor) for corner in corners ]
+        displayim = cv2.aruco.drawDetectedMarkers(image, scaled_corners, ids)
 
         #add poses #currently fails since image is already scaled. How to scale camMat?
         #if(self.ids is not None):
@@ -7,20 +7,35 @@
 
 import cozmo
 
+from . import evbase
 from .trace import TRACE
+from .instrument import INSTR
 from .evbase import Event, EventListener
 from .events import CompletionEvent, SuccessEvent, FailureEvent, DataEvent
 
 class StateNode(EventListener):
     """Base class for state nodes; does nothing."""
+
+    # Set by genfsm on classes with a $setup block: the names of the
+    # event classes the child state machine's transitions listen for.
+    fsm_events = ()
+
+    # If true, setup() and setup2() run when the node is first started
+    # instead of when it's constructed, so the child machines of
+    # branches that never run are never built.  The machine is kept
+    # and reused on later starts.  Code that touches self.children
+    # before calling super().start() should call ensure_setup() first.
+    lazy_setup = False
+
     def __init__(self):
         super().__init__()
         self.parent = None
         self.children = {}
         self.transitions = []
         self.start_node = None
-        self.setup()
-        self.setup2()
+        self.setup_done = False
+        if not self.lazy_setup:
+            self.ensure_setup()
 
     # Cache 'robot' in the instance because we could have two state
     # machine instances controlling different robots.
@@ -36,11 +51,34 @@ class StateNode(EventListener):
         """Redefine this if post-setup processing is required."""
         pass
 
+    def ensure_setup(self):
+        """Build the child state machine if it hasn't been built yet."""
+        if self.setup_done: return
+        self.setup_done = True
+        # Children built now belong to this node's robot.
+        saved_robot = evbase.robot_for_loading
+        evbase.robot_for_loading = self._robot
+        try:
+            self.setup()
+            self.setup2()
+        finally:
+            evbase.robot_for_loading = saved_robot
+
     def start(self,event=None):
         if self.running: return
+        if not self.setup_done:
+            self.ensure_setup()
         if TRACE.trace_level >= TRACE.statenode_start:
             print('TRACE%d:' % TRACE.statenode_start, self, 'starting')
+        if INSTR.enabled:
+            INSTR.node_started(self)
         super().start()
+        if self.fsm_events:
+            # Keep the dispatch entries for the events our child
+            # transitions use while we run, rather than creating them
+            # on every state change.  Released in stop().
+            erouter = self.robot.erouter
+            erouter.preregister(erouter.classes_for_names(self.fsm_events))
         # Start transitions before children, because children
         # may post an event that we're listening for (such as completion).
         for t in self.transitions:
@@ -59,11 +97,26 @@ class StateNode(EventListener):
                 print('TRACE%d:' % TRACE.statenode_startstop, self, 'stopping')
             super().stop()
             self.stop_children()
+            if self.fsm_events:
+                erouter = self.robot.erouter
+                erouter.release(erouter.classes_for_names(self.fsm_events))
+            if INSTR.enabled:
+                INSTR.node_stopped(self)
         # Stop transitions even if we're not running, because a firing
         # transition could have stopped us and left a fire2 pending.
         for t in self.transitions:
             t.stop()
 
+    def has_action_to_cancel(self):
+        """True if stopping this node cancels a robot action or motion.
+        Transitions then give the cancellation time to take effect
+        before starting their destinations.  Pure logic nodes return
+        False unless a running child has something to cancel."""
+        for child in self.children.values():
+            if child.running and child.has_action_to_cancel():
+                return True
+        return False
+
     def stop_children(self):
         if self.children == {}:
             return
@@ -135,6 +188,13 @@ class StateNode(EventListener):
 
 class Transition(EventListener):
     """Base class for transitions: does nothing."""
+
+    # Wait this long for source node action cancellations to take effect.
+    action_cancel_delay = 0.01
+    # If False, always wait action_cancel_delay, even when no source
+    # node has an action to cancel.
+    zero_delay_firing = True
+
     def __init__(self):
         super().__init__()
         self.sources = []
@@ -201,7 +261,8 @@ class Transition(EventListener):
     def fire(self,event=None):
         """Shut down source nodes and schedule start of destination nodes.
         Lets the stack unwind by returning before destinations are started.
-        Delay also gives time for Cozmo action cancellation to take effect."""
+        If a source node has an action to cancel, delays the start to give
+        the cancellation time to take effect."""
         if not self.running: return
         if TRACE.trace_level >= TRACE.transition_fire:
             if event == None:
@@ -209,15 +270,23 @@ class Transition(EventListener):
             else:
                 evt_desc = ' on %s' % event
             print('TRACE%d:' % TRACE.transition_fire, self, 'firing'+evt_desc)
+        if INSTR.enabled:
+            INSTR.transition_fired(self)
+        delay = not self.zero_delay_firing or \
+                any(src.running and src.has_action_to_cancel() for src in self.sources)
         for src in self.sources:
             src.stop()
         self.stop()
-        action_cancel_delay = 0.01  # wait for source node action cancellations to take effect
-        self.handle = self.robot.loop.call_later(action_cancel_delay, self.fire2, event)
+        if delay:
+            self.handle = self.robot.loop.call_later(self.action_cancel_delay, self.fire2, event)
+        else:
+            self.handle = self.robot.loop.call_soon(self.fire2, event)
 
     def fire2(self,event):
         if not self.handle:
             print('@ @ @ @ @ HANDLE GONE: I SHOULD BE DEAD', self, event)
+        if INSTR.enabled:
+            INSTR.transition_fired2(self)
         for dest in self.destinations:
             if TRACE.trace_level >= TRACE.transition_fire:
                 print('TRACE%d: ' % TRACE.transition_fire, self, 'starting', dest)
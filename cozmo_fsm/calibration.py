@@ -0,0 +1,122 @@
+"""
+Camera calibrations for perched cameras.
+
+A CalibrationRegistry maps camera ids (the values given to
+cv2.VideoCapture) to CameraCalibration objects, so cameras of different
+models can be mixed.  Calibrations can be loaded from OpenCV
+FileStorage files (.yml, .yaml, .xml, as written by OpenCV's
+calibration sample) or from .npz files.
+"""
+
+import os
+import re
+import numpy as np
+import cv2
+
+class CameraCalibration():
+    def __init__(self, camera_matrix, dist_coeffs, name=None):
+        self.camera_matrix = np.array(camera_matrix, dtype=float)
+        self.dist_coeffs = np.array(dist_coeffs, dtype=float).reshape(-1)
+        self.name = name
+        self.zero_distortion = np.zeros(5)
+        self.maps = dict()   # image size -> undistortion maps
+
+    def __repr__(self):
+        return '<CameraCalibration %s f=(%.1f,%.1f)>' % \
+               (self.name, self.camera_matrix[0,0], self.camera_matrix[1,1])
+
+    def undistort_maps(self, image_size):
+        """Undistortion maps for full-frame remapping, computed once per
+        image size.  image_size is (width, height)."""
+        maps = self.maps.get(image_size)
+        if maps is None:
+            maps = cv2.initUndistortRectifyMap(self.camera_matrix, self.dist_coeffs,
+                                               None, self.camera_matrix,
+                                               image_size, cv2.CV_16SC2)
+            self.maps[image_size] = maps
+        return maps
+
+    def undistort_image(self, image):
+        (map1, map2) = self.undistort_maps((image.shape[1], image.shape[0]))
+        return cv2.remap(image, map1, map2, cv2.INTER_LINEAR)
+
+    def undistort_corners(self, corners):
+        """Undistort marker corners only, keeping pixel coordinates.  The
+        results can be used with zero_distortion for pose estimation.
+        Note: undistortPoints ignores the skew term of the camera matrix;
+        for the Microsoft webcam's skew of -3 that shifts poses by ~0.2%."""
+        if len(corners) == 0:
+            return corners
+        pts = np.concatenate([c.reshape(-1,1,2) for c in corners]).astype(np.float32)
+        pts = cv2.undistortPoints(pts, self.camera_matrix, self.dist_coeffs,
+                                  P=self.camera_matrix)
+        return [pts[4*i:4*i+4].reshape(1,4,2) for i in range(len(corners))]
+
+    @staticmethod
+    def load(filename):
+        if filename.endswith('.npz'):
+            data = np.load(filename)
+            return CameraCalibration(data['camera_matrix'], data['dist_coeffs'],
+                                     name=os.path.basename(filename))
+        fs = cv2.FileStorage(filename, cv2.FILE_STORAGE_READ)
+        if not fs.isOpened():
+            raise IOError("Can't read calibration file %s" % filename)
+        try:
+            camera_matrix = fs.getNode('camera_matrix').mat()
+            dist_coeffs = fs.getNode('distortion_coefficients').mat()
+        finally:
+            fs.release()
+        if camera_matrix is None or dist_coeffs is None:
+            raise ValueError('%s lacks camera_matrix or distortion_coefficients' % filename)
+        return CameraCalibration(camera_matrix, dist_coeffs, name=os.path.basename(filename))
+
+    def save(self, filename):
+        if filename.endswith('.npz'):
+            np.savez(filename, camera_matrix=self.camera_matrix, dist_coeffs=self.dist_coeffs)
+            return
+        fs = cv2.FileStorage(filename, cv2.FILE_STORAGE_WRITE)
+        fs.write('camera_matrix', self.camera_matrix)
+        fs.write('distortion_coefficients', self.dist_coeffs)
+        fs.release()
+
+# Microsoft HD ( Calibrated to death )
+microsoft_HD_webcam_cameraMatrix = np.array([[1148.00,       -3,    641.0],
+                                             [0.000000,   1145.0,    371.0],
+                                             [0.000000, 0.000000, 1.000000]])
+microsoft_HD_webcam_distCoeffs = np.array([0.211679, -0.179776, 0.041896, 0.040334, 0.000000])
+
+microsoft_HD_webcam = CameraCalibration(microsoft_HD_webcam_cameraMatrix,
+                                        microsoft_HD_webcam_distCoeffs,
+                                        name='Microsoft HD webcam')
+
+class CalibrationRegistry():
+    """Camera id -> CameraCalibration, with a default for unregistered cameras."""
+    file_pattern = re.compile(r'^camera[-_]?(.+)\.(yml|yaml|xml|npz)$')
+
+    def __init__(self, default=microsoft_HD_webcam):
+        self.default = default
+        self.calibrations = dict()
+
+    def __repr__(self):
+        return '<CalibrationRegistry %s default=%s>' % \
+               (dict(self.calibrations), self.default)
+
+    def register(self, camera_id, calibration):
+        if not isinstance(calibration, CameraCalibration):
+            calibration = CameraCalibration.load(calibration)
+        self.calibrations[camera_id] = calibration
+        return calibration
+
+    def load_directory(self, dirname):
+        """Register every file named camera<id>.yml (or .yaml, .xml, .npz).
+        Numeric ids are converted to ints to match cv2.VideoCapture indices."""
+        for filename in sorted(os.listdir(dirname)):
+            match = self.file_pattern.match(filename)
+            if not match: continue
+            camera_id = match.group(1)
+            if camera_id.isdigit():
+                camera_id = int(camera_id)
+            self.register(camera_id, os.path.join(dirname, filename))
+
+    def get(self, camera_id):
+        return self.calibrations.get(camera_id, self.default)
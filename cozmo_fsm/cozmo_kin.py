@@ -22,7 +22,8 @@ class CozmoKinematics(Kinematics):
         cor_frame = Joint('cor', parent=base_frame, r=-19.)
 
         # Use link instead of joint for world_frame
-        world_frame = Joint('world', parent=base_frame, type='world', getter=self.get_world)
+        world_frame = Joint('world', parent=base_frame, type='world',
+                            getter=self.get_world, source=self.world_source)
 
         front_axle_frame = Joint('front_axle', parent=base_frame, alpha=pi/2)
         back_axle_frame = Joint('back_axle', parent=base_frame, r=-46., alpha=pi/2)
@@ -32,10 +33,10 @@ class CozmoKinematics(Kinematics):
         # x is forward, y points up.
         shoulder_frame = Joint('shoulder', parent=base_frame,
                                type='revolute', getter=self.get_shoulder,
-                               d=21., r=-39., alpha=pi/2)
+                               source=self.lift_source, d=21., r=-39., alpha=pi/2)
         lift_attach_frame = \
             Joint('lift_attach', parent=shoulder_frame, type='revolute',
-                  getter=self.get_lift_attach, r=66.,
+                  getter=self.get_lift_attach, source=self.lift_source, r=66.,
                   collision_model=Circle(transform.point(), radius=10))
 
         # Positive head angle is up, so z must point to the right.
@@ -69,5 +70,12 @@ class CozmoKinematics(Kinematics):
     def get_lift_attach(self):
         return -self.get_shoulder()
 
+    def lift_source(self):
+        return self.robot.lift_height.distance_mm
+
     def get_world(self):
-        return self.robot.world.particle_filter.pose_estimate()
+        return self.robot.world.particle_filter.current_pose()
+
+    def world_source(self):
+        pf = self.robot.world.particle_filter
+        return (pf, pf.pose_version)
@@ -12,6 +12,8 @@ from time import sleep
 from math import sin, cos, atan2, pi, sqrt
 
 class GoToWall(StateNode):
+    lazy_setup = True
+
     def __init__(self, wall=-1, door=-1):
         super().__init__()
         self.object = wall
@@ -79,7 +81,7 @@ class GoToWall(StateNode):
             wall = self.parent.object
             wobj = self.parent.wobj
             (x, y, ang) = self.parent.pick_side(150)
-            dtheta = wrap_angle(ang - self.robot.world.particle_filter.pose_estimate()[2])
+            dtheta = wrap_angle(ang - self.robot.world.particle_filter.current_pose()[2])
             if abs(dtheta) > 0.1:
                 self.angle = Angle(dtheta)
                 super().start(event)
@@ -254,7 +256,7 @@ class GoToWall(StateNode):
             end: SetHeadAngle(0) =C=> Forward(150) =C=> ParentCompletes()
         """
         
-        # Code generated by genfsm on Sun Nov 19 18:38:12 2017:
+        # Code generated by genfsm on Sun Oct 18 23:55:01 2026:
         
         droplift = SetLiftHeight(0) .set_name("droplift") .set_parent(self)
         check_start = PilotCheckStart() .set_name("check_start") .set_parent(self)
@@ -371,8 +373,12 @@ class GoToWall(StateNode):
         
         return self
 
+    fsm_events = ('CompletionEvent', 'FailureEvent', 'SuccessEvent')
+
 class Explore(StateNode):
 
+    lazy_setup = True
+
     def __init__(self):
         self.current_wall = None
         self.to_do_wall = []
@@ -382,8 +388,8 @@ class Explore(StateNode):
     class Think(StateNode):
         def start(self,event=None):
             super().start(event)
-            for key, val in self.robot.world.world_map.objects.items():
-                if isinstance(val,WallObj) and val.id not in self.parent.done_wall and val.id not in self.parent.to_do_wall:
+            for val in self.robot.world.world_map.objects.of_type(WallObj):
+                if val.id not in self.parent.done_wall and val.id not in self.parent.to_do_wall:
                     self.parent.to_do_wall.append(val)
                     print(val.id)
 
@@ -419,7 +425,7 @@ class Explore(StateNode):
             end: Say("Done") =C=> ParentCompletes()
         """
         
-        # Code generated by genfsm on Sun Nov 19 18:38:12 2017:
+        # Code generated by genfsm on Sun Oct 18 23:55:01 2026:
         
         look = LookAroundInPlace(stop_on_exit=False) .set_name("look") .set_parent(self)
         stopbehavior1 = StopBehavior() .set_name("stopbehavior1") .set_parent(self)
@@ -448,6 +454,8 @@ class Explore(StateNode):
         
         return self
 
+    fsm_events = ('CompletionEvent', 'FailureEvent', 'SuccessEvent')
+
 class WarmUp(StateNode):
 
     def __init__(self):
@@ -460,7 +468,7 @@ class WarmUp(StateNode):
             end:  ParentCompletes()
         """
         
-        # Code generated by genfsm on Sun Nov 19 18:38:12 2017:
+        # Code generated by genfsm on Sun Oct 18 23:55:01 2026:
         
         start = Forward(100) .set_name("start") .set_parent(self)
         forward5 = Forward(-100) .set_name("forward5") .set_parent(self)
@@ -474,9 +482,13 @@ class WarmUp(StateNode):
         
         return self
 
+    fsm_events = ('CompletionEvent',)
+
 
 class GoToRobot(StateNode):
 
+    lazy_setup = True
+
     def __init__(self, gname=-1):
         super().__init__()
         self.gname = 'Foreign-'+str(gname)
@@ -553,7 +565,7 @@ class GoToRobot(StateNode):
             end: ParentCompletes()
         """
         
-        # Code generated by genfsm on Sun Nov 19 18:38:12 2017:
+        # Code generated by genfsm on Sun Oct 18 23:55:01 2026:
         
         check_start = PilotCheckStart() .set_name("check_start") .set_parent(self)
         setheadangle2 = SetHeadAngle(0) .set_name("setheadangle2") .set_parent(self)
@@ -594,9 +606,13 @@ class GoToRobot(StateNode):
         
         return self
 
+    fsm_events = ('CompletionEvent', 'FailureEvent', 'SuccessEvent')
+
 
 class WallPilotToPose(StateNode):
 
+    lazy_setup = True
+
     def __init__(self,target_pose):
         self.target_pose = target_pose
         self.next_wall = None
@@ -616,26 +632,25 @@ class WallPilotToPose(StateNode):
             mp = (yd-yr)/(xd-xr)
             cp = -xr*mp +yr
 
-            for key, val in self.robot.world.world_map.objects.items():
-                if isinstance(val,WallObj):
-                    x = val.x
-                    y = val.y
-                    m = tan(val.theta + pi/2)
-                    c = -x*m + y
+            for val in self.robot.world.world_map.objects.of_type(WallObj):
+                x = val.x
+                y = val.y
+                m = tan(val.theta + pi/2)
+                c = -x*m + y
 
-                    s1 = m*xr + c - yr
-                    s2 = m*xd + c - yd
-                    if abs(s1)/s1 == abs(s2)/s2:
-                        continue
+                s1 = m*xr + c - yr
+                s2 = m*xd + c - yd
+                if abs(s1)/s1 == abs(s2)/s2:
+                    continue
 
-                    xi = (cp-c)/(m-mp)
-                    yi = m*xi + c
+                xi = (cp-c)/(m-mp)
+                yi = m*xi + c
 
-                    distance = sqrt((x-xi)**2+(y-yi)**2)
+                distance = sqrt((x-xi)**2+(y-yi)**2)
 
-                    if distance < val.length/2 + tolerence:
-                        block_walls.append((sqrt((x-xr)**2+(y-yr)**2),val))
-                        print("Added",val)
+                if distance < val.length/2 + tolerence:
+                    block_walls.append((sqrt((x-xr)**2+(y-yr)**2),val))
+                    print("Added",val)
             if len(block_walls) > 0:
                 self.parent.next_wall = int(sorted(block_walls)[0][1].id)
                 self.post_success()
@@ -651,7 +666,7 @@ class WallPilotToPose(StateNode):
             xd = self.parent.target_pose.position.x
             yd = self.parent.target_pose.position.y
 
-            dtheta = wrap_angle(arctan2(yd,xd)- self.robot.world.particle_filter.pose_estimate()[2])
+            dtheta = wrap_angle(arctan2(yd,xd)- self.robot.world.particle_filter.current_pose()[2])
             if abs(dtheta) > 0.1:
                 self.angle = Angle(dtheta)
                 super().start(event)
@@ -691,7 +706,7 @@ class WallPilotToPose(StateNode):
             end: self.Fin() =C=> ParentCompletes()
         """
         
-        # Code generated by genfsm on Sun Nov 19 18:38:12 2017:
+        # Code generated by genfsm on Sun Oct 18 23:55:01 2026:
         
         look = self.TurnToGoal() .set_name("look") .set_parent(self)
         lookaroundinplace1 = LookAroundInPlace(stop_on_exit=False) .set_name("lookaroundinplace1") .set_parent(self)
@@ -723,3 +738,5 @@ class WallPilotToPose(StateNode):
         completiontrans36 .add_sources(end) .add_destinations(parentcompletes3)
         
         return self
+
+    fsm_events = ('CompletionEvent', 'FailureEvent', 'SuccessEvent')
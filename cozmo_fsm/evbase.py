@@ -7,10 +7,15 @@
 """
 
 import functools
+import heapq
+import math
+import time
+from collections import deque
 
 import cozmo
 
 from .trace import TRACE
+from .instrument import INSTR, Histogram
 
 #________________ Event base class ________________
 
@@ -32,10 +37,64 @@ class Event:
 
 #________________ Event Router ________________
 
+def event_classes_by_name():
+    """Map class names to Event subclasses, including nested ones such
+    as Say.SayDataEvent."""
+    result = dict()
+    classes = [Event]
+    while classes:
+        cls = classes.pop()
+        result.setdefault(cls.__name__, cls)
+        classes.extend(cls.__subclasses__())
+    return result
+
+class DeliveryStats:
+    """Event delivery metrics kept by the EventRouter."""
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.events_posted = 0
+        self.events_delivered = 0
+        self.handler_calls = 0
+        self.ticks = 0
+        self.max_pending = 0
+        self.busy_time = 0.      # time spent running handlers
+        self.total_latency = 0.  # sum of post-to-delivery delays
+        self.max_latency = 0.
+
+    def __repr__(self):
+        return '<DeliveryStats %d events, %d handler calls in %d ticks>' % \
+               (self.events_delivered, self.handler_calls, self.ticks)
+
+    @property
+    def mean_latency(self):
+        return self.total_latency / max(1, self.events_delivered)
+
+    @property
+    def throughput(self):
+        """Events delivered per second of delivery time."""
+        return self.events_delivered / self.busy_time if self.busy_time > 0 else 0.
+
+    def report(self):
+        print('%d events posted, %d delivered in %d ticks (%d handler calls)' %
+              (self.events_posted, self.events_delivered, self.ticks, self.handler_calls))
+        print('latency: mean %.3f ms, max %.3f ms;  max pending %d;  throughput %.0f events/sec' %
+              (1000*self.mean_latency, 1000*self.max_latency, self.max_pending, self.throughput))
+
 class EventRouter:
     """An event router drives the state machine."""
+
+    # Limit on cached (event_class, source) dispatch entries.
+    max_cache_entries = 16384
+
+    # Events delivered per event loop tick; the rest wait for the next
+    # tick so a burst of events can't starve other loop callbacks.
+    max_events_per_tick = 100
+
     def __init__(self):
-        # dispatch_table: event_class -> (source,listener)...
+        # dispatch_table: event_class -> source -> {handler: True}
+        # (dicts keep handlers in registration order and allow O(1) removal)
         self.dispatch_table = dict()
         # listener_registry: listener -> (event_class, source)...
         self.listener_registry = dict()
@@ -43,63 +102,120 @@ class EventRouter:
         self.wildcard_registry = dict()
         # event generator objects
         self.event_generators = dict()
+        # preregistered: event_class -> count of running machines that
+        # keep its dispatch entry even when it has no listeners
+        self.preregistered = dict()
+        # event_names: tuple of event class names -> tuple of classes
+        self.event_names = dict()
+        # dispatch_cache: event_class -> source -> tuple of handlers, built on demand
+        self.dispatch_cache = dict()
+        self.cache_entries = 0
+        # pending deliveries: (handlers, event, post_time)
+        self.pending = deque()
+        self.delivery_scheduled = False
+        self.delivery_stats = DeliveryStats()
+        self.poll_scheduler = PollScheduler(self)
+
+    def _add_event_class(self, event_class):
+        """Create the dispatch table entry for event_class, starting a
+        cozmo event handler if this event type requires one."""
+        source_dict = dict()
+        if event_class.cozmo_evt_type:
+            coztype = event_class.cozmo_evt_type
+            if not issubclass(coztype, cozmo.event.Event):
+                raise ValueError('%s cozmo_evt_type %s not a subclass of cozmo.event.Event' % (event_class, coztype))
+            world = self.robot.world
+            # supply the erouter and event type
+            gen = functools.partial(event_class.generator, self, event_class)
+            self.event_generators[event_class] = gen
+            world.add_event_handler(coztype,gen)
+        self.dispatch_table[event_class] = source_dict
+        return source_dict
+
+    def _remove_event_class(self, event_class):
+        """Delete the dispatch table entry for event_class and its cozmo
+        event handler, if there was one."""
+        del self.dispatch_table[event_class]
+        if event_class.cozmo_evt_type:
+            coztype = event_class.cozmo_evt_type
+            world = self.robot.world
+            gen = self.event_generators.pop(event_class)
+            world.remove_event_handler(coztype, gen)
+
+    def preregister(self, event_classes):
+        """Create dispatch table entries and cozmo event handlers for
+        event_classes now, and keep them when their last listener is
+        removed, so entering and leaving states doesn't repeatedly
+        subscribe to and unsubscribe from SDK events.  Each call must
+        be matched by a call to release()."""
+        for event_class in event_classes:
+            if not issubclass(event_class, Event):
+                raise TypeError('%s is not an Event' % event_class)
+            if event_class not in self.dispatch_table:
+                self._add_event_class(event_class)
+            self.preregistered[event_class] = self.preregistered.get(event_class, 0) + 1
+
+    def release(self, event_classes):
+        """Undo a preregister() call.  Entries that are no longer
+        preregistered and have no listeners are removed."""
+        for event_class in event_classes:
+            count = self.preregistered.get(event_class, 0) - 1
+            if count > 0:
+                self.preregistered[event_class] = count
+                continue
+            self.preregistered.pop(event_class, None)
+            if self.dispatch_table.get(event_class) == {}:
+                self._remove_event_class(event_class)
+
+    def classes_for_names(self, names):
+        """The Event subclasses named in names (a state machine class's
+        fsm_events attribute), looked up once per tuple."""
+        classes = self.event_names.get(names)
+        if classes is None:
+            by_name = event_classes_by_name()
+            classes = tuple(by_name[name] for name in names if name in by_name)
+            self.event_names[names] = classes
+        return classes
 
     def add_listener(self, listener, event_class, source):
         if not issubclass(event_class, Event):
-            raise TypeError('% is not an Event' % event_type)
+            raise TypeError('%s is not an Event' % event_class)
         source_dict = self.dispatch_table.get(event_class)
         if source_dict is None:
-            source_dict = dict()
-            # start a cozmo event handler if this event type requires one
-            if event_class.cozmo_evt_type:
-                coztype = event_class.cozmo_evt_type
-                if not issubclass(coztype, cozmo.event.Event):
-                    raise ValueError('%s cozmo_evt_type %s not a subclass of cozmo.event.Event' % (event_type, coztype))
-                world = self.robot.world
-                # supply the erouter and event type
-                gen = functools.partial(event_class.generator, self, event_class)
-                self.event_generators[event_class] = gen
-                world.add_event_handler(coztype,gen)                                
-        handlers = source_dict.get(source, [])
-        handlers.append(listener.handle_event)
-        source_dict[source] = handlers
-        self.dispatch_table[event_class] = source_dict
+            source_dict = self._add_event_class(event_class)
+        handlers = source_dict.get(source)
+        if handlers is None:
+            handlers = dict()
+            source_dict[source] = handlers
+        handlers[listener.handle_event] = True
         reg_entry = self.listener_registry.get(listener,[])
         reg_entry.append((event_class,source))
         self.listener_registry[listener] = reg_entry
+        self._invalidate(event_class, source)
 
     # Transitions like =Hear('\w')=> must use None as a source because
     # they do the matching themselves instead of relying on the event
     # router. So to distinguish a wildcard =Hear=> transition from
     # all the other Hear transitions, we must register it specially.
     def add_wildcard_listener(self, listener, event_class, source):
-        self.add_listener(listener, event_class, source)
         self.wildcard_registry[listener.handle_event] = True
+        self.add_listener(listener, event_class, source)
 
     def remove_listener(self, listener, event_class, source):
-        try:
-            del self.wildcard_registry[listener.handle_event]
-        except: pass
         if not issubclass(event_class, Event):
-            raise TypeError('% is not an Event' % event_class)
+            raise TypeError('%s is not an Event' % event_class)
+        self.wildcard_registry.pop(listener.handle_event, None)
         source_dict = self.dispatch_table.get(event_class)
         if source_dict is None: return
         handlers = source_dict.get(source)
         if handlers is None: return
-        try:
-            handlers.remove(listener.handle_event)
-        except: pass
-        if handlers == []:
+        handlers.pop(listener.handle_event, None)
+        self._invalidate(event_class, source)
+        if len(handlers) == 0:
             del source_dict[source]
-        if len(source_dict) == 0:   # no one listening for this event
-            del self.dispatch_table[event_class]
-            # remove the cozmo SDK event handler if there was one
-            if event_class.cozmo_evt_type:
-                coztype = event_class.cozmo_evt_type
-                world = self.robot.world
-                gen = self.event_generators[event_class]
-                world.remove_event_handler(coztype, gen)
-                del self.event_generators[event_class]
+        if len(source_dict) == 0 and event_class not in self.preregistered:
+            # no one listening for this event
+            self._remove_event_class(event_class)
 
     def remove_all_listener_entries(self, listener):
         for event_class, source in self.listener_registry.get(listener,[]):
@@ -108,36 +224,231 @@ class EventRouter:
             del self.listener_registry[listener]
         except: pass
 
-    def _get_listeners(self,event):
-        source_dict = self.dispatch_table.get(type(event), None)
-        if source_dict is None:  # no listeners for this event type
-            return []
-        matches = source_dict.get(event.source, [])
-        if event.source is None:
-            none_matches = matches
-            matches = []
-        else:
-            none_matches = source_dict.get(None, [])
+    def _invalidate(self, event_class, source):
+        """Drop cached dispatch entries affected by a change to
+        (event_class, source), including those for event subclasses."""
+        for cached_class in list(self.dispatch_cache):
+            if not issubclass(cached_class, event_class): continue
+            if source is None:
+                self.cache_entries -= len(self.dispatch_cache[cached_class])
+                del self.dispatch_cache[cached_class]
+            elif self.dispatch_cache[cached_class].pop(source, None) is not None:
+                self.cache_entries -= 1
+
+    def _build_listeners(self, event_class, source):
+        """Handlers for an event: those registered for its source, then
+        those registered for source None, then wildcards.  Handlers for
+        an event's base classes are included as well."""
+        matches = []
+        none_matches = []
         wildcards = []
-        for handler in none_matches:
-            if self.wildcard_registry.get(handler,False) is True:
-                wildcards.append(handler)
-            else:
-                matches.append(handler)
+        for cls in event_class.__mro__:
+            source_dict = self.dispatch_table.get(cls)
+            if source_dict is None: continue
+            if source is not None:
+                matches.extend(source_dict.get(source, ()))
+            for handler in source_dict.get(None, ()):
+                if handler in self.wildcard_registry:
+                    wildcards.append(handler)
+                else:
+                    none_matches.append(handler)
         # wildcard handlers must come last in the list
-        return matches + wildcards
+        return tuple(matches + none_matches + wildcards)
+
+    def _get_listeners(self,event):
+        event_class = type(event)
+        source = event.source
+        try:
+            return self.dispatch_cache[event_class][source]
+        except KeyError:
+            pass
+        listeners = self._build_listeners(event_class, source)
+        if self.cache_entries >= self.max_cache_entries:
+            self.dispatch_cache.clear()
+            self.cache_entries = 0
+        self.dispatch_cache.setdefault(event_class, dict())[source] = listeners
+        self.cache_entries += 1
+        return listeners
 
     def post(self,event):
         if not isinstance(event,Event):
             raise TypeError('%s is not an Event' % event)
         listeners = self._get_listeners(event)
-        cnt = 0
-        for listener in listeners:
-            cnt += 1
-            if TRACE.trace_level >= TRACE.listener_invocation:
-                print('TRACE%d:' % TRACE.listener_invocation, listener.__class__, 'receiving', event)
-            self.robot.loop.call_soon(listener,event)
-    
+        if not listeners: return
+        self.pending.append((listeners, event, time.perf_counter()))
+        self.delivery_stats.events_posted += 1
+        if len(self.pending) > self.delivery_stats.max_pending:
+            self.delivery_stats.max_pending = len(self.pending)
+        if not self.delivery_scheduled:
+            self.delivery_scheduled = True
+            self.robot.loop.call_soon(self._deliver)
+
+    def _deliver(self):
+        """Deliver pending events in order, in a single loop callback.
+        Events posted by the handlers are delivered on the next tick,
+        as they were when each handler had its own call_soon."""
+        self.delivery_scheduled = False
+        stats = self.delivery_stats
+        count = len(self.pending)
+        if self.max_events_per_tick:
+            count = min(count, self.max_events_per_tick)
+        start = time.perf_counter()
+        for i in range(count):
+            (listeners, event, post_time) = self.pending.popleft()
+            latency = start - post_time
+            stats.total_latency += latency
+            if latency > stats.max_latency:
+                stats.max_latency = latency
+            if INSTR.enabled:
+                name = event.__class__.__name__
+                INSTR.record('event', name, name, post_time, latency)
+            for listener in listeners:
+                if TRACE.trace_level >= TRACE.listener_invocation:
+                    print('TRACE%d:' % TRACE.listener_invocation, listener.__class__, 'receiving', event)
+                try:
+                    listener(event)
+                except Exception as exc:
+                    self.robot.loop.call_exception_handler({
+                        'message' : 'Exception in event handler %s for %s' % (listener, event),
+                        'exception' : exc })
+            stats.handler_calls += len(listeners)
+        stats.events_delivered += count
+        stats.ticks += 1
+        stats.busy_time += time.perf_counter() - start
+        if self.pending and not self.delivery_scheduled:
+            self.delivery_scheduled = True
+            self.robot.loop.call_soon(self._deliver)
+
+#________________ Poll Scheduler ________________
+
+class PollEntry:
+    """A listener's place in the PollScheduler.  Serves as the listener's
+    poll_handle; cancel() stops further polling."""
+    __slots__ = ('listener', 'deadline', 'cancelled')
+
+    def __init__(self, listener, deadline):
+        self.listener = listener
+        self.deadline = deadline
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+class PollStats(Histogram):
+    """Poll timing for one listener class: a duration histogram plus
+    deadline statistics."""
+    def __init__(self):
+        super().__init__()
+        self.missed = 0
+        self.max_lateness = 0.
+
+    def record(self, duration, lateness, missed):
+        self.add(duration)
+        if lateness > self.max_lateness:
+            self.max_lateness = lateness
+        if missed:
+            self.missed += 1
+
+class PollScheduler:
+    """Runs the poll() methods of all polling listeners from a single
+    event loop timer.  Deadlines are rounded up to the next multiple of
+    quantum, so pollers that come due together run in one pass, and a
+    poller never runs before its deadline.  Deadlines advance by the
+    polling interval, so rounding doesn't accumulate into drift.  If a
+    poll runs so late that its next deadline has already passed, that
+    deadline counts as missed and is skipped rather than run twice."""
+
+    quantum = 0.005   # seconds
+
+    def __init__(self, erouter):
+        self.erouter = erouter
+        self.buckets = dict()   # tick number -> [PollEntry...]
+        self.ticks = []         # heap of tick numbers that have buckets
+        self.timer_tick = None  # tick the loop timer is set for
+        self.timer_handle = None
+        self.stats = dict()     # listener class name -> PollStats
+        self.passes = 0
+
+    def __repr__(self):
+        return '<PollScheduler %d pollers in %d buckets>' % \
+               (sum(len(b) for b in self.buckets.values()), len(self.buckets))
+
+    def schedule(self, listener, delay=None):
+        loop = self.erouter.robot.loop
+        if delay is None:
+            delay = listener.polling_interval
+        entry = PollEntry(listener, loop.time() + delay)
+        self._insert(entry)
+        return entry
+
+    def _insert(self, entry):
+        tick = math.ceil(entry.deadline / self.quantum)
+        bucket = self.buckets.get(tick)
+        if bucket is None:
+            self.buckets[tick] = [entry]
+            heapq.heappush(self.ticks, tick)
+        else:
+            bucket.append(entry)
+        if self.timer_tick is None or tick < self.timer_tick:
+            self._set_timer(tick)
+
+    def _set_timer(self, tick):
+        if self.timer_handle:
+            self.timer_handle.cancel()
+        self.timer_tick = tick
+        self.timer_handle = \
+            self.erouter.robot.loop.call_at(tick * self.quantum, self._run)
+
+    def _run(self):
+        self.timer_tick = None
+        self.timer_handle = None
+        loop = self.erouter.robot.loop
+        now = loop.time()
+        due = []
+        while self.ticks and self.ticks[0] * self.quantum <= now:
+            due.extend(self.buckets.pop(heapq.heappop(self.ticks)))
+        self.passes += 1
+        for entry in due:
+            if entry.cancelled: continue
+            listener = entry.listener
+            if not (listener.running and listener.polling_interval):
+                entry.cancelled = True
+                continue
+            lateness = now - entry.deadline
+            # schedule the next poll first because poll() may cancel it
+            entry.deadline += listener.polling_interval
+            missed = entry.deadline <= now
+            if missed:
+                entry.deadline = now + listener.polling_interval
+            self._insert(entry)
+            start = time.perf_counter()
+            try:
+                listener.poll()
+            except Exception as exc:
+                loop.call_exception_handler({
+                    'message' : 'Exception in poll() of %s' % listener,
+                    'exception' : exc })
+            duration = time.perf_counter() - start
+            name = listener.__class__.__name__
+            stats = self.stats.get(name)
+            if stats is None:
+                stats = self.stats[name] = PollStats()
+            stats.record(duration, lateness, missed)
+            if INSTR.enabled:
+                INSTR.record('poll', name, listener.name, start, duration)
+        if self.ticks and self.timer_tick is None:
+            self._set_timer(self.ticks[0])
+
+    def report(self):
+        print('%-24s %8s %10s %10s %8s %12s  %s' %
+              ('class', 'polls', 'mean us', 'max us', 'missed', 'max late ms',
+               'histogram (log2 us: count)'))
+        for name in sorted(self.stats):
+            s = self.stats[name]
+            print('%-24s %8d %10.1f %10.1f %8d %12.1f  %s' %
+                  (name, s.calls, 1e6*s.mean_time, 1e6*s.max_time,
+                   s.missed, 1000*s.max_lateness, s.histogram_string()))
+
 #________________ Event Listener ________________
 
 class EventListener:
@@ -163,8 +474,7 @@ class EventListener:
     def start(self):
         self.running = True
         if self.polling_interval:
-            self.poll_handle = \
-                self.robot.loop.call_later(self.polling_interval, self._next_poll)
+            self.poll_handle = self.robot.erouter.poll_scheduler.schedule(self)
 
     def stop(self):
         if not self.running: return
@@ -181,14 +491,6 @@ class EventListener:
         else:
             raise TypeError('interval must be a number')
 
-    def _next_poll(self):
-        """Called to poll the node and then schedule the next polling interval."""
-        if self.running and self.polling_interval:
-            self.poll_handle = \
-                self.robot.loop.call_later(self.polling_interval, self._next_poll)
-        # schedule the next poll first because self.poll may cancel it
-        self.poll()
-
     def poll(self):
         """Dummy polling function in case sublass neglects to supply one."""
         if TRACE.trace_level >= TRACE.polling:
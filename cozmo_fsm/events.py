@@ -62,6 +62,13 @@ class PilotEvent(Event):
         self.status = status
         self.args = args
 
+class ArucoEvent(Event):
+    """Posted by Aruco.process_image for each marker seen in a camera
+    image.  The source is the marker id."""
+    def __init__(self,marker):
+        super().__init__(int(marker.id))
+        self.marker = marker
+
 #________________ Cozmo-generated events ________________
 
 class CozmoGeneratedEvent(Event):
@@ -71,7 +78,9 @@ class CozmoGeneratedEvent(Event):
         self.params = params
     # Note regarding generator(): we're going to curry this function
     # to supply EROUTER and EVENT_CLASS as the first two arguments.
-    def generator(EROUTER, EVENT_CLASS, cozmo_event, obj, **kwargs):
+    def generator(EROUTER, EVENT_CLASS, cozmo_event, obj=None, **kwargs):
+        if obj is None:   # face events supply face instead of obj
+            obj = kwargs.get('face')
         our_event = EVENT_CLASS(obj,kwargs)
         EROUTER.post(our_event)
 
@@ -80,3 +89,11 @@ class TapEvent(CozmoGeneratedEvent):
 
 class FaceEvent(CozmoGeneratedEvent):
     cozmo_evt_type = cozmo.faces.EvtFaceAppeared
+
+class ObjectSeenEvent(CozmoGeneratedEvent):
+    """Posted for every camera image in which the object is seen."""
+    cozmo_evt_type = cozmo.objects.EvtObjectObserved
+
+class FaceSeenEvent(CozmoGeneratedEvent):
+    """Posted for every camera image in which the face is seen."""
+    cozmo_evt_type = cozmo.faces.EvtFaceObserved
@@ -26,7 +26,7 @@ class BackItUp(StateMachineProgram):
     
         """
         
-        # Code generated by genfsm on Thu Feb 16 23:51:48 2017:
+        # Code generated by genfsm on Mon Oct 19 00:05:09 2026:
         
         launcher = StateNode() .set_name("launcher") .set_parent(self)
         driver = Forward(-100,10) .set_name("driver") .set_parent(self)
@@ -43,3 +43,5 @@ class BackItUp(StateMachineProgram):
         completiontrans2 .add_sources(driver,speaker) .add_destinations(finisher)
         
         return self
+
+    fsm_events = ('CompletionEvent',)
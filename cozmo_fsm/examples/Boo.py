@@ -50,7 +50,7 @@ class HeadAndLiftGesture(StateNode):
             {move_head, move_lift} =C(1)=> ParentCompletes()
         """
         
-        # Code generated by genfsm on Thu Feb 16 23:51:48 2017:
+        # Code generated by genfsm on Mon Oct 19 00:05:09 2026:
         
         launch = StateNode() .set_name("launch") .set_parent(self)
         move_head = SetHeadAngle(cozmo.robot.MAX_HEAD_ANGLE) .set_name("move_head") .set_parent(self)
@@ -65,6 +65,8 @@ class HeadAndLiftGesture(StateNode):
         
         return self
 
+    fsm_events = ('CompletionEvent',)
+
 class Boo(StateNode):
     def setup(self):
         """
@@ -91,7 +93,7 @@ class Boo(StateNode):
                 =C=> player_hides
         """
         
-        # Code generated by genfsm on Thu Feb 16 23:51:48 2017:
+        # Code generated by genfsm on Mon Oct 19 00:05:09 2026:
         
         launch = Say("Let's play") .set_name("launch") .set_parent(self)
         setheadangle1 = SetHeadAngle(30) .set_name("setheadangle1") .set_parent(self)
@@ -151,3 +153,5 @@ class Boo(StateNode):
         completiontrans15 .add_sources(setheadangle4) .add_destinations(player_hides)
         
         return self
+
+    fsm_events = ('CompletionEvent',)
@@ -1,11 +1,58 @@
+"""
+  CV_Contour demonstrates OpenCV's contour finder.  The contours are
+  found by a vision processor on a worker thread; the trackbars are
+  read on the display thread, in user_annotate.
+"""
+
 import cv2
 import numpy as np
 from cozmo_fsm import *
 
+class Contours(VisionProcessor):
+    requires = ('gray',)
+
+    colors = [(0,0,255), (0,255,0), (255,0,0),
+              (255,255,0), (255,0,255), (0,255,255),
+              (0,0,128), (0,128,0), (128,0,0),
+              (128,128,0), (0,128,128), (128,0,128),
+              (255,255,255)]
+
+    def __init__(self):
+        super().__init__()
+        self.thresh = 100
+        self.min_area = 50
+        self.result = None
+
+    def process(self,products):
+        ret, thresholded = cv2.threshold(products['gray'], self.thresh, 255, 0)
+        contours, hierarchy = \
+            cv2.findContours(thresholded, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)[-2:]
+        areas = [(i, cv2.contourArea(contours[i])) for i in range(len(contours))]
+        areas.sort(key=lambda x: x[1])
+        areas.reverse()
+        # One assignment, so annotate never sees a mix of two frames.
+        self.result = (thresholded, areas, contours, hierarchy)
+
+    def annotate(self,image,scale):
+        if self.result is None: return image
+        (thresholded, areas, contours, hierarchy) = self.result
+        for area_entry in areas:
+            if area_entry[1] < self.min_area:
+                break
+            temp = index = area_entry[0]
+            depth = -1
+            while temp != -1 and depth < len(self.colors)-1:
+                depth += 1
+                temp = hierarchy[0,temp,3]
+            contour = scale * contours[index]
+            cv2.drawContours(image, [contour], 0, self.colors[depth], 1)
+        return image
+
 class CV_Contour(StateMachineProgram):
     def __init__(self):
         super().__init__(aruco=False, particle_filter = False, cam_viewer=True,
                          annotate_cube = False)
+        self.contours = self.add_vision_processor(Contours())
 
     def start(self):
         cv2.namedWindow('contour')
@@ -13,44 +60,16 @@ class CV_Contour(StateMachineProgram):
         cv2.imshow('contour',dummy)
 
         cv2.createTrackbar('thresh1','contour',0,255,lambda self: None)
-        cv2.setTrackbarPos('thresh1','contour',100)
+        cv2.setTrackbarPos('thresh1','contour',self.contours.thresh)
 
         cv2.createTrackbar('minArea','contour',1,1000,lambda self: None)
-        cv2.setTrackbarPos('minArea','contour',50)
-
-        self.colors = [(0,0,255), (0,255,0), (255,0,0),
-                       (255,255,0), (255,0,255), (0,255,255),
-                       (0,0,128), (0,128,0), (128,0,0),
-                       (128,128,0), (0,128,128), (128,0,128),
-                       (255,255,255)]
+        cv2.setTrackbarPos('minArea','contour',self.contours.min_area)
 
         super().start()
 
-
-    def user_image(self,image,gray):
-        thresh1 = cv2.getTrackbarPos('thresh1','contour')
-        ret, thresholded = cv2.threshold(gray, thresh1, 255, 0)
-        cv2.imshow('contour',thresholded)
-        stuff, contours, hierarchy = \
-            cv2.findContours(thresholded, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
-
-        areas = [(i, cv2.contourArea(contours[i])) for i in range(len(contours))]
-        areas.sort(key=lambda x: x[1])
-        areas.reverse()
-        self.areas = areas
-        self.contours = contours
-        self.hierarchy = hierarchy
-
     def user_annotate(self,image):
-        minArea = cv2.getTrackbarPos('minArea','contour')
-        for area_entry in self.areas:
-            if area_entry[1] < minArea:
-                break
-            temp = index = area_entry[0]
-            depth = -1
-            while temp != -1 and depth < len(self.colors)-1:
-                depth += 1
-                temp = self.hierarchy[0,temp,3]
-            contour = 2 * self.contours[index]
-            cv2.drawContours(image, [contour], 0, self.colors[depth], 1)
+        self.contours.thresh = cv2.getTrackbarPos('thresh1','contour')
+        self.contours.min_area = cv2.getTrackbarPos('minArea','contour')
+        if self.contours.result is not None:
+            cv2.imshow('contour',self.contours.result[0])
         return image
@@ -1,15 +1,42 @@
 """
   CV_GoodFeatures demonstrates the Shi and Tomasi (1994) feature
-  extractor built in to OpenCV.
+  extractor built in to OpenCV.  The features are found by a vision
+  processor on a worker thread; the trackbars are read on the display
+  thread, in user_annotate.
 """
 
 import cv2
 import numpy as np
 from cozmo_fsm import *
 
+class GoodFeatures(VisionProcessor):
+    requires = ('gray',)
+
+    def __init__(self):
+        super().__init__()
+        self.params = (50, 0.01, 5)   # maxFeatures, qualityLevel, minDistance
+        self.colors = np.random.randint(0,255,(101,3),dtype=np.int)
+        self.corners = None
+
+    def process(self,products):
+        (maxFeat, qualityLevel, minDist) = self.params
+        self.corners = cv2.goodFeaturesToTrack(products['gray'], maxFeat, qualityLevel, minDist)
+
+    def annotate(self,image,scale):
+        corners = self.corners
+        if corners is None: return image
+        for corner in corners:
+            x,y = corner.ravel()
+            x = int(x); y = int(y)
+            color_index = (x+y) % self.colors.shape[0]
+            color = self.colors[color_index].tolist()
+            cv2.circle(image, (scale*x,scale*y), 3, color, -1)
+        return image
+
 class CV_GoodFeatures(StateMachineProgram):
     def __init__(self):
         super().__init__(aruco=False, cam_viewer=True, annotate_cube = False)
+        self.features = self.add_vision_processor(GoodFeatures())
 
     def start(self):
         cv2.namedWindow('features')
@@ -22,27 +49,14 @@ class CV_GoodFeatures(StateMachineProgram):
 
         cv2.createTrackbar('minDistance','features',5,50,lambda self: None)
 
-        self.colors = np.random.randint(0,255,(101,3),dtype=np.int)
-
         super().start()
 
-    def user_image(self,image,gray):
+    def user_annotate(self,image):
         maxFeat = cv2.getTrackbarPos('maxFeatures','features')
         quality = max(1,cv2.getTrackbarPos('qualityLevel','features'))
         cv2.setTrackbarPos('qualityLevel', 'features', quality) # don't allow zero
         minDist = max(1,cv2.getTrackbarPos('minDistance','features'))
         cv2.setTrackbarPos('minDistance', 'features', minDist) # don't allow zero
-        qualityLevel = quality / 1000
-        self.corners = cv2.goodFeaturesToTrack(gray, maxFeat, qualityLevel, minDist)
-
-    def user_annotate(self,image):
-        if self.corners is None: return image
-        i = 0
-        for corner in self.corners:
-            x,y = corner.ravel()
-            x = int(x); y = int(y)
-            color_index = (x+y) % self.colors.shape[0]
-            color = self.colors[color_index].tolist()
-            cv2.circle(image, (2*x,2*y), 3, color, -1)
-            i += 1
+        # One assignment, so the worker thread never sees a half-updated set.
+        self.features.params = (maxFeat, quality / 1000, minDist)
         return image
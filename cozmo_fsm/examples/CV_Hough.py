@@ -6,16 +6,58 @@
   and minimum bin count (threshold). The 'HoughP' window shows the output of
   HoughLinesP using the r and theta values from the Hough window, plus the
   minLineLength and maxLineGap parameters and its own bin count threshold.
+
+  The two transforms run as separate vision processors, concurrently,
+  and share the frame's edge image, which is computed once.  The
+  trackbars are read on the display thread, in user_annotate.
 """
 
 import cv2
 import numpy as np
 from cozmo_fsm import *
 
+class Hough(VisionProcessor):
+    """Regular Hough transform of the frame's edge image."""
+    def __init__(self):
+        super().__init__()
+        self.set_params((50, 150), 2, 2, 120)
+        self.result = None
+
+    def set_params(self, thresholds, r_tol, deg_tol, h_thresh):
+        # One assignment, so a worker thread never sees a half-updated set.
+        self.params = (('edges',) + tuple(thresholds), r_tol, deg_tol, h_thresh)
+        self.requires = (self.params[0],)
+
+    def process(self,products):
+        (edges_key, r_tol, deg_tol, h_thresh) = self.params
+        edges = products.get(*edges_key)
+        self.result = (edges, cv2.HoughLines(edges, r_tol, deg_tol/180.*np.pi, h_thresh))
+
+class HoughP(Hough):
+    """Probabilistic Hough transform of the frame's edge image."""
+    def __init__(self):
+        super().__init__()
+        self.set_params((50, 150), 2, 2, 20, 40, 20)
+
+    def set_params(self, thresholds, r_tol, deg_tol, p_thresh,
+                   min_line_length=40, max_line_gap=20):
+        self.params = (('edges',) + tuple(thresholds), r_tol, deg_tol, p_thresh,
+                       min_line_length, max_line_gap)
+        self.requires = (self.params[0],)
+
+    def process(self,products):
+        (edges_key, r_tol, deg_tol, p_thresh, min_line_length, max_line_gap) = self.params
+        edges = products.get(*edges_key)
+        self.result = (edges, cv2.HoughLinesP(edges, r_tol, deg_tol/180.*np.pi,
+                                              p_thresh, None,
+                                              min_line_length, max_line_gap))
+
 class CV_Hough(StateMachineProgram):
     def __init__(self):
         super().__init__(aruco=False, particle_filter = False, cam_viewer=True,
                          annotate_cube = False)
+        self.hough = self.add_vision_processor(Hough())
+        self.houghp = self.add_vision_processor(HoughP())
 
     def start(self):
         cv2.namedWindow('edges')
@@ -26,9 +68,6 @@ class CV_Hough(StateMachineProgram):
         cv2.imshow('Hough',dummy)
         cv2.imshow('HoughP',dummy)
 
-        self.h_lines = None
-        self.p_lines = None
-
         cv2.createTrackbar('thresh1','edges',0,255,lambda self: None)
         cv2.createTrackbar('thresh2','edges',0,255,lambda self: None)
         cv2.setTrackbarPos('thresh1','edges',50)
@@ -53,33 +92,25 @@ class CV_Hough(StateMachineProgram):
         cv2.setTrackbarPos('p_main','HoughP',0)
         super().start()
 
-    def user_image(self,image,gray):
-        # Canny edge detector
-        self.thresh1 = cv2.getTrackbarPos('thresh1','edges')
-        self.thresh2 = cv2.getTrackbarPos('thresh2','edges')
-        self.edges = cv2.Canny(gray, self.thresh1, self.thresh2, apertureSize=3)
-
-        # regular Hough
-        self.r_tol = max(0.1, cv2.getTrackbarPos('r_tol','Hough'))
-        self.deg_tol = max(0.1, cv2.getTrackbarPos('deg_tol','Hough'))
-        self.h_thresh = cv2.getTrackbarPos('h_thresh','Hough')
-        self.h_lines = cv2.HoughLines(self.edges, self.r_tol,
-                                      self.deg_tol/180.*np.pi,
-                                      self.h_thresh)
-        # probabilistic Hough
-        self.p_thresh = cv2.getTrackbarPos('p_thresh','HoughP')
-        self.minLineLength = cv2.getTrackbarPos('minLineLength','HoughP')
-        self.maxLineGap = cv2.getTrackbarPos('maxLineGap','HoughP')
-        self.p_lines = cv2.HoughLinesP(self.edges, self.r_tol, self.deg_tol/180.*np.pi,
-                                       self.p_thresh, None,
-                                       self.minLineLength, self.maxLineGap)
-
     def user_annotate(self,image):
-        cv2.imshow('edges',self.edges)
-        if self.h_lines is not None:
-            hough_image = cv2.cvtColor(self.edges,cv2.COLOR_GRAY2BGR)
+        # Settings for the next frame
+        thresholds = (cv2.getTrackbarPos('thresh1','edges'),
+                      cv2.getTrackbarPos('thresh2','edges'))
+        r_tol = max(0.1, cv2.getTrackbarPos('r_tol','Hough'))
+        deg_tol = max(0.1, cv2.getTrackbarPos('deg_tol','Hough'))
+        self.hough.set_params(thresholds, r_tol, deg_tol,
+                              cv2.getTrackbarPos('h_thresh','Hough'))
+        self.houghp.set_params(thresholds, r_tol, deg_tol,
+                               cv2.getTrackbarPos('p_thresh','HoughP'),
+                               cv2.getTrackbarPos('minLineLength','HoughP'),
+                               cv2.getTrackbarPos('maxLineGap','HoughP'))
+
+        if self.hough.result is not None:
+            (edges, h_lines) = self.hough.result
+            cv2.imshow('edges',edges)
+            hough_image = cv2.cvtColor(edges,cv2.COLOR_GRAY2BGR)
             h_main = cv2.getTrackbarPos('h_main','Hough')
-            for line in self.h_lines:
+            for line in (h_lines if h_lines is not None else ()):
                 rho, theta = line[0]
                 a = np.cos(theta)
                 b = np.sin(theta)
@@ -93,10 +124,11 @@ class CV_Hough(StateMachineProgram):
                 if h_main:
                     cv2.line(image,(2*x1,2*y1),(2*x2,2*y2),(0,255,0),2)
             cv2.imshow('Hough',hough_image)
-        if self.p_lines is not None:
-            houghp_image = cv2.cvtColor(self.edges,cv2.COLOR_GRAY2BGR)
+        if self.houghp.result is not None:
+            (edges, p_lines) = self.houghp.result
+            houghp_image = cv2.cvtColor(edges,cv2.COLOR_GRAY2BGR)
             p_main = cv2.getTrackbarPos('p_main','HoughP')
-            for line in self.p_lines:
+            for line in (p_lines if p_lines is not None else ()):
                 x1,y1,x2,y2 = line[0]
                 cv2.line(houghp_image,(x1,y1),(x2,y2),(255,0,0),1)
                 if p_main:
@@ -1,42 +1,39 @@
 """
   CV_OpticalFlow demonstrates the Lucas and Kanade optical flow
-  algorithm built in to OpenCV.
+  algorithm built in to OpenCV.  The flow is computed by a vision
+  processor on a worker thread.
 """
 
 import cv2
 import numpy as np
 from cozmo_fsm import *
 
-class CV_OpticalFlow(StateMachineProgram):
-    def __init__(self):
-        super().__init__(aruco=False, particle_filter=False, cam_viewer=True,
-                         annotate_cube = False)
+class OpticalFlow(VisionProcessor):
+    requires = ('gray',)
 
-    def start(self):
-        self.feature_params = dict( maxCorners = 100,
-                                    qualityLevel = 0.3,
-                                    minDistance = 7,
-                                    blockSize = 7 )
+    feature_params = dict( maxCorners = 100,
+                           qualityLevel = 0.3,
+                           minDistance = 7,
+                           blockSize = 7 )
 
-        self.lk_params = dict( winSize = (15,15),
-                               maxLevel = 2,
-                               criteria = (cv2.TERM_CRITERIA_EPS |
-                                           cv2.TERM_CRITERIA_COUNT,
-                                           10, 0.03) )
+    lk_params = dict( winSize = (15,15),
+                      maxLevel = 2,
+                      criteria = (cv2.TERM_CRITERIA_EPS |
+                                  cv2.TERM_CRITERIA_COUNT,
+                                  10, 0.03) )
 
+    def __init__(self):
+        super().__init__()
         self.colors = np.random.randint(0, 255, (100,3), dtype=np.int)
-
         self.prev_gray = None
-        self.good_new = None
+        self.tracks = None    # (new points, old points) from the latest frame
+        self.mask = None
 
-        super().start()
-
-    def user_image(self,image,gray):
-        maxFeat = cv2.getTrackbarPos('maxFeatures','features')
-        quality = cv2.getTrackbarPos('qualityLevel','features') / 1000
-        minDist = cv2.getTrackbarPos('minDistance','features')
+    def process(self,products):
+        gray = products['gray']
         if self.prev_gray is None:
-            self.prev_gray = gray
+            # The gray buffer is reused for later frames, so keep a copy.
+            self.prev_gray = gray.copy()
             self.prev_feat = cv2.goodFeaturesToTrack(gray, mask=None,
                                                      **self.feature_params)
             return
@@ -44,22 +41,30 @@ class CV_OpticalFlow(StateMachineProgram):
                   cv2.calcOpticalFlowPyrLK(self.prev_gray, gray,
                                            self.prev_feat, None, **self.lk_params)
         if new_feat is None:
-            self.good_new = None
+            self.tracks = None
             return
-        self.good_new = new_feat[st==1]
-        self.good_old = self.prev_feat[st==1]
-        self.prev_gray = gray
-        self.prev_feat = self.good_new.reshape(-1,1,2)
+        good_new = new_feat[st==1]
+        self.tracks = (good_new, self.prev_feat[st==1])
+        self.prev_gray = gray.copy()
+        self.prev_feat = good_new.reshape(-1,1,2)
 
-    def user_annotate(self,image):
-        if self.good_new is None:
+    def annotate(self,image,scale):
+        tracks = self.tracks
+        if self.mask is None or self.mask.shape != image.shape:
             self.mask = np.zeros_like(image)
+        if tracks is None:
+            self.mask[:] = 0
             return image
-        for i,(new,old) in enumerate(zip(self.good_new, self.good_old)):
-            a,b = new.ravel()
-            c,d = old.ravel()
-            self.mask = cv2.line(self.mask, (a+a,b+b), (c+c,d+d),
-                                 self.colors[i].tolist(), 2)
-            cv2.circle(image,(a+a,b+b),5,self.colors[i].tolist(),-1)
-        image = cv2.add(image,self.mask)
-        return image
+        for i,(new,old) in enumerate(zip(*tracks)):
+            a,b = (scale * new.ravel()).astype(int)
+            c,d = (scale * old.ravel()).astype(int)
+            color = self.colors[i % len(self.colors)].tolist()
+            cv2.line(self.mask, (a,b), (c,d), color, 2)
+            cv2.circle(image,(a,b),5,color,-1)
+        return cv2.add(image,self.mask)
+
+class CV_OpticalFlow(StateMachineProgram):
+    def __init__(self):
+        super().__init__(aruco=False, particle_filter=False, cam_viewer=True,
+                         annotate_cube = False)
+        self.flow = self.add_vision_processor(OpticalFlow())
@@ -1,16 +1,45 @@
 """
   CV_Thresh demonstrates image thresholding in OpenCV, and
-  independently, the Canny edge detector.
+  independently, the Canny edge detector.  The two run as separate
+  vision processors, concurrently, sharing the frame's gray image.
+
+  The processors run on worker threads, so the trackbars are read
+  on the display thread, in user_annotate, and the settings are
+  passed to the processors for the next frame.
 """
 
 import cv2
 import numpy as np
 from cozmo_fsm import *
 
+class Threshold(VisionProcessor):
+    requires = ('gray',)
+
+    def __init__(self):
+        super().__init__()
+        self.thresh = 100
+
+    def process(self,products):
+        ret, self.im_thresh = cv2.threshold(products['gray'], self.thresh, 255, cv2.THRESH_BINARY)
+
+class Edges(VisionProcessor):
+    def __init__(self):
+        super().__init__()
+        self.set_thresholds(50, 150)
+
+    def set_thresholds(self, thresh1, thresh2):
+        # One tuple, so a worker thread never sees a half-updated pair.
+        self.requires = (('edges', thresh1, thresh2),)
+
+    def process(self,products):
+        self.im_edges = products.get(*self.requires[0])
+
 class CV_Thresh(StateMachineProgram):
     def __init__(self):
         super().__init__(aruco=False, particle_filter=False, cam_viewer=True,
                          annotate_cube = False)
+        self.threshold = self.add_vision_processor(Threshold())
+        self.edges = self.add_vision_processor(Edges())
 
     def start(self):
         cv2.namedWindow('edges')
@@ -20,7 +49,7 @@ class CV_Thresh(StateMachineProgram):
         cv2.imshow('edges',dummy)
 
         cv2.createTrackbar('thresh','threshold',0,255,lambda self: None)
-        cv2.setTrackbarPos('thresh', 'threshold', 100)
+        cv2.setTrackbarPos('thresh', 'threshold', self.threshold.thresh)
 
         cv2.createTrackbar('thresh1','edges',0,255,lambda self: None)
         cv2.createTrackbar('thresh2','edges',0,255,lambda self: None)
@@ -29,17 +58,12 @@ class CV_Thresh(StateMachineProgram):
 
         super().start()
 
-    def user_image(self,image,gray):
-        # Thresholding
-        self.thresh = cv2.getTrackbarPos('thresh','threshold')
-        ret, self.im_thresh = cv2.threshold(gray, self.thresh, 255, cv2.THRESH_BINARY)
-
-        # Canny edge detection
-        self.thresh1 = cv2.getTrackbarPos('thresh1','edges')
-        self.thresh2 = cv2.getTrackbarPos('thresh2','edges')
-        self.im_edges = cv2.Canny(gray, self.thresh1, self.thresh2, apertureSize=3)
-
     def user_annotate(self,image):
-        cv2.imshow('threshold',self.im_thresh)
-        cv2.imshow('edges',self.im_edges)
+        self.threshold.thresh = cv2.getTrackbarPos('thresh','threshold')
+        self.edges.set_thresholds(cv2.getTrackbarPos('thresh1','edges'),
+                                  cv2.getTrackbarPos('thresh2','edges'))
+        if hasattr(self.threshold, 'im_thresh'):
+            cv2.imshow('threshold',self.threshold.im_thresh)
+        if hasattr(self.edges, 'im_edges'):
+            cv2.imshow('edges',self.edges.im_edges)
         return image
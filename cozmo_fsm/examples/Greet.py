@@ -19,7 +19,7 @@ class Greet(StateMachineProgram):
                 say2: Say('Bye-bye now.')
         """
         
-        # Code generated by genfsm on Thu Feb 16 23:51:48 2017:
+        # Code generated by genfsm on Mon Oct 19 00:05:09 2026:
         
         say = Say('Greetings, human!') .set_name("say") .set_parent(self)
         wait = StateNode() .set_name("wait") .set_parent(self)
@@ -32,3 +32,5 @@ class Greet(StateMachineProgram):
         timertrans1 .add_sources(wait) .add_destinations(say2)
         
         return self
+
+    fsm_events = ('CompletionEvent',)
@@ -12,7 +12,7 @@ class PrintIt(StateNode):
         if self.running: return
         super().start(event)
         if isinstance(event,DataEvent):
-            print('I heard: ', event.data)
+            print('I got some data: ', event.data)
 
 class Iteration(StateMachineProgram):
     def setup(self):
@@ -27,7 +27,7 @@ class Iteration(StateMachineProgram):
     	outer_loop =C=> Say('Done')
         """
         
-        # Code generated by genfsm on Fri Feb 24 22:22:17 2017:
+        # Code generated by genfsm on Mon Oct 19 00:05:10 2026:
         
         outer_loop = Iterate(['alpha', 'bravo', 'charlie']) .set_name("outer_loop") .set_parent(self)
         say1 = Say() .set_name("say1") .set_parent(self)
@@ -54,3 +54,5 @@ class Iteration(StateMachineProgram):
         completiontrans2 .add_sources(outer_loop) .add_destinations(say2)
         
         return self
+
+    fsm_events = ('CompletionEvent', 'DataEvent', 'SayDataEvent')
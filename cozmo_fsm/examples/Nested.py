@@ -20,7 +20,7 @@ class DingDong(StateNode):
             ding: Say('ding') =C=> dong: Say('dong') =C=> ParentCompletes()
         """
         
-        # Code generated by genfsm on Thu Feb 16 23:51:48 2017:
+        # Code generated by genfsm on Mon Oct 19 00:05:10 2026:
         
         ding = Say('ding') .set_name("ding") .set_parent(self)
         dong = Say('dong') .set_name("dong") .set_parent(self)
@@ -34,13 +34,15 @@ class DingDong(StateNode):
         
         return self
 
+    fsm_events = ('CompletionEvent',)
+
 class Nested(StateMachineProgram):
     def setup(self):
         """
             dd1: DingDong() =C=> bridge: Say('once again') =C=> dd2: DingDong()
         """
         
-        # Code generated by genfsm on Thu Feb 16 23:51:48 2017:
+        # Code generated by genfsm on Mon Oct 19 00:05:10 2026:
         
         dd1 = DingDong() .set_name("dd1") .set_parent(self)
         bridge = Say('once again') .set_name("bridge") .set_parent(self)
@@ -53,3 +55,5 @@ class Nested(StateMachineProgram):
         completiontrans4 .add_sources(bridge) .add_destinations(dd2)
         
         return self
+
+    fsm_events = ('CompletionEvent',)
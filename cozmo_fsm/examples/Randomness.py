@@ -57,7 +57,7 @@ class Randomness(StateMachineProgram):
                    =C=> StateNode() =T(2)=> startnode
         """
         
-        # Code generated by genfsm on Thu Feb 16 23:51:48 2017:
+        # Code generated by genfsm on Mon Oct 19 00:05:10 2026:
         
         startnode = StateNode() .set_name("startnode") .set_parent(self)
         fwd = Say(["Forward", "Straight", "Full steam ahead"]) .set_name("fwd") .set_parent(self)
@@ -91,3 +91,5 @@ class Randomness(StateMachineProgram):
         
         return self
 
+    fsm_events = ('CompletionEvent',)
+
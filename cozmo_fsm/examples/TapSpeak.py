@@ -37,7 +37,7 @@ class TapSpeak(StateMachineProgram):
             speak: SayCube() =C=> wait
         """
         
-        # Code generated by genfsm on Thu Feb 16 23:51:48 2017:
+        # Code generated by genfsm on Mon Oct 19 00:05:10 2026:
         
         intro = Say('Tap a cube.') .set_name("intro") .set_parent(self)
         wait = StateNode() .set_name("wait") .set_parent(self)
@@ -53,3 +53,5 @@ class TapSpeak(StateMachineProgram):
         completiontrans2 .add_sources(speak) .add_destinations(wait)
         
         return self
+
+    fsm_events = ('CompletionEvent', 'TapEvent')
@@ -15,7 +15,7 @@ class Junk(StateNode):
             do_comp: Say("Full steam ahead") =C=> Forward(20) =C=> startnode
         """
         
-        # Code generated by genfsm on Thu Feb 16 23:51:48 2017:
+        # Code generated by genfsm on Mon Oct 19 00:05:10 2026:
         
         startnode = StateNode() .set_name("startnode") .set_parent(self)
         do_null = Say("Full steam ahead") .set_name("do_null") .set_parent(self)
@@ -53,3 +53,5 @@ class Junk(StateNode):
         completiontrans4 .add_sources(forward3) .add_destinations(startnode)
         
         return self
+
+    fsm_events = ('CompletionEvent', 'TextMsgEvent')
@@ -0,0 +1,119 @@
+"""
+Camera frame ingestion.
+
+The SDK delivers each camera image as a PIL image.  numpy.array() on it
+copies the pixels twice (PIL's tobytes, then the array copy), and
+converting to gray allocates another array.  FrameRing instead wraps the
+PIL data with numpy.asarray, which is one copy and the least PIL allows,
+or uses the array as is if the image is already one.  It then converts
+to gray into a ring of reused buffers.
+
+Each frame leases its gray buffer from the ring.  Whoever processes
+the frame calls frame.release() when done with it (frame.hold() adds
+another consumer, e.g. a second pipeline stage), and only then can the
+buffer be reused.  A consumer that keeps a gray image past that, such
+as optical flow's previous frame, must copy it.  If every buffer is
+leased a fresh one is allocated, so a frame that is never released
+costs an allocation but is never overwritten.
+
+Frame.image is a read-only view of the SDK's pixels.  Use
+frame.writable_image() for a copy that can be drawn on.
+"""
+
+import threading
+import time
+
+import cv2
+import numpy
+
+class Frame():
+    """One camera image, with metadata from the SDK."""
+    def __init__(self, event, number):
+        self.event = event
+        self.number = number    # our own count of frames received
+        self.image_number = getattr(event.image, 'image_number', number)
+        self.image_recv_time = getattr(event.image, 'image_recv_time', None) or time.time()
+        self.recv_time = time.time()
+        self.image = None
+        self.gray = None
+        self.products = None    # FrameProducts, see vision.py
+        self.ring = None        # FrameRing that leased self.gray, until released
+        self.lease = None
+        self.holds = 1          # consumers that have yet to call release()
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return '<Frame %d image_number=%d>' % (self.number, self.image_number)
+
+    def hold(self):
+        """Add a consumer, which must call release() when done."""
+        with self.lock:
+            self.holds += 1
+
+    def release(self):
+        """Called by each consumer when it's done with the frame.  After
+        the last one, the gray buffer goes back to the ring."""
+        with self.lock:
+            self.holds -= 1
+            if self.holds > 0 or self.ring is None: return
+            (ring, lease) = (self.ring, self.lease)
+            self.ring = self.lease = None
+        ring.release(lease)
+
+    def writable_image(self):
+        """A copy of the image that may be modified."""
+        return numpy.array(self.image)
+
+class FrameRing():
+    def __init__(self, size=6):
+        self.size = size
+        self.buffers = [None] * size
+        self.leased = [False] * size
+        self.lock = threading.Lock()
+        self.index = 0
+        self.allocations = 0
+        self.frames = 0
+
+    def __repr__(self):
+        return '<FrameRing %d buffers, %d frames, %d allocations>' % \
+               (self.size, self.frames, self.allocations)
+
+    def lease_gray(self, shape):
+        """Returns (lease, buffer).  lease is None if every ring buffer was
+        leased and buffer is a fresh one outside the ring."""
+        with self.lock:
+            for k in range(self.size):
+                i = (self.index + k) % self.size
+                if not self.leased[i]: break
+            else:
+                self.allocations += 1
+                return (None, numpy.empty(shape, dtype=numpy.uint8))
+            # Take buffers in turn, so a released one is reused as late as possible.
+            self.index = (i + 1) % self.size
+            buffer = self.buffers[i]
+            if buffer is None or buffer.shape != shape:
+                buffer = numpy.empty(shape, dtype=numpy.uint8)
+                self.buffers[i] = buffer
+                self.allocations += 1
+            self.leased[i] = True
+            return (i, buffer)
+
+    def release(self, lease):
+        if lease is None: return
+        with self.lock:
+            self.leased[lease] = False
+
+    def ingest(self, frame):
+        """Fill in frame.image and frame.gray from the frame's SDK image."""
+        raw = frame.event.image.raw_image
+        if isinstance(raw, numpy.ndarray):
+            image = raw
+        else:
+            image = numpy.asarray(raw)
+        frame.image = image
+        (lease, buffer) = self.lease_gray(image.shape[:2])
+        if lease is not None:
+            (frame.ring, frame.lease) = (self, lease)
+        frame.gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst=buffer)
+        self.frames += 1
+        return frame
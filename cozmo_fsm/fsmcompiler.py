@@ -0,0 +1,981 @@
+"""
+State machine compiler: translates .fsm files to Python.
+Modeled after the Tekkotsu stateparser tool.
+
+This is the engine behind the genfsm command.  It can also be used
+directly:
+
+    compile_string(text)                 # returns Python source
+    compile_file('Foo.fsm', 'Foo.py')    # regenerates Foo.py only if Foo.fsm changed
+
+or as an import hook, so that "import Foo" finds Foo.fsm on the search
+path and compiles it to bytecode without a Foo.py:
+
+    fsmcompiler.install()
+
+Compiled modules are cached in the __pycache__ directory next to the
+.fsm file, keyed by a SHA-256 hash of its contents, so an unchanged
+.fsm file is never parsed twice and an edited one is never stale.
+The cache holds the generated Python source (Foo.fsm.py, which
+tracebacks refer to, ending with a comment giving the hash) and its
+bytecode (Foo.fsm.<python tag>.pyc, unless bytecode writing is off).
+
+Each $setup block also yields a graph of the machine: its nodes, and
+its transitions with their sources, destinations, and the events they
+listen for.  analyze() checks it for unreachable nodes, transitions
+that can never fire, and dead ends; see genfsm --graph and --check.
+Only the names of the events are emitted, as the class attribute
+fsm_events, which StateNode.start uses to preregister dispatch
+entries while the machine runs.
+
+To enter state machine notation use a line that contains just
+$setup ''', followed by the lines of the state machine, and ending
+with a line contaning just '''. This will result in a definition of a
+setup() method for the state node class you are defining. Example:
+
+  class MyNode(StateNode):
+      $setup '''
+          Say("Hello") =C=> Forward(50)
+      '''
+
+Author: David S. Touretzky, Carnegie Mellon University
+"""
+
+import hashlib
+import importlib.abc
+import importlib.util
+import marshal
+import os
+import re
+import sys
+import time
+from collections import deque
+
+try:
+    from termcolor import cprint
+except:
+    def cprint(string, color=None, file=None):
+        print(string, file=file)
+
+# Bump this when the generated code changes, to invalidate cached compilations.
+COMPILER_VERSION = b'genfsm 4'
+
+class FSMSyntaxError(SyntaxError): pass
+
+class Token:
+    def __repr__(self):
+        return "<%s>" % self.__class__.__name__
+    # Lexer tokens
+    def isIdentifier(self): return isinstance(self,Identifier)
+    def isColon(self): return isinstance(self,Colon)
+    def isNewline(self): return isinstance(self,Newline)
+    def isEqual(self): return isinstance(self,Equal)
+    def isArrowHead(self): return isinstance(self,ArrowHead)
+    def isComma(self): return isinstance(self,Comma)
+    def isLBrace(self): return isinstance(self,LBrace)
+    def isRBrace(self): return isinstance(self,RBrace)
+    def isArglist(self): return isinstance(self,Arglist)
+    # Parser stage 1 tokens
+    def isLabelRef(self): return isinstance(self,LabelRef)
+    def isLabelDef(self): return isinstance(self,LabelDef)
+    def isConstructorCall(self): return isinstance(self,ConstructorCall)
+    def isIdentifierList(self): return isinstance(self,IdentifierList)
+    # Parser stage 2 token
+    def isTransition(self) : return isinstance(self,Transition)
+    # Parser stage 3 tokens
+    def isNodeDefinition(self): return isinstance(self,NodeDefinition)
+
+# Lexer tokens:
+
+class Identifier(Token):
+    def __init__(self,name):
+        self.name = name
+    def __repr__(self):
+        return "<Identifier %s>" % self.name
+
+class Colon(Token): pass
+class Equal(Token): pass
+class ArrowHead(Token) : pass
+class Comma(Token) : pass
+class LBrace(Token) : pass
+class RBrace(Token) : pass
+class Newline(Token) : pass
+
+class Arglist(Token):
+    def __init__(self,value):
+        self.value = value
+    def __repr__(self):
+        return "<Arglist %s>" % self.value
+
+# Parser stage 1 and 2 tokens:
+
+class IdentifierList(Token):
+    def __init__(self,label_refs):
+        self.label_refs = label_refs
+    def __repr__(self):
+        return "<IdentifierList %s>" % ','.join(self.label_refs)
+
+class LabelDef(Token):
+    def __init__(self,label):
+        self.label = label
+    def __repr__(self):
+        return "<LabelDef %s>" % self.label
+
+class LabelRef(Token):
+    def __init__(self,label):
+        self.label = label
+    def __repr__(self):
+        return "<LabelRef %s>" % self.label
+
+class ConstructorCall(Token):
+    def __init__(self,name,arglist):
+        self.name = name
+        self.arglist = arglist
+    def __repr__(self):
+        return "<ConstructorCall %s%s>" % (self.name, self.arglist)
+
+# Parser stage 3 tokens
+
+class NodeDefinition(Token):
+    def __init__(self,label,node_type,arglist):
+        self.label = label
+        self.node_type = node_type
+        self.arglist = arglist
+    def __repr__(self):
+        label = self.label+':' if self.label else ''
+        return "<NodeDefinition %s%s%s>" % \
+               (label, self.node_type, self.arglist)
+
+class Transition(Token):
+    def __init__(self,label,trans_type,arglist):
+        self.label = label
+        self.trans_type = trans_type
+        self.arglist = arglist
+        self.sources = []
+        self.destinations = []
+
+    def __repr__(self):
+        label = self.label+':' if self.label else ''
+        if len(self.sources) == 1:
+            srcs = self.sources[0]
+        else:
+            srcs = '{%s}' % ','.join(self.sources)
+        if len(self.destinations) == 1:
+            dests = self.destinations[0]
+        else:
+            dests = '{%s}' % ','.join(self.destinations)
+        return "<Transition %s=%s%s=>%s>" % (srcs,label,self.trans_type,dests)
+
+transition_names = dict(
+    N = 'NullTrans',
+    T = 'TimerTrans',
+    C = 'CompletionTrans',
+    S = 'SuccessTrans',
+    F = 'FailureTrans',
+    D = 'DataTrans',
+    TM = 'TextMsgTrans',
+    RND = 'RandomTrans',
+    PILOT = 'PilotTrans',
+    Tap = 'TapTrans',
+    Aruco = 'ArucoTrans',
+    CubeSeen = 'CubeSeenTrans',
+    FaceSeen = 'FaceSeenTrans',
+    Next = 'NextTrans',
+    CNext = 'CNextTrans',
+    SayData = 'SayDataTrans',
+    Hear = 'HearTrans'
+    )
+
+# One alternative per kind of lexeme, tried at the current position.
+# Newline alternatives are ordered so '\r\n' counts as one line.
+r_lexeme = re.compile(r"""
+    (?P<space>    [ \t]+          ) |
+    (?P<newline>  \r\n | \r | \n  ) |
+    (?P<arrowhead> =>             ) |
+    (?P<punc>     [:,={}]         ) |
+    (?P<comment>  \#[^\r\n]*      ) |
+    (?P<arglist>  \(              ) |
+    (?P<identifier> (self\.)?\w+  )
+    """, re.VERBOSE)
+
+punc_tokens = {':' : Colon, ',' : Comma, '=' : Equal, '{' : LBrace, '}' : RBrace}
+
+r_setup = re.compile(r'^\s*\$setup\s*((""")|(\'\'\')|\{)\s*((\#.*)|)$')
+r_indent = re.compile(r'^\s*')
+r_class = re.compile(r'^(\s*)class\s+(\w+)')
+
+# What each built-in transition waits for: 'event' (the event classes
+# in transition_events), 'timer', or 'immediate' (fires when started).
+# User-defined transitions are 'unknown'.
+transition_triggers = dict(
+    NullTrans = 'immediate',
+    RandomTrans = 'immediate',
+    NextTrans = 'immediate',
+    TimerTrans = 'timer',
+    CompletionTrans = 'event',
+    SuccessTrans = 'event',
+    FailureTrans = 'event',
+    CNextTrans = 'event',
+    DataTrans = 'event',
+    SayDataTrans = 'event',
+    TapTrans = 'event',
+    ArucoTrans = 'event',
+    CubeSeenTrans = 'event',
+    FaceSeenTrans = 'event',
+    TextMsgTrans = 'event',
+    HearTrans = 'event',
+    PilotTrans = 'event'
+    )
+
+transition_events = dict(
+    CompletionTrans = ['CompletionEvent'],
+    SuccessTrans = ['SuccessEvent'],
+    FailureTrans = ['FailureEvent'],
+    CNextTrans = ['CompletionEvent'],
+    DataTrans = ['DataEvent'],
+    SayDataTrans = ['DataEvent', 'SayDataEvent'],
+    TapTrans = ['TapEvent'],
+    ArucoTrans = ['ArucoEvent'],
+    CubeSeenTrans = ['ObjectSeenEvent'],
+    FaceSeenTrans = ['FaceSeenEvent'],
+    TextMsgTrans = ['TextMsgEvent'],
+    HearTrans = ['SpeechEvent'],
+    PilotTrans = ['PilotEvent']
+    )
+
+# Transitions that fire only after events from all (or count of) their sources.
+counting_transitions = ('CompletionTrans', 'SuccessTrans', 'FailureTrans', 'CNextTrans')
+
+# Nodes that do nothing themselves; with no outgoing transitions, a
+# machine that enters one sits there forever.
+idle_node_types = ('StateNode',)
+
+class Compiler():
+    """Translates the text of one .fsm file.  Errors are printed to
+    stderr as they're found; found_error is then True."""
+    def __init__(self, filename='<fsm>'):
+        self.filename = filename
+        self.line_cache = [None]  # dummy line 0
+        self.current_line = 0
+        self.starting_line = 0
+        self.indent_level = 0
+        self.setup_indent = 0
+        self.found_error = False
+        self.error_count = 0
+        self.name_counts = dict()
+        self.output = []
+        self.graphs = []          # one per $setup block
+        self.class_stack = []     # (indentation, name) of enclosing class definitions
+
+    def handle_newline(self):
+        self.current_line += 1
+
+    #---------------- Lexer ----------------
+
+    def lexer(self, string):
+        """Convert input string into a sequence of lexer tokens.  Scans
+        by position, so it takes time linear in the length of string."""
+        tokens = []
+        pos = 0
+        end = len(string)
+        while pos < end:
+            match = r_lexeme.match(string, pos)
+            if match is None:
+                # If we reach here, we've found something indigestible.
+                self.report_line_error("syntax error at '%s'" % error_fragment(string[pos:]))
+                next_line = string.find('\n', pos)
+                if next_line > -1:
+                    pos = next_line
+                    continue
+                break
+            kind = match.lastgroup
+            if kind == 'arglist':
+                (arglist, pos) = self.lexer_build_arglist(string, pos)
+                tokens.append(arglist)
+                continue
+            pos = match.end()
+            if kind == 'newline':
+                tokens.append(Newline())
+                self.handle_newline()
+            elif kind == 'arrowhead':
+                tokens.append(ArrowHead())
+            elif kind == 'punc':
+                tokens.append(punc_tokens[match.group()]())
+            elif kind == 'identifier':
+                tokens.append(Identifier(match.group()))
+            # spaces and comments produce no tokens
+        return tokens
+
+    def lexer_build_arglist(self, string, start):
+        """Helper for lexer.  string[start] is '('.  Returns the argument
+        list and the position following it."""
+        lookstack = [')']
+        pos = start + 1
+        end = len(string)
+        while lookstack and pos < end:
+            if lookstack[0] == string[pos]:
+                del lookstack[0]
+            elif lookstack[0] not in '\'"':
+                if string[pos] == '(':
+                    lookstack.insert(0,')')
+                elif string[pos] == '[':
+                    lookstack.insert(0,']')
+                elif string[pos] == '{':
+                    lookstack.insert(0,'}')
+                elif string[pos] in ')]}':
+                    break
+            pos += 1
+        if lookstack:
+            cleanstr = string[start:].strip()
+            p = min(pos-start, len(cleanstr)-1)
+            self.report_line_error("Ill-formed argument list at '%s' near '%s'" %
+                                   (error_fragment(string[start:]), cleanstr[p]))
+            return Arglist(''), end
+        return Arglist(string[start:pos]), pos
+
+    #---------------- Parser ----------------
+
+    def parser1(self, lex_tokens):
+        """Assembles label-def / constructor-call / label-ref / identifier-list tokens."""
+        lex_tokens = deque(lex_tokens)
+        p1tokens = []
+        while lex_tokens:
+            if lex_tokens[0].isIdentifier():
+                # An identifier must be a label definition, constructor call, or label reference.
+                if len(lex_tokens) > 1 and lex_tokens[1].isColon():   # Label definition
+                    p1tokens.append(LabelDef(lex_tokens[0].name))
+                    lex_tokens.popleft(); lex_tokens.popleft()
+                    continue
+                if len(lex_tokens) > 1 and lex_tokens[1].isArglist(): # Constructor call
+                    p1tokens.append(ConstructorCall(lex_tokens[0].name,lex_tokens[1].value))
+                    lex_tokens.popleft(); lex_tokens.popleft()
+                    continue
+                # Default case: identifier assumed to be a label reference.
+                p1tokens.append(LabelRef(lex_tokens[0].name))
+                lex_tokens.popleft()
+                continue
+            # A left braces introduces a comma-separated list of label references
+            if lex_tokens[0].isLBrace():
+                lex_tokens.popleft()
+                label_refs = []
+                need_comma = False
+                need_rbrace = True
+                while lex_tokens:
+                    if lex_tokens[0].isRBrace():
+                        p1tokens.append(IdentifierList(label_refs))
+                        lex_tokens.popleft()
+                        need_rbrace = False
+                        break
+                    if need_comma and lex_tokens[0].isComma():
+                        lex_tokens.popleft()
+                        need_comma = False
+                    elif not need_comma and lex_tokens[0].isIdentifier():
+                        label_refs.append(lex_tokens[0].name)
+                        lex_tokens.popleft()
+                        need_comma = True
+                    else:
+                        self.report_line_error('Syntax error in identifier list near %s.' %lex_tokens[0])
+                        lex_tokens.popleft()
+                if not label_refs:
+                    self.report_line_error('Empty identifier list {}.')
+                if label_refs and not need_comma:
+                    self.report_line_error('Trailing comma in identifier list {... ,}.')
+                if need_rbrace:
+                    self.report_line_error('Missing right brace in identifier list {....')
+                continue
+            if lex_tokens[0].isRBrace():
+                self.report_line_error('Extraneous right brace.')
+                lex_tokens.popleft()
+                continue
+            if lex_tokens[0].isEqual():
+                p1tokens.append(lex_tokens.popleft())
+                # Special handling for transitions: convert identifier to
+                # labelref if followed by ":" or to constructor call with
+                # no arguments if followed by "=>". Otherwise just
+                # continue and we'll process "identifier (" on the next
+                # iteration.
+                if len(lex_tokens) < 2:
+                    self.report_line_error('Syntax error in transition near %s' %
+                                           (lex_tokens[0] if len(lex_tokens) > 0 else 'end of line'))
+                    continue
+                # Assemble optional label for transition.
+                if lex_tokens[0].isIdentifier() and lex_tokens[1].isColon():
+                    p1tokens.append(LabelDef(lex_tokens[0].name))
+                    lex_tokens.popleft(); lex_tokens.popleft()
+                if len(lex_tokens) < 2:
+                    self.report_line_error('Syntax error in transition near %s' %
+                                           (lex_tokens[0] if len(lex_tokens) > 0 else 'end of line'))
+                    continue
+                # For transitions, an identifier with no arglist is still a constructor call.
+                if lex_tokens[0].isIdentifier():
+                    if len(lex_tokens) >= 2 and not lex_tokens[1].isArglist():
+                        p1tokens.append(ConstructorCall(lex_tokens[0].name,'()'))
+                        lex_tokens.popleft()
+                    continue
+            # Default: just pass the item (arrowhead, newline) on to the next stage
+            if lex_tokens[0].isNewline(): self.handle_newline()
+            p1tokens.append(lex_tokens.popleft())
+        return p1tokens
+
+    def parser2(self, p1tokens):
+        """Create a node definition with label, or a transition with label
+        and constructor call; no sources/destinations yet."""
+        p1tokens = deque(p1tokens)
+        p2tokens = []
+        while p1tokens:
+            if p1tokens[0].isNewline():
+                self.handle_newline()
+                p2tokens.append(p1tokens.popleft())
+                continue
+            # Must begin with a node reference or definition.
+            if p1tokens[0].isLabelDef():
+                label = p1tokens[0].label
+                # labeled constructor call
+                if p1tokens[1].isConstructorCall():
+                    call = p1tokens[1]
+                    p2tokens.append(NodeDefinition(label, call.name, call.arglist))
+                    p2tokens[-1].line = self.current_line
+                    p1tokens.popleft(); p1tokens.popleft()
+                    continue
+                else:
+                    if p1tokens[1].isLabelRef() and p1tokens[1].label[0].isupper():
+                        hint = "\n\tDid you mean '%s()' ?" % p1tokens[1].label
+                    else:
+                        hint = ""
+                    self.report_line_error("Label '%s:' should be followed by a node definition, not %s.%s"
+                                           % (label, p1tokens[1], hint))
+                    p1tokens.popleft()
+                    continue
+            if p1tokens[0].isConstructorCall():
+                # Unlabeled constructor call: label it.
+                call = p1tokens.popleft()
+                label = self.gen_name(call.name)
+                p2tokens.append(NodeDefinition(label, call.name, call.arglist))
+                p2tokens[-1].line = self.current_line
+                continue
+            if p1tokens[0].isEqual():   # start of a transition
+                p1tokens.popleft()
+                label = None
+                trans = None
+                # look for optional transition label
+                if p1tokens[0].isLabelDef():
+                    label = p1tokens.popleft().label
+                # look for transition constructor
+                if p1tokens[0].isConstructorCall():
+                    trans_type = p1tokens[0].name
+                    trans_args = p1tokens[0].arglist
+                else:
+                    self.report_line_error('Ill-formed transition: should not see %s here.' % p1tokens[0])
+                    p1tokens.popleft()
+                    continue
+                p1tokens.popleft()   # constructor
+                if not p1tokens[0].isArrowHead():
+                    self.report_line_error("Error in transition: expected '=>' not %s." % p1tokens[0])
+                p1tokens.popleft()  # arrowhead
+                trans_class = transition_names.get(trans_type,trans_type)
+                if not label:
+                    label = self.gen_name(trans_class)
+                p2tokens.append(Transition(label,trans_class,trans_args))
+                p2tokens[-1].line = self.current_line
+                continue
+            # Pass along an identifier list without modification
+            if p1tokens[0].isIdentifierList() or p1tokens[0].isLabelRef():
+                p2tokens.append(p1tokens.popleft())
+                continue
+            else:
+                self.report_line_error("A %s token is not legal in this context." % p1tokens[0])
+                p1tokens.popleft()
+                continue
+        return p2tokens
+
+    def gen_name(self, base_name):
+        name = base_name.lower()
+        if name.startswith('self.'):
+            name = name[5:]
+        count = self.name_counts.get(name,0) + 1
+        self.name_counts[name] = count
+        return name + repr(count)
+
+    def parser3(self, p2tokens):
+        """Chain nodes and transitions by filling in source/destination fields."""
+        p2tokens = deque(p2tokens)
+        current_node = None
+        need_destination = False
+        p3tokens = []
+        must_transition = False
+        while p2tokens:
+            while p2tokens and p2tokens[0].isNewline():
+                must_transition = False
+                self.handle_newline()
+                p2tokens.popleft()
+            if not p2tokens: break
+            if p2tokens[0].isLabelRef():
+                must_transition = True
+                current_node = [p2tokens.popleft().label]
+            elif p2tokens[0].isNodeDefinition():
+                must_transition = True
+                current_node = [p2tokens[0].label]
+                p3tokens.append(p2tokens.popleft())
+            elif p2tokens[0].isIdentifierList():
+                must_transition = True
+                current_node = p2tokens.popleft().label_refs
+            elif not current_node:
+                self.report_line_error('Node reference expected before this transition: %s' % p2tokens[0])
+            # node definition could be followed by newlines
+            while p2tokens and p2tokens[0].isNewline():
+                must_transition = False
+                self.handle_newline()
+                p2tokens.popleft()
+            if not p2tokens: break
+            # next item must be a transition
+            if p2tokens[0].isTransition():
+                # check for source
+                if not current_node:
+                    self.report_line_error('Transition %s has no source nodes.' % p2tokens[0].label)
+                p2tokens[0].sources = current_node
+                need_destination = True
+                p3tokens.append(p2tokens.popleft())
+            elif must_transition:
+                self.report_line_error("Expected a transition after '%s', not %s." %
+                                       (','.join(current_node), p2tokens[0]))
+                p2tokens.popleft()
+                continue
+            while p2tokens and p2tokens[0].isNewline():
+                self.handle_newline()
+                p2tokens.popleft()
+            if not p2tokens:
+                self.report_line_error('Missing destination for transition %s.' % p3tokens[-1].label)
+                continue
+            # next item must be a destination for the transition
+            if p2tokens[0].isLabelRef():
+                current_node = [p2tokens.popleft().label]
+                if need_destination:
+                    if p3tokens[-1].isTransition():
+                        p3tokens[-1].destinations = current_node
+                        need_destination = False
+                continue
+            elif p2tokens[0].isNodeDefinition():
+                current_node = [p2tokens[0].label]
+                p3tokens[-1].destinations = current_node
+                continue  # process the node defintion on the next iteration
+            elif p2tokens[0].isIdentifierList():
+                current_node = p2tokens.popleft().label_refs
+                if need_destination:
+                    if p3tokens[-1].isTransition():
+                        p3tokens[-1].destinations = current_node
+                        need_destination = False
+            else:
+                raise Exception('parser3 is confused by %s.' % list(p2tokens))
+        return p3tokens
+
+    #---------------- Code generation ----------------
+
+    def generate_machine(self, lines):
+        self.found_error = False
+        self.current_line = self.starting_line
+        tok = self.lexer(''.join(lines))
+        if self.found_error: return
+        self.current_line = self.starting_line
+        p1tokens = self.parser1(tok)
+        if self.found_error: return
+        self.current_line = self.starting_line
+        p2tokens = self.parser2(p1tokens)
+        if self.found_error: return
+        self.current_line = self.starting_line
+        p3tokens = self.parser3(p2tokens)
+        if self.found_error: return
+
+        labels = {}
+        for item in p3tokens:
+            if item.label in labels:
+                    self.report_global_error("Label '%s:' is multiply defined." % item.label)
+            elif item.isNodeDefinition() or item.isTransition():
+                labels[item.label] = item
+            else:
+                raise Exception("Problem in generate_machine: %s" % item)
+
+        # Check for undefined references
+        for item in p3tokens:
+            if item.isTransition():
+                for ref in item.sources + item.destinations:
+                    if ref not in labels:
+                        hint = (" Should it be %s() ?" % ref) if ref[0].isupper() else ""
+                        self.report_global_error("Label '%s' was referenced but never defined.%s" %
+                                                 (ref,hint))
+                        labels[ref] = None
+
+        # Write out the state machine source as a comment
+        self.emit_line('def setup(self):')
+        self.indent_level += 4
+        self.emit_line('"""')
+        self.indent_level += 4
+        indent = ' ' * 4
+        self.output.append(indent + indent.join(lines))
+        self.indent_level -= 4
+        self.emit_line('"""')
+        self.emit_line('')
+        self.emit_line('# Code generated by genfsm on %s:' % time.strftime('%c'))
+        self.emit_line('')
+
+        # Generate the nodes, then the transitions
+        for item in p3tokens:
+            if item.isNodeDefinition():
+                self.emit_line('%s = %s%s .set_name("%s") .set_parent(self)' %
+                               (item.label, item.node_type, item.arglist, item.label))
+        for item in p3tokens:
+            if item.isTransition():
+                self.emit_line('')
+                self.emit_line('%s = %s%s .set_name("%s")' %
+                               (item.label, item.trans_type, item.arglist, item.label))
+                self.emit_line('%s .add_sources(%s) .add_destinations(%s)' %
+                               (item.label, ','.join(item.sources), ','.join(item.destinations)))
+
+        self.emit_line('')
+        self.emit_line('return self')
+
+        # Emit the events the machine listens for as a class attribute
+        graph = self.make_graph(p3tokens)
+        self.graphs.append(graph)
+        events = sorted(set(name for trans in graph['transitions'] for name in trans['events']))
+        if events:
+            self.indent_level -= 4
+            self.output.append('\n')
+            self.emit_line('fsm_events = %r' % (tuple(events),))
+
+    def make_graph(self, p3tokens):
+        """Describe the machine in plain Python data.  The first node
+        defined is the start node."""
+        nodes = [item for item in p3tokens if item.isNodeDefinition()]
+        transitions = [item for item in p3tokens if item.isTransition()]
+        enclosing = [name for (indent, name) in self.class_stack if indent < self.setup_indent]
+        return dict(
+            cls = enclosing[-1] if enclosing else '',
+            line = self.starting_line,
+            start = nodes[0].label if nodes else '',
+            nodes = [dict(label=node.label, type=node.node_type,
+                          args=node.arglist, line=node.line)
+                     for node in nodes],
+            transitions = [dict(label=trans.label, type=trans.trans_type,
+                                args=trans.arglist, line=trans.line,
+                                sources=trans.sources, destinations=trans.destinations,
+                                trigger=transition_triggers.get(trans.trans_type, 'unknown'),
+                                events=transition_events.get(trans.trans_type, []))
+                           for trans in transitions])
+
+    def emit_line(self, line):
+        self.output.append((' '*self.indent_level) + line + '\n')
+
+    def process_text(self, text):
+        """Translate a whole .fsm file.  Returns the Python source, or
+        None if there were errors."""
+        lines = text.splitlines(keepends=True)
+        i = 0
+        while i < len(lines):
+            line = lines[i]
+            i += 1
+            self.line_cache.append(line)
+            self.current_line += 1
+            # Echo lines to the output until we reach a $setup line.
+            if line.find('$setup') == -1:
+                self.output.append(line)
+                class_match = r_class.match(line)
+                if class_match:
+                    indent = len(class_match.group(1))
+                    self.class_stack = [entry for entry in self.class_stack if entry[0] < indent]
+                    self.class_stack.append((indent, class_match.group(2)))
+                continue
+            setup_match = r_setup.match(line)
+            if not setup_match:
+                self.report_line_error("Incorrect $setup syntax: '%s'" % line.strip())
+                continue
+            delim = setup_match.group(1)[0]
+            if delim == '{':
+                close_delim = '}'
+                r_end = re.compile(r'\s*\}\s*$')
+            else:
+                close_delim = delim * 3
+                r_end = re.compile(r'^\s*' + close_delim)
+
+            # Collect the lines of the state machine.
+            self.starting_line = self.current_line + 1
+            self.indent_level = r_indent.match(line).span()[1]
+            self.setup_indent = self.indent_level
+            machine_lines = []
+            while True:
+                if i >= len(lines):
+                    self.report_line_error("State machine at line %s ended without closing %s." %
+                                           (self.starting_line-1, close_delim))
+                    return None
+                line = lines[i]
+                i += 1
+                self.current_line += 1
+                self.line_cache.append(line)
+                if r_end.match(line): break
+                machine_lines.append(line)
+            # Now parse the collected lines and generate code.
+            self.generate_machine(machine_lines)
+        if self.error_count:
+            return None
+        return ''.join(self.output)
+
+    #---------------- Error reporting ----------------
+
+    def report_line_error(self, error_text):
+        self.found_error = True
+        self.error_count += 1
+        cprint(self.line_cache[self.current_line].rstrip(), color='red', file=sys.stderr)
+        cprint('Line %d: %s\n' % (self.current_line, error_text), color='red', file=sys.stderr)
+
+    def report_global_error(self, error_text):
+        self.found_error = True
+        self.error_count += 1
+        cprint('Error: %s\n' % error_text, color='red', file=sys.stderr)
+
+def error_fragment(string):
+    s = string.strip()
+    p = s.find('\n')
+    if p == -1:
+        p = len(s)
+    fragment = s[0:min(p,20)]
+    if len(fragment) < p:
+        fragment += "..."
+    return fragment
+
+#================ Graph analysis ================
+
+r_count = re.compile(r'^\(\s*(count\s*=\s*)?(\d+)\s*\)$')
+
+def analyze(graph):
+    """Check a machine's graph.  Returns a list of (kind, label, message)
+    where kind is 'unreachable' (a node the start node can't lead to),
+    'never-fires' (a transition that can't fire), or 'dead-end' (a
+    reachable node that does nothing and has no outgoing transitions).
+    Other nodes without outgoing transitions, such as the last Say of
+    a chain, are final by design and aren't reported."""
+    problems = []
+    node_types = dict((node['label'], node['type']) for node in graph['nodes'])
+    outgoing = dict((label, []) for label in node_types)
+    for trans in graph['transitions']:
+        for source in trans['sources']:
+            outgoing.setdefault(source, []).append(trans)
+
+    # Reachability from the start node
+    reachable = set()
+    if graph['start']:
+        frontier = [graph['start']]
+        reachable.add(graph['start'])
+        while frontier:
+            label = frontier.pop()
+            for trans in outgoing.get(label, ()):
+                for dest in trans['destinations']:
+                    if dest not in reachable:
+                        reachable.add(dest)
+                        frontier.append(dest)
+    for node in graph['nodes']:
+        if node['label'] not in reachable:
+            problems.append(('unreachable', node['label'],
+                             'line %d: node %s can never be entered' % (node['line'], node['label'])))
+
+    # A transition can't fire if no source can be entered, if a
+    # sibling immediate transition always stops its source first, or
+    # if it waits for more sources than it has.
+    for trans in graph['transitions']:
+        label = trans['label']
+        reason = None
+        if not any(source in reachable for source in trans['sources']):
+            reason = 'its source nodes can never be entered'
+        elif trans['trigger'] != 'immediate' and len(trans['sources']) == 1:
+            preempted = [other['label'] for other in outgoing[trans['sources'][0]]
+                         if other is not trans and other['trigger'] == 'immediate']
+            if preempted:
+                reason = '%s fires first when %s starts' % (preempted[0], trans['sources'][0])
+        if reason is None and trans['type'] in counting_transitions:
+            match = r_count.match(trans['args'])
+            if match and int(match.group(2)) > len(trans['sources']):
+                reason = 'it waits for %s sources but has only %d' % \
+                         (match.group(2), len(trans['sources']))
+        if reason:
+            problems.append(('never-fires', label, 'line %d: transition %s can never fire: %s' %
+                             (trans['line'], label, reason)))
+
+    for node in graph['nodes']:
+        label = node['label']
+        if label in reachable and not outgoing[label] and \
+               node['type'] in idle_node_types:
+            problems.append(('dead-end', label,
+                             'line %d: node %s does nothing and has no outgoing transitions' %
+                             (node['line'], label)))
+    return problems
+
+#================ Compiler API ================
+
+def compile_string(text, filename='<fsm>'):
+    """Translate the text of a .fsm file to Python source.  Raises
+    FSMSyntaxError if there are errors; they are also printed."""
+    return translate_string(text, filename)[0]
+
+def translate_string(text, filename='<fsm>'):
+    """Like compile_string, but returns (source, graphs) with one graph
+    per $setup block."""
+    compiler = Compiler(filename)
+    source = compiler.process_text(text)
+    if source is None:
+        raise FSMSyntaxError('%d error%s in %s' %
+                             (compiler.error_count,
+                              '' if compiler.error_count == 1 else 's', filename))
+    return (source, compiler.graphs)
+
+def source_digest(data):
+    """Cache key for the bytes of a .fsm file."""
+    return hashlib.sha256(COMPILER_VERSION + b'\0' + data).digest()
+
+def cache_paths(fsm_path):
+    """The cached generated source and bytecode for fsm_path."""
+    (dirname, basename) = os.path.split(os.path.abspath(fsm_path))
+    cache_dir = os.path.join(dirname, '__pycache__')
+    source_path = os.path.join(cache_dir, basename + '.py')
+    tag = sys.implementation.cache_tag or 'py'
+    return (source_path, os.path.join(cache_dir, '%s.%s.pyc' % (basename, tag)))
+
+def write_atomically(path, data):
+    """Write data to path, or do nothing if the directory isn't writable."""
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except OSError:
+        pass
+
+def digest_line(digest):
+    return '# genfsm sha256 %s\n' % digest.hex()
+
+def read_cached_source(source_path, digest):
+    """The cached generated source, without its digest line, if the
+    digest matches, else None."""
+    try:
+        with open(source_path, 'rb') as f:
+            source = f.read().decode('utf-8')
+    except (OSError, UnicodeDecodeError):
+        return None
+    trailer = digest_line(digest)
+    if not source.endswith(trailer):
+        return None
+    return source[:-len(trailer)]
+
+def read_cached_code(bytecode_path, digest):
+    """The cached code object if its digest matches, else None.
+    The file holds the import system's magic number, the .fsm file's
+    digest, and the marshaled code object."""
+    magic = importlib.util.MAGIC_NUMBER
+    try:
+        with open(bytecode_path, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return None
+    header_length = len(magic) + len(digest)
+    if data[:len(magic)] != magic or data[len(magic):header_length] != digest:
+        return None
+    try:
+        return marshal.loads(data[header_length:])
+    except (EOFError, ValueError, TypeError):
+        return None
+
+def translate_fsm(fsm_path):
+    """Returns (generated source, digest), translating fsm_path only
+    if the cached source is missing or stale."""
+    with open(fsm_path, 'rb') as f:
+        data = f.read()
+    digest = source_digest(data)
+    (source_path, bytecode_path) = cache_paths(fsm_path)
+    source = read_cached_source(source_path, digest)
+    if source is None:
+        source = compile_string(data.decode('utf-8'), fsm_path)
+        write_atomically(source_path, (source + digest_line(digest)).encode('utf-8'))
+    return (source, digest)
+
+def compile_fsm(fsm_path):
+    """Returns (code object, path of generated source), using the
+    cache when fsm_path's contents haven't changed."""
+    with open(fsm_path, 'rb') as f:
+        digest = source_digest(f.read())
+    (source_path, bytecode_path) = cache_paths(fsm_path)
+    code = read_cached_code(bytecode_path, digest)
+    if code is not None and os.path.exists(source_path):
+        return (code, source_path)
+    (source, digest) = translate_fsm(fsm_path)
+    code = compile(source, source_path, 'exec', dont_inherit=True)
+    if not sys.dont_write_bytecode:
+        write_atomically(bytecode_path, importlib.util.MAGIC_NUMBER + digest + marshal.dumps(code))
+    return (code, source_path)
+
+def compile_file(fsm_path, py_path=None, force=False):
+    """Write the Python translation of fsm_path to py_path (default:
+    the same name ending in .py).  Returns True if py_path was
+    written, False if it was already up to date."""
+    if py_path is None:
+        py_path = os.path.splitext(fsm_path)[0] + '.py'
+        if py_path == fsm_path:
+            raise ValueError("Output file name can't be the same as input file.")
+    if force:
+        with open(fsm_path, 'rb') as f:
+            source = compile_string(f.read().decode('utf-8'), fsm_path)
+    else:
+        (source, digest) = translate_fsm(fsm_path)
+        try:
+            with open(py_path, 'rb') as f:
+                if f.read().decode('utf-8') == source:
+                    return False
+        except (OSError, UnicodeDecodeError):
+            pass
+    with open(py_path, 'w') as f:
+        f.write(source)
+    return True
+
+#================ Import hook ================
+
+class FSMLoader(importlib.abc.Loader):
+    def __init__(self, fullname, fsm_path):
+        self.name = fullname
+        self.path = fsm_path
+
+    def create_module(self, spec):
+        return None  # default module creation
+
+    def exec_module(self, module):
+        (code, source_path) = compile_fsm(self.path)
+        module.__cached__ = source_path
+        exec(code, module.__dict__)
+
+    def get_filename(self, fullname):
+        return self.path
+
+    def get_source(self, fullname):
+        return translate_fsm(self.path)[0]
+
+class FSMFinder(importlib.abc.MetaPathFinder):
+    """Finds modules written as .fsm files.  An .fsm file takes
+    precedence over a .py file of the same name in the same directory,
+    since the .py may be out of date."""
+    def find_spec(self, fullname, path, target=None):
+        basename = fullname.rpartition('.')[2] + '.fsm'
+        for entry in (sys.path if path is None else path):
+            if not isinstance(entry, str): continue
+            fsm_path = os.path.join(entry or '.', basename)
+            if os.path.isfile(fsm_path):
+                fsm_path = os.path.abspath(fsm_path)
+                return importlib.util.spec_from_file_location(
+                    fullname, fsm_path, loader=FSMLoader(fullname, fsm_path))
+        return None
+
+finder = FSMFinder()
+
+def install():
+    """Make .fsm files importable.  Safe to call more than once."""
+    if finder not in sys.meta_path:
+        sys.meta_path.insert(0, finder)
+
+def uninstall():
+    if finder in sys.meta_path:
+        sys.meta_path.remove(finder)
@@ -0,0 +1,139 @@
+"""
+  Low-overhead timing instrumentation for state machines.
+
+  Unlike TRACE, which prints as things happen, INSTR records
+  timestamps in a ring buffer and keeps per-class histograms:
+
+    node     how long each state node ran (start to stop)
+    fire     delay from Transition.fire to fire2 starting the destinations
+    event    delay from EventRouter.post to the handlers running
+    poll     duration of each poll() call
+
+  Usage:
+    INSTR.enable()
+    ... run the state machine ...
+    INSTR.report()
+    INSTR.export_chrome_trace('fsm.json')   # load in chrome://tracing
+
+  When disabled, each hook costs one attribute test.
+"""
+
+import json
+import math
+import time
+from collections import deque
+
+class Histogram:
+    """Durations in log2 microsecond buckets: histogram[k] counts
+    durations between 2**(k-1) and 2**k microseconds."""
+    def __init__(self):
+        self.calls = 0
+        self.total_time = 0.
+        self.max_time = 0.
+        self.histogram = dict()
+
+    def add(self, duration):
+        self.calls += 1
+        self.total_time += duration
+        if duration > self.max_time:
+            self.max_time = duration
+        bucket = max(0, math.frexp(duration * 1e6)[1])
+        self.histogram[bucket] = self.histogram.get(bucket, 0) + 1
+
+    @property
+    def mean_time(self):
+        return self.total_time / max(1, self.calls)
+
+    def histogram_string(self):
+        return ' '.join('%d:%d' % (k, self.histogram[k]) for k in sorted(self.histogram))
+
+class Instrumentation:
+    def __init__(self, capacity=100000):
+        self.enabled = False
+        self.records = deque(maxlen=capacity)  # (kind, class name, instance name, start, duration)
+        self.stats = dict()                    # (kind, class name) -> Histogram
+        self.node_starts = dict()
+        self.fire_times = dict()
+
+    def __repr__(self):
+        return '<Instrumentation %s, %d records>' % \
+               ('enabled' if self.enabled else 'disabled', len(self.records))
+
+    def enable(self, capacity=None):
+        if capacity is not None and capacity != self.records.maxlen:
+            self.records = deque(self.records, maxlen=capacity)
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def clear(self):
+        self.records.clear()
+        self.stats.clear()
+        self.node_starts.clear()
+        self.fire_times.clear()
+
+    def record(self, kind, class_name, name, start, duration):
+        self.records.append((kind, class_name, name, start, duration))
+        key = (kind, class_name)
+        hist = self.stats.get(key)
+        if hist is None:
+            hist = self.stats[key] = Histogram()
+        hist.add(duration)
+
+    # Hooks called by StateNode, Transition, EventRouter, and PollScheduler
+
+    def node_started(self, node):
+        self.node_starts[node] = time.perf_counter()
+
+    def node_stopped(self, node):
+        start = self.node_starts.pop(node, None)
+        if start is not None:
+            self.record('node', node.__class__.__name__, node.name,
+                        start, time.perf_counter() - start)
+
+    def transition_fired(self, transition):
+        self.fire_times[transition] = time.perf_counter()
+
+    def transition_fired2(self, transition):
+        start = self.fire_times.pop(transition, None)
+        if start is not None:
+            self.record('fire', transition.__class__.__name__, transition.name,
+                        start, time.perf_counter() - start)
+
+    # Reporting
+
+    def report(self, kinds=('node', 'fire', 'event', 'poll')):
+        print('%-6s %-24s %8s %10s %10s  %s' %
+              ('kind', 'class', 'count', 'mean ms', 'max ms', 'histogram (log2 us: count)'))
+        for kind in kinds:
+            for (k, class_name) in sorted(key for key in self.stats if key[0] == kind):
+                h = self.stats[(k, class_name)]
+                print('%-6s %-24s %8d %10.3f %10.3f  %s' %
+                      (kind, class_name, h.calls, 1000*h.mean_time, 1000*h.max_time,
+                       h.histogram_string()))
+
+    trace_rows = dict(node=1, fire=2, event=3, poll=4)
+
+    def chrome_trace(self):
+        """The recorded events in Chrome trace-event format, one row per kind."""
+        records = list(self.records)
+        t0 = min((r[3] for r in records), default=0)
+        events = [dict(name='thread_name', ph='M', pid=1, tid=tid, args=dict(name=kind))
+                  for (kind, tid) in self.trace_rows.items()]
+        events += [dict(name = name,
+                        cat = kind,
+                        ph = 'X',
+                        ts = 1e6 * (start - t0),
+                        dur = 1e6 * duration,
+                        pid = 1,
+                        tid = self.trace_rows.get(kind, 0),
+                        args = dict(cls = class_name))
+                   for (kind, class_name, name, start, duration) in records]
+        return dict(traceEvents=events, displayTimeUnit='ms')
+
+    def export_chrome_trace(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.chrome_trace(), f)
+
+INSTR = Instrumentation()
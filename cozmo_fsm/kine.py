@@ -1,4 +1,27 @@
+"""
+Forward kinematics.
+
+Each joint caches its transforms to and from the base frame.  Setting a
+joint's q invalidates the cached transforms of that joint's link and of
+every joint below it, and only if q actually changed, so repeated
+queries between pose updates cost a dictionary lookup.  The matrices
+returned are shared with the cache and are read-only; copy one before
+modifying it.
+
+The viewers query the kinematics from their own threads, so each
+kinematic tree has one reentrant lock.  It is held while a transform
+is computed and stored, and while q changes and caches are
+invalidated.  Otherwise a value computed from the old q could be
+stored after invalidation and then served as current.
+
+Kinematics.get_pose skips fixed joints.  A joint may also have a source
+function returning a cheap token, such as a version number, that
+changes whenever the joint's value might have; its getter is only
+called when the token changes.
+"""
+
 import math
+import threading
 import numpy as np
 
 from . import transform
@@ -7,21 +30,28 @@ from . import rrt_shapes
 class Joint():
     def __init__(self, name, parent=None, type='fixed', getter=(lambda:0),
                  d=0, theta=0, r=0, alpha=0,
-                 collision_model=None, ctransform=transform.identity()):
+                 collision_model=None, ctransform=transform.identity(),
+                 source=None):
         self.name = name
         self.parent = parent
         self.type = type
         if type == 'fixed':
             self.apply_q = self.fixed
+            self.unapply_q = self.fixed
         elif type == 'revolute':
             self.apply_q = self.revolute
+            self.unapply_q = self.revolute_inverse
         elif type == 'prismatic':
             self.apply_q = self.prismatic
+            self.unapply_q = self.prismatic_inverse
         elif type == 'world':
             self.apply_q = self.world_joint
+            self.unapply_q = self.world_joint_inverse
         else:
             raise ValueError("Type must be 'fixed', 'revolute', or 'prismatic'.")
         self.getter = getter
+        self.source = source
+        self.source_token = None
         self.children = []
         self.d = d
         self.theta = theta
@@ -29,11 +59,13 @@ class Joint():
         self.alpha = alpha
         self.children = []
         self.collision_model = collision_model
-        self.q = 0
+        self.cache = dict()
+        self.lock = threading.RLock()   # shared by the whole tree, see Kinematics
+        self._q = 0
         self.qmin = -math.inf
         self.qmax = math.inf
         self.parent_link_to_this_joint = transform.dh_matrix(-d,-theta,-r,-alpha)
-        self.this_joint_to_parent_link = np.linalg.inv(self.parent_link_to_this_joint)
+        self.this_joint_to_parent_link = transform.rigid_inverse(self.parent_link_to_this_joint)
 
         self.solver = None
 
@@ -46,33 +78,85 @@ class Joint():
             qval = ("q=%s" % repr(self.q))
         return "<Joint '%s' %s>" % (self.name, qval)
 
+    @property
+    def q(self):
+        return self._q
+
+    @q.setter
+    def q(self, value):
+        try:
+            same = bool(value == self._q)
+        except ValueError:  # arrays
+            same = np.array_equal(value, self._q)
+        if not same:
+            with self.lock:
+                self._q = value
+                self.invalidate()
+
+    def invalidate(self):
+        """Discard cached transforms that depend on this joint's q: its
+        link's transforms, and everything in the subtree below it."""
+        cache = self.cache
+        for key in ('link', 'link_inverse', 'link_to_base', 'base_to_link'):
+            cache.pop(key, None)
+        for child in self.children:
+            child.invalidate_subtree()
+
+    def invalidate_subtree(self):
+        if self.cache:
+            self.cache.clear()
+        for child in self.children:
+            child.invalidate_subtree()
+
+    def cached(self, key, compute):
+        with self.lock:
+            try:
+                return self.cache[key]
+            except KeyError:
+                value = compute()
+                value.flags.writeable = False
+                self.cache[key] = value
+                return value
+
     def this_joint_to_this_link(self):
         "The link moves by q in the joint's reference frame."
-        return self.apply_q()
+        return self.cached('link', self.apply_q)
 
     def this_link_to_this_joint(self):
-        return np.linalg.inv(self.this_joint_to_this_link())
+        return self.cached('link_inverse', self.unapply_q)
 
     def revolute(self):
         return transform.aboutZ(-self.q)
 
+    def revolute_inverse(self):
+        return transform.aboutZ(self.q)
+
     def prismatic(self):
         return transform.translate(0.,0.,-self.q)
 
+    def prismatic_inverse(self):
+        return transform.translate(0.,0.,self.q)
+
     def fixed(self):
         return transform.identity()
 
     def world_joint(self):
-        return transform.translate(self.q[0],self.q[1]).dot(transform.aboutZ(self.q[2]))
+        return transform.SE2(*self.q).matrix()
+
+    def world_joint_inverse(self):
+        return transform.SE2(*self.q).inverse().matrix()
 
 class Kinematics():
     def __init__(self,joint_list,robot):
         self.joints = dict()
+        self.lock = threading.RLock()
         for j in joint_list:
             self.joints[j.name] = j
+            j.lock = self.lock
             if j.parent:
                 j.parent.children.append(j)
         self.base = self.joints[joint_list[0].name]
+        self.moving_joints = [j for j in joint_list if j.type != 'fixed']
         self.robot = robot
         robot.kine = self
         self.get_pose()
@@ -80,20 +164,21 @@ class Kinematics():
     def joint_to_base(self,joint):
         if isinstance(joint,str):
             joint = self.joints[joint]
-        Tinv = transform.identity()
-        j = joint
-        while j is not self.base and j.parent is not None:
-            Tinv = j.parent.this_link_to_this_joint().dot(
-                j.this_joint_to_parent_link.dot(Tinv)
-                )
-            j = j.parent
-        if j:
-            return Tinv
-        else:
+        return joint.cached('joint_to_base', lambda: self.compute_joint_to_base(joint))
+
+    def compute_joint_to_base(self,joint):
+        if joint is self.base:
+            return transform.identity()
+        elif joint.parent is None:
             raise Exception('Joint %s has no path to base frame' % joint)
+        else:
+            return self.link_to_base(joint.parent).dot(joint.this_joint_to_parent_link)
 
     def base_to_joint(self,joint):
-        return np.linalg.inv(self.joint_to_base(joint))
+        if isinstance(joint,str):
+            joint = self.joints[joint]
+        return joint.cached('base_to_joint',
+                            lambda: transform.rigid_inverse(self.joint_to_base(joint)))
 
     def joint_to_joint(self,joint1,joint2):
         return self.base_to_joint(joint2).dot(self.joint_to_base(joint1))
@@ -101,14 +186,39 @@ class Kinematics():
     def link_to_base(self,joint):
         if isinstance(joint,str):
             joint = self.joints[joint]
-        return self.joint_to_base(joint).dot(joint.this_link_to_this_joint())
+        return joint.cached('link_to_base',
+                            lambda: self.joint_to_base(joint).dot(joint.this_link_to_this_joint()))
 
     def base_to_link(self,joint):
-        return np.linalg.inv(self.link_to_base(joint))
+        if isinstance(joint,str):
+            joint = self.joints[joint]
+        return joint.cached('base_to_link',
+                            lambda: transform.rigid_inverse(self.link_to_base(joint)))
 
     def link_to_link(self,joint1,joint2):
         return self.base_to_link(joint2).dot(self.link_to_base(joint1))
 
+    # Batched queries: one (n,4,4) array for a list of joints or joint names.
+
+    def joints_to_base(self,joints):
+        return np.stack([self.joint_to_base(j) for j in joints])
+
+    def links_to_base(self,joints):
+        return np.stack([self.link_to_base(j) for j in joints])
+
+    def points_to_base(self,joint,points):
+        """Transform an (n,3) or (n,4) array of points in joint's link frame
+        to the base frame in one matrix product.  Returns (n,3)."""
+        points = np.asarray(points, dtype=float)
+        t = self.link_to_base(joint)
+        return points[:,0:3].dot(t[0:3,0:3].T) + t[0:3,3]
+
     def get_pose(self):
-        for j in self.joints.values():
-            j.q = j.getter()
+        with self.lock:
+            for j in self.moving_joints:
+                if j.source:
+                    token = j.source()
+                    if token == j.source_token:
+                        continue
+                    j.source_token = token
+                j.q = j.getter()
@@ -0,0 +1,180 @@
+"""
+Saving and loading SLAM maps.
+
+A map file holds the best particle's landmark map plus the WorldMap's
+walls, markers, and perched cameras, so a program started in a known
+arena can relocalize from a few camera frames instead of remapping it.
+
+File layout (all integers little-endian):
+
+    magic           8 bytes   b'COZMAP\\0\\0'
+    version         uint32
+    header length   uint32
+    header          JSON, padded with spaces to a multiple of 8 bytes
+    data            float64 array
+
+The JSON header describes each landmark and object and gives the
+offset of its numbers in the data array.  Loading parses the header
+and memory-maps the data (copy-on-write), so the landmark arrays of a
+large map are paged in only as they're used.
+
+Usage:
+    save_map(robot, 'arena.map')
+    load_map(robot, 'arena.map')      # or StateMachineProgram(map_file='arena.map')
+"""
+
+import json
+import struct
+
+import numpy as np
+
+from .worldmap import WallObj, MarkerObj, CameraObj, wall_marker_dict
+
+MAGIC = b'COZMAP\0\0'
+VERSION = 1
+prefix = struct.Struct('<8sII')
+
+# Floating point attributes saved for each kind of WorldMap object.
+object_fields = {
+    'WallObj' : ('x', 'y', 'theta', 'length', 'height', 'door_width', 'door_height'),
+    'MarkerObj' : ('x', 'y', 'theta'),
+    'CameraObj' : ('x', 'y', 'z', 'theta', 'phi')
+    }
+
+class MapSnapshot():
+    def __init__(self, landmarks, objects, header):
+        self.landmarks = landmarks   # landmark id -> (mu, orient or height, sigma)
+        self.objects = objects       # WorldMap key -> WorldObject
+        self.header = header
+
+    def __repr__(self):
+        return '<MapSnapshot %d landmarks, %d objects>' % \
+               (len(self.landmarks), len(self.objects))
+
+#================ Writing ================
+
+def plain(id):
+    """Marker ids may be numpy integers, which json can't write."""
+    return int(id) if isinstance(id, np.integer) else id
+
+def encode_landmark(value):
+    (mu, orient, sigma) = value
+    return np.concatenate([np.asarray(mu, dtype=float).ravel(),
+                           np.asarray(orient, dtype=float).ravel(),
+                           np.asarray(sigma, dtype=float).ravel()])
+
+def write_map(filename, landmarks, objects):
+    """Write landmarks (id -> (mu, orient, sigma)) and objects
+    (key -> WorldObject) to filename.  Landmarks whose ids aren't ints
+    or strings, such as LightCubes, are skipped, as are objects of
+    classes not in object_fields."""
+    header = dict(version=VERSION, landmarks=[], objects=[])
+    chunks = []
+    offset = 0
+    for (id, value) in landmarks.items():
+        id = plain(id)
+        if not isinstance(id, (int, str)): continue
+        numbers = encode_landmark(value)
+        header['landmarks'].append(dict(id=id, offset=offset, size=len(numbers)))
+        chunks.append(numbers)
+        offset += len(numbers)
+    for (key, obj) in objects.items():
+        cls = obj.__class__.__name__
+        if not isinstance(key, str) or cls not in object_fields: continue
+        numbers = np.array([float(getattr(obj, field)) for field in object_fields[cls]])
+        record = dict(key=key, cls=cls, id=plain(obj.id), offset=offset)
+        if cls == 'WallObj':
+            record['markers'] = [[plain(id), s, cx, cy] for (id, (s, (cx, cy))) in obj.markers.items()]
+            record['door_ids'] = [plain(id) for id in obj.door_ids]
+        header['objects'].append(record)
+        chunks.append(numbers)
+        offset += len(numbers)
+    header['size'] = offset
+    text = json.dumps(header).encode('utf-8')
+    text += b' ' * (-len(text) % 8)
+    data = np.concatenate(chunks) if chunks else np.empty(0)
+    with open(filename, 'wb') as f:
+        f.write(prefix.pack(MAGIC, VERSION, len(text)))
+        f.write(text)
+        f.write(data.astype('<f8').tobytes())
+
+def save_map(robot, filename):
+    """Save the best particle's landmarks and the world map's walls,
+    markers, and cameras."""
+    pf = robot.world.particle_filter
+    pf.current_pose()   # make sure best_particle is up to date
+    objects = dict((key, obj) for (key, obj) in robot.world.world_map.objects.items()
+                   if isinstance(obj, (WallObj, MarkerObj, CameraObj)) and
+                   not getattr(obj, 'foreign', False))
+    write_map(filename, pf.best_particle.landmarks, objects)
+
+#================ Reading ================
+
+def decode_landmark(numbers):
+    """Markers and walls have a 3x3 sigma and scalar orientation; perched
+    cameras have a 5x5 sigma and (z, orient, pitch)."""
+    mu = numbers[0:2].reshape(2,1)
+    if len(numbers) == 2 + 1 + 9:
+        return (mu, float(numbers[2]), numbers[3:12].reshape(3,3))
+    elif len(numbers) == 2 + 3 + 25:
+        return (mu, numbers[2:5], numbers[5:30].reshape(5,5))
+    raise ValueError('Landmark record of unexpected size %d' % len(numbers))
+
+def decode_object(record, numbers):
+    values = dict(zip(object_fields[record['cls']], (float(x) for x in numbers)))
+    id = record['id']
+    if record['cls'] == 'WallObj':
+        spec = wall_marker_dict.get(id)
+        if spec:
+            (markers, door_ids) = (spec.markers, spec.door_ids)
+        else:
+            markers = dict((m_id, (s, (cx, cy))) for (m_id, s, cx, cy) in record['markers'])
+            door_ids = record['door_ids']
+        return WallObj(id, markers=markers, door_ids=door_ids, **values)
+    elif record['cls'] == 'MarkerObj':
+        return MarkerObj(id, **values)
+    else:
+        return CameraObj(id, **values)
+
+def read_map(filename, mmap=True):
+    """Returns a MapSnapshot.  With mmap=True the landmark arrays are
+    copy-on-write views of the memory-mapped file."""
+    with open(filename, 'rb') as f:
+        (magic, version, header_length) = prefix.unpack(f.read(prefix.size))
+        if magic != MAGIC:
+            raise ValueError('%s is not a map file' % filename)
+        if version > VERSION:
+            raise ValueError('%s has map format version %d; this code reads up to %d' %
+                             (filename, version, VERSION))
+        header = json.loads(f.read(header_length).decode('utf-8'))
+        data_offset = prefix.size + header_length
+        size = header['size']
+        if size == 0:
+            data = np.empty(0)
+        elif mmap:
+            data = np.memmap(f, dtype='<f8', mode='c', offset=data_offset,
+                             shape=(size,)).view(np.ndarray)
+        else:
+            data = np.fromfile(f, dtype='<f8', count=size)
+    landmarks = dict()
+    for record in header['landmarks']:
+        start = record['offset']
+        landmarks[record['id']] = decode_landmark(data[start:start+record['size']])
+    objects = dict()
+    for record in header['objects']:
+        start = record['offset']
+        numbers = data[start:start+len(object_fields[record['cls']])]
+        objects[record['key']] = decode_object(record, numbers)
+    return MapSnapshot(landmarks, objects, header)
+
+def load_map(robot, filename, initializer=None, mmap=True):
+    """Warm-start the particle filter and world map from a saved map.
+    If initializer is supplied the particles are redistributed with it,
+    e.g. RandomWithinRadius when the robot's starting spot is unknown."""
+    snapshot = read_map(filename, mmap=mmap)
+    robot.world.particle_filter.warm_start(snapshot.landmarks, initializer)
+    world_map = robot.world.world_map
+    for (key, obj) in snapshot.objects.items():
+        world_map.objects[key] = obj
+    world_map.objects.reindex()
+    return snapshot
@@ -83,6 +83,9 @@ class MoveLift(StateNode):
         self.robot.conn.send_msg(msg)
         self.robot.move_lift(self.speed)
 
+    def has_action_to_cancel(self):
+        return True
+
     def stop(self):
         if not self.running: return
         self.robot.move_lift(0)
@@ -135,6 +138,9 @@ class DriveContinuous(StateNode):
         self.handle = None
         super().start(event)
 
+    def has_action_to_cancel(self):
+        return True
+
     def stop(self):
         if self.handle:
             self.handle.cancel()
@@ -338,6 +344,10 @@ class CoroutineNode(StateNode):
     def coroutine_launcher(self):
         raise Exception('%s lacks a coroutine_launcher() method' % self)
     
+    def has_action_to_cancel(self):
+        return (self.handle is not None and not self.handle.done()) or \
+               super().has_action_to_cancel()
+
     def stop(self):
         if not self.running: return
         if self.handle: self.handle.cancel()
@@ -370,6 +380,9 @@ class DriveWheels(CoroutineNode):
             if driver: driver.send(None)  # will raise StopIteration
         except StopIteration: pass
 
+    def has_action_to_cancel(self):
+        return True   # stop() stops the wheels
+
     def stop(self):
         if not self.running: return
         self.stop_wheels()
@@ -645,6 +658,11 @@ class ActionNode(StateNode):
                       self.cozmo_action_handle)
                 self.post_failure(self.cozmo_action_handle)
 
+    def has_action_to_cancel(self):
+        return (self.abort_on_stop and self.cozmo_action_handle is not None and
+                self.cozmo_action_handle.is_running) or \
+               super().has_action_to_cancel()
+
     def stop(self):
         if not self.running: return
         if self.cozmo_action_handle and self.abort_on_stop and \
@@ -893,6 +911,10 @@ class StartBehavior(StateNode):
         self.robot.behavior_handle = self.behavior_handle
         self.post_completion()
 
+    def has_action_to_cancel(self):
+        return self.stop_on_exit and self.behavior_handle is not None and \
+               self.behavior_handle is self.robot.behavior_handle
+
     def stop(self):
         if not self.running: return
         if self.stop_on_exit and self.behavior_handle is self.robot.behavior_handle:
@@ -12,7 +12,6 @@ from .transform import wrap_angle, wrap_selected_angles
 from .aruco import ArucoMarker
 from .cozmo_kin import center_of_rotation_offset
 from .worldmap import WallObj, wall_marker_dict, MarkerObj
-from .perched import Cam
 
 class Particle():
     def __init__(self):
@@ -48,6 +47,7 @@ class RandomWithinRadius(ParticleInitializer):
             p.log_weight = 0.0
             p.weight = 1.0
         self.pf.pose = (0, 0, 0)
+        self.pf.pose_changed()
         self.pf.motion_model.old_pose = robot.pose
 
 class RobotPosition(ParticleInitializer):
@@ -75,6 +75,7 @@ class RobotPosition(ParticleInitializer):
             p.log_weight = 0.0
             p.weight = 1.0
         self.pf.pose = (x, y, theta)
+        self.pf.pose_changed()
         self.pf.motion_model.old_pose = robot.pose
     
 
@@ -92,11 +93,12 @@ class DefaultMotionModel(MotionModel):
         self.old_pose = robot.pose
 
     def move(self, particles):
+        """Returns False if the particles were not moved."""
         old_pose = self.old_pose
         new_pose = self.robot.pose
         self.old_pose = new_pose
         if not new_pose.is_comparable(old_pose):
-            return  # can't path integrate if the robot switched reference frames
+            return False  # can't path integrate if the robot switched reference frames
         old_xyz = old_pose.position.x_y_z
         new_xyz = new_pose.position.x_y_z
         old_hdg = old_pose.rotation.angle_z.radians
@@ -104,6 +106,8 @@ class DefaultMotionModel(MotionModel):
         turn_angle = wrap_angle(new_hdg - old_hdg)
         dx = new_xyz[0] - old_xyz[0]
         dy = new_xyz[1] - old_xyz[1]
+        if dx == 0 and dy == 0 and turn_angle == 0:
+            return False  # robot hasn't moved
         cor = center_of_rotation_offset
         dist = max(0, sqrt(dx*dx + dy*dy) + cor * abs(turn_angle))
         # Did we drive forward, or was it backward?
@@ -133,15 +137,30 @@ class DefaultMotionModel(MotionModel):
             p.x = p.x + cos(p.theta)*pdist + xcor
             p.y = p.y + sin(p.theta)*pdist + ycor
             p.theta = wrap_angle(p.theta + pturn/2)
+        return True
 
 #================ Sensor Model ================
 
 class SensorModel():
     def __init__(self, robot, landmarks=dict()):
         self.robot = robot
+        self.landmarks_version = 0  # incremented whenever the landmarks change
         self.set_landmarks(landmarks)
         self.last_evaluate_pose = robot.pose
 
+    @property
+    def landmarks(self):
+        return self._landmarks
+
+    @landmarks.setter
+    def landmarks(self, landmarks):
+        self._landmarks = landmarks
+        self.landmarks_changed()
+
+    def landmarks_changed(self):
+        """Call after modifying the landmarks dict in place."""
+        self.landmarks_version += 1
+
     def set_landmarks(self,landmarks):
         self.landmarks = landmarks
 
@@ -391,6 +410,8 @@ class ParticleFilter():
         self.particles = [particle_factory() for i in range(num_particles)]
         self.best_particle = self.particles[0]
         self.min_log_weight = -300  # prevent floating point underflow in exp()
+        self.pose_version = 0       # incremented whenever particles or weights change
+        self.estimate_version = -1  # pose_version when self.pose was computed
         self.initializer.initialize(robot)
         self.exp_weights = np.empty(self.num_particles)
         self.new_indices = np.empty(self.num_particles, dtype=np.int)
@@ -402,7 +423,10 @@ class ParticleFilter():
         self.variance = (np.array([[0,0],[0,0]]), 0.)
 
     def move(self):
-        self.motion_model.move(self.particles)
+        # Only an explicit False means the particles didn't move; older
+        # motion models that return None are assumed to have moved them.
+        if self.motion_model.move(self.particles) is not False:
+            self.pose_changed()
         if self.sensor_model.evaluate(self.particles):  # true if log_weights changed
             var = self.update_weights()
             if var > 0:
@@ -411,7 +435,19 @@ class ParticleFilter():
         if self.robot.carrying:
             self.robot.world.world_map.update_carried_object(self.robot.carrying)
 
+    def pose_changed(self):
+        """Call after modifying the particles or their weights."""
+        self.pose_version += 1
+
+    def current_pose(self):
+        """The pose estimate, recomputed only if the particles have
+        changed since it was last computed."""
+        if self.estimate_version != self.pose_version:
+            self.pose_estimate()
+        return self.pose
+
     def pose_estimate(self):
+        self.estimate_version = self.pose_version
         cx = 0.0; cy = 0.0
         hsin = 0.0; hcos = 0.0
         weight_sum = 0.0
@@ -470,6 +506,7 @@ class ParticleFilter():
             p = particles[i]
             p.log_weight += wt_inc            
             exp_weights[i] = p.weight = exp(p.log_weight)
+        self.pose_changed()
         variance = np.var(exp_weights)
         return variance
 
@@ -526,6 +563,7 @@ class ParticleFilter():
             p.theta = new_theta[i]
             p.log_weight = 0.0
             p.weight = 1.0
+        self.pose_changed()
 
     def set_pose(self,x,y,theta):
         for i in range(self.num_particles):
@@ -535,6 +573,7 @@ class ParticleFilter():
             p.theta = theta
             p.log_weight = 0.0
             p.weight = 1.0
+        self.pose_changed()
         self.variance_estimate()
 
     def look_for_new_landmarks(self): pass  # SLAM only
@@ -772,6 +811,7 @@ class SLAMSensorModel(SensorModel):
         # Call with force=True from particle_viewer to skip distance traveled check.
         # Call with just_looking=True to just look for new landmarks; no evaluation.
         evaluated = False
+        added = False
 
         (dist,turn_angle) = self.compute_robot_motion()
         # Unless forced, only evaluate if the robot moved enough
@@ -790,7 +830,10 @@ class SLAMSensorModel(SensorModel):
                  if cube.is_visible and self.landmark_test(cube)] + \
             [marker.id for marker in seen_marker_objects.values()
                  if self.landmark_test(marker)] + self.generate_walls_from_markers(seen_marker_objects)
+        Cam = None
         if self.use_perched_cameras:
+            # perched is only imported if perched cameras are in use
+            from .perched import Cam
             # add cammeras that can see the robot as landmarks
             seen_landmarks = seen_landmarks +  \
                                 list(self.robot.world.perched.camera_pool.get(self.robot.aruco_id,{}).values())
@@ -814,7 +857,7 @@ class SLAMSensorModel(SensorModel):
                 sensor_bearing = atan2(id.y,id.x)
                 sensor_orient = id.theta
                 id = "Wall-"+str(id.id)
-            elif isinstance(id, Cam):
+            elif Cam and isinstance(id, Cam):
                 # turning to cylindrical coordinates
                 sensor_dist = sqrt(id.x**2 + id.y**2)
                 sensor_bearing = atan2(id.y,id.x)
@@ -849,6 +892,7 @@ class SLAMSensorModel(SensorModel):
                         p.add_landmark(id, sensor_dist, sensor_bearing, sensor_orient)
                 if not (isinstance(id, str) or isinstance(id, WallObj) ):
                     del self.candidate_landmarks[id]
+                added = True
                 continue
             if just_looking:
                 continue
@@ -891,6 +935,9 @@ class SLAMSensorModel(SensorModel):
                     p.log_weight += wt_inc
             self.robot.world.particle_filter.variance_estimate()
 
+        if evaluated or added:
+            self.landmarks_changed()
+
         # Update the candidate landmarks and delete any losers
         for id in tuple(self.candidate_landmarks.keys()):
             self.candidate_landmarks[id] -= 1
@@ -912,11 +959,39 @@ class SLAMParticleFilter(ParticleFilter):
         super().__init__(robot, **kwargs)
         self.initializer.pf = self
         self.new_landmarks = [None] * self.num_particles
+        self.relocalizing = 0  # forced evaluations left after warm_start
+
+    relocalize_frames = 10
+
+    def warm_start(self, landmarks, initializer=None):
+        """Give every particle a copy of a previously built landmark map,
+        e.g. one loaded by mapfile.load_map.  Redistribute the particles
+        with initializer if supplied, then relocalize against the map
+        on the next relocalize_frames camera frames that see a known
+        landmark, whether or not the robot moves."""
+        if initializer:
+            initializer.pf = self
+            initializer.initialize(self.robot)
+        for p in self.particles:
+            p.landmarks = landmarks.copy()
+        self.sensor_model.landmarks = self.particles[0].landmarks
+        self.relocalizing = self.relocalize_frames
+        self.primed = True
+        self.pose_changed()
+
+    def relocalize(self):
+        """Evaluate the particles against the map without waiting for
+        the robot to move.  Called on each camera frame after warm_start."""
+        if self.sensor_model.evaluate(self.particles, force=True):
+            self.relocalizing -= 1
+            if self.update_weights() > 0:
+                self.resample()
 
     def clear_landmarks(self):
         for p in self.particles:
             p.landmarks.clear()
         self.sensor_model.landmarks.clear()
+        self.sensor_model.landmarks_changed()
 
     def update_weights(self):
         var = super().update_weights()
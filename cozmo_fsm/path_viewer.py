@@ -160,8 +160,7 @@ class PathViewer():
                 radius = node.radius
                 dir = +1 if radius >= 0 else -1
                 r = abs(radius)
-                center = transform.translate(init_x,init_y).dot(
-                    transform.aboutZ(init_q+dir*pi/2).dot(transform.point(r)))
+                center = transform.SE2(init_x, init_y, init_q+dir*pi/2).apply(transform.point(r))
                 theta = wrap_angle(init_q - dir*pi/2)
                 targ_theta = wrap_angle(targ_q - dir*pi/2)
                 ang_step = 0.05 # radians
@@ -2,40 +2,85 @@ import cv2
 import cv2.aruco as aruco
 from numpy import matrix, array, ndarray, sqrt, arctan2, pi
 import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import time
 from time import sleep
 from .transform import wrap_angle
-
-
-# Known camera parameters
-
-# Microsoft HD ( Calibrated to death )
-microsoft_HD_webcam_cameraMatrix = matrix([[1148.00,       -3,    641.0],
-                               [0.000000,   1145.0,    371.0],
-                               [0.000000, 0.000000, 1.000000]])
-microsoft_HD_webcam_distCoeffs = array([0.211679, -0.179776, 0.041896, 0.040334, 0.000000])
+from .aruco import MarkerTracker, PyramidDetector
+from .calibration import CalibrationRegistry, \
+     microsoft_HD_webcam_cameraMatrix, microsoft_HD_webcam_distCoeffs
 
 class Cam():
-    def __init__(self,cap,x,y,z,phi, theta):
+    def __init__(self,cap,x,y,z,phi, theta, timestamp=None):
         self.cap = cap
         self.x = x
         self.y = y
         self.z = z
         self.phi = phi
         self.theta = theta
+        self.timestamp = timestamp   # capture time of the frame this came from
 
     def __repr__(self):
         return '<Cam (%.2f, %.2f, %.2f)> @ %.2f' % \
                (self.x, self.y, self.z,self.phi*180/pi)
 
+class CaptureThread(threading.Thread):
+    """Reads one camera continuously, keeping only the latest frame."""
+    def __init__(self, cap):
+        threading.Thread.__init__(self, daemon=True)
+        self.cap = cap
+        self.name = str(cap)
+        self.running = False
+        self.lock = threading.Lock()
+        self.frame = None
+        self.timestamp = None
+        self.frame_count = 0
+
+    def start(self):
+        # Set running here rather than in run(), so a stop issued
+        # before the thread is scheduled isn't lost.
+        self.running = True
+        super().start()
+
+    def run(self):
+        while self.running:
+            ret, frame = self.cap.read()
+            if not ret:
+                sleep(0.01)
+                continue
+            timestamp = time.time()
+            with self.lock:
+                self.frame = frame
+                self.timestamp = timestamp
+                self.frame_count += 1
+
+    def latest(self):
+        """Returns (frame, capture timestamp, frame count)."""
+        with self.lock:
+            return (self.frame, self.timestamp, self.frame_count)
+
 class PerchedCameraThread(threading.Thread):
+    # Drop a camera's detections if it hasn't delivered a frame for this long
+    max_detection_age = 1.0  # seconds
+
     def __init__(self, robot):
         threading.Thread.__init__(self)
         self.robot = robot
         self.use_perched_cameras=False
         self.perched_cameras = []
-        # Set camera paramaters ( Current code assumes same parameters for all cameras connected to a computer)
-        self.cameraMatrix = microsoft_HD_webcam_cameraMatrix
-        self.distCoeffs = microsoft_HD_webcam_distCoeffs
+        self.captures = []
+        self.pool = None
+        # cap name -> (capture timestamp, {aruco id: Cam}) from its latest frame
+        self.detections = {}
+        # cap name -> MarkerTracker when ROI tracking is enabled
+        self.trackers = {}
+        # cap name -> PyramidDetector for cameras using multi-scale detection
+        self.detectors = {}
+        # Camera parameters by camera id; unregistered cameras get the
+        # registry's default (the Microsoft HD webcam).  Register or
+        # load_directory() before starting the thread.
+        self.calibrations = CalibrationRegistry()
+        self.capture_calibrations = {}   # cap name -> CameraCalibration
         self.aruco_dict = aruco.Dictionary_get(aruco.DICT_4X4_250)
         self.parameters =  aruco.DetectorParameters_create()
         # camera landmarks from local cameras
@@ -44,21 +89,44 @@ class PerchedCameraThread(threading.Thread):
         self.camera_pool = {}
 
     def run(self):
-        while(True):
-            if self.use_perched_cameras:
-                self.process_image()
-                # Computer overloaded if not given break
-                sleep(0.01)
-            else:
-                break
+        # Each capture thread holds the newest frame from its camera.
+        # Detection runs in the worker pool, one job per camera at a
+        # time, and each result is merged as soon as it is ready, so
+        # adding cameras does not add to the per-frame latency.
+        pending = {}
+        processed = {capture.name: 0 for capture in self.captures}
+        while self.use_perched_cameras:
+            for capture in self.captures:
+                if capture.name in pending: continue
+                frame, timestamp, count = capture.latest()
+                if frame is None or count == processed[capture.name]: continue
+                processed[capture.name] = count
+                pending[capture.name] = \
+                    self.pool.submit(self.detect_cameras, capture.name, frame, timestamp)
+            if not pending:
+                sleep(0.005)
+                continue
+            done, _ = wait(pending.values(), timeout=0.05, return_when=FIRST_COMPLETED)
+            for name in [name for (name,future) in pending.items() if future in done]:
+                future = pending.pop(name)
+                try:
+                    self.merge_detections(name, *future.result())
+                except Exception as e:
+                    print('Perched camera %s detection failed: %s' % (name, e))
 
-    def start_perched_camera_thread(self,cameras=[]):
+    def start_perched_camera_thread(self,cameras=[],roi_tracking=False,pyramid=None):
+        """pyramid selects multi-scale detection.  Use True for the
+        PyramidDetector defaults on every camera, a dict of PyramidDetector
+        settings such as dict(scale=0.25, target_fps=15) for every camera,
+        or a dict mapping individual cameras to such settings."""
         if not isinstance(cameras,list):
             cameras = [cameras]
 
         if self.robot.aruco_id == -1:
             self.robot.aruco_id = int(input("Please enter the aruco id of the robot:"))
-            self.robot.world.server.camera_landmark_pool[self.robot.aruco_id]={}
+            server = self.robot.world.server   # None unless map sharing is enabled
+            if server is not None:
+                server.camera_landmark_pool[self.robot.aruco_id]={}
         self.use_perched_cameras=True
         self.perched_cameras = []
         for x in cameras:
@@ -71,13 +139,57 @@ class PerchedCameraThread(threading.Thread):
             # hack to set highest resolution
             cap.set(3,4000)
             cap.set(4,4000)
+        self.detections = {}
+        self.captures = [CaptureThread(cap) for cap in self.perched_cameras]
+        self.capture_calibrations = {capture.name: self.calibrations.get(camera)
+                                     for (camera, capture) in zip(cameras, self.captures)}
+        self.detectors = {}
+        for (camera, capture) in zip(cameras, self.captures):
+            settings = self.pyramid_settings(pyramid, camera)
+            if settings is not None:
+                self.detectors[capture.name] = \
+                    PyramidDetector(self.aruco_dict, self.parameters, **settings)
+        if roi_tracking:
+            # Perched cameras don't move, so markers are searched for
+            # where they were last seen.
+            self.trackers = {capture.name:
+                                 MarkerTracker(self.aruco_dict, self.parameters,
+                                               detector=self.detectors.get(capture.name))
+                             for capture in self.captures}
+        else:
+            self.trackers = {}
+        for capture in self.captures:
+            capture.start()
+        self.pool = ThreadPoolExecutor(max_workers=max(1,len(self.captures)))
         self.robot.world.particle_filter.sensor_model.use_perched_cameras = True
         print("Particle filter now using perched cameras")
         self.start()
 
+    @staticmethod
+    def pyramid_settings(pyramid, camera):
+        if pyramid is None or pyramid is False:
+            return None
+        elif pyramid is True:
+            return dict()
+        elif camera in pyramid:
+            return pyramid[camera]
+        elif set(pyramid.keys()) <= {'scale', 'target_fps'}:
+            return pyramid
+        else:
+            return None
+
     def stop_perched_camera_thread(self):
         self.use_perched_cameras=False
-        sleep(1)
+        if self.is_alive():
+            self.join()
+        for capture in self.captures:
+            capture.running = False
+        for capture in self.captures:
+            if capture.is_alive():
+                capture.join()
+        if self.pool:
+            self.pool.shutdown()
+            self.pool = None
         for cap in self.perched_cameras:
             cap.release()
         self.robot.world.particle_filter.sensor_model.use_perched_cameras = False
@@ -114,33 +226,53 @@ class PerchedCameraThread(threading.Thread):
      
         return array([x, y, z])
 
-    def process_image(self):
-        # Dict with key: aruco id with values as cameras that can see the marker
-        self.temp_cams = {}     # Necessary, else self.cameras is empty most of the time
-        for cap in self.perched_cameras:
-            # Clearing Buffer by grabbing five frames
-            for i in range(5):
-                cap.grab()
-            ret, frame = cap.read()
-            gray = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
+    def detect_cameras(self, name, frame, timestamp):
+        """Runs in a worker thread.  Returns (timestamp, {aruco id: Cam})
+        for the markers seen in one frame from one camera."""
+        cams = {}
+        gray = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
+        if name in self.trackers:
+            corners, ids = self.trackers[name].detect(gray)
+        elif name in self.detectors:
+            corners, ids = self.detectors[name](gray)
+        else:
             corners, ids, rejectedImgPoints = aruco.detectMarkers(gray, self.aruco_dict, parameters=self.parameters)
 
-            if type(ids) is ndarray:
-                vecs = aruco.estimatePoseSingleMarkers(corners, 50, self.cameraMatrix, self.distCoeffs)
-                rvecs, tvecs = vecs[0], vecs[1]
-                for i in range(len(ids)):
-                    rotationm, jcob = cv2.Rodrigues(rvecs[i])
-                    # transform to robot coordinate frame
-                    transformed = matrix(rotationm).T*(-matrix(tvecs[i]).T)
-                    phi = self.rotationMatrixToEulerAngles(rotationm.T)
-                    if ids[i][0] in self.temp_cams:
-                        self.temp_cams[ids[i][0]][str(cap)]=Cam(str(cap),transformed[0][0,0],
-                            transformed[1][0,0],transformed[2][0,0],wrap_angle(phi[2]-pi/2), wrap_angle(phi[0]+pi/2))
-                    else:
-                        self.temp_cams[ids[i][0]]={str(cap):Cam(str(cap),transformed[0][0,0],
-                            transformed[1][0,0],transformed[2][0,0],wrap_angle(phi[2]-pi/2), wrap_angle(phi[0]+pi/2))}
-        self.cameras = self.temp_cams
+        if type(ids) is ndarray:
+            # Undistort just the corners rather than the whole image, then
+            # estimate poses without redoing the distortion model.
+            calibration = self.capture_calibrations[name]
+            corners = calibration.undistort_corners(corners)
+            vecs = aruco.estimatePoseSingleMarkers(corners, 50, calibration.camera_matrix,
+                                                   calibration.zero_distortion)
+            rvecs, tvecs = vecs[0], vecs[1]
+            for i in range(len(ids)):
+                rotationm, jcob = cv2.Rodrigues(rvecs[i])
+                # transform to robot coordinate frame
+                transformed = matrix(rotationm).T*(-matrix(tvecs[i]).T)
+                phi = self.rotationMatrixToEulerAngles(rotationm.T)
+                cams[ids[i][0]] = Cam(name,transformed[0][0,0],
+                    transformed[1][0,0],transformed[2][0,0],wrap_angle(phi[2]-pi/2), wrap_angle(phi[0]+pi/2),
+                    timestamp)
+        return (timestamp, cams)
+
+    def merge_detections(self, name, timestamp, cams):
+        """Install one camera's latest detections and rebuild the
+        aruco id -> {cap: Cam} dictionaries."""
+        self.detections[name] = (timestamp, cams)
+        now = time.time()
+        # Build a new dict rather than updating in place, else
+        # self.cameras is empty most of the time for readers.
+        merged = {}
+        for (ts, cam_dict) in self.detections.values():
+            if now - ts > self.max_detection_age: continue
+            for (aruco_id, cam) in cam_dict.items():
+                if aruco_id in merged:
+                    merged[aruco_id][cam.cap] = cam
+                else:
+                    merged[aruco_id] = {cam.cap: cam}
+        self.cameras = merged
 
         # Only server clears the pool
         if self.robot.world.is_server:
-            self.camera_pool = self.temp_cams
+            self.camera_pool = merged
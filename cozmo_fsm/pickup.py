@@ -11,6 +11,8 @@ from math import sin, cos, atan2, pi, sqrt
 
 class GoToCube(StateNode):
 
+    lazy_setup = True
+
     def __init__(self, cube=None):
         self.object = cube
         super().__init__()
@@ -19,6 +21,7 @@ class GoToCube(StateNode):
         # self.object will be set up by the parent of this node
         if isinstance(self.object, LightCubeObj):
             self.object = self.object.sdk_obj
+        self.ensure_setup()
         self.children['looker'].object = self.object
         super().start(event)
 
@@ -162,7 +165,7 @@ class GoToCube(StateNode):
             end: ParentCompletes()
         """
         
-        # Code generated by genfsm on Sun Nov 19 18:48:58 2017:
+        # Code generated by genfsm on Sun Oct 18 23:55:01 2026:
         
         droplift = SetLiftHeight(0) .set_name("droplift") .set_parent(self)
         looker = LookAtObject() .set_name("looker") .set_parent(self)
@@ -279,6 +282,8 @@ class GoToCube(StateNode):
         
         return self
 
+    fsm_events = ('CompletionEvent', 'FailureEvent', 'SuccessEvent')
+
 class SetCarrying(StateNode):
     def __init__(self,object=None):
         self.object = object
@@ -296,6 +301,8 @@ class SetNotCarrying(StateNode):
 
 class PickUpCube(StateNode):
 
+    lazy_setup = True
+
     class StoreImagePatch(StateNode):
         def __init__(self,params,attr_name):
             self.params = params
@@ -328,6 +335,7 @@ class PickUpCube(StateNode):
         super().__init__()
 
     def start(self, event=None):
+        self.ensure_setup()
         self.children['goto_cube'].object = self.object
         self.children['set_carry'].object = self.object
         super().start(event)
@@ -350,7 +358,7 @@ class PickUpCube(StateNode):
             set_carry: SetCarrying() =N=> ParentCompletes()
         """
         
-        # Code generated by genfsm on Sun Nov 19 18:48:58 2017:
+        # Code generated by genfsm on Sun Oct 18 23:55:01 2026:
         
         goto_cube = GoToCube() .set_name("goto_cube") .set_parent(self)
         parentfails3 = ParentFails() .set_name("parentfails3") .set_parent(self)
@@ -392,6 +400,8 @@ class PickUpCube(StateNode):
         
         return self
 
+    fsm_events = ('CompletionEvent', 'FailureEvent', 'SuccessEvent')
+
 class DropObject(StateNode):
     def __init__(self):
         self.object = None
@@ -402,7 +412,7 @@ class DropObject(StateNode):
             Print('DropObject...') =N=> SetLiftHeight(0) =C=> SetNotCarrying() =N=> Forward(-10) =C=> ParentCompletes()
         """
         
-        # Code generated by genfsm on Sun Nov 19 18:48:58 2017:
+        # Code generated by genfsm on Sun Oct 18 23:55:01 2026:
         
         print2 = Print('DropObject...') .set_name("print2") .set_parent(self)
         setliftheight1 = SetLiftHeight(0) .set_name("setliftheight1") .set_parent(self)
@@ -424,9 +434,13 @@ class DropObject(StateNode):
         
         return self
 
+    fsm_events = ('CompletionEvent',)
+
 
 class PickUpCubeForeign(StateNode):
 
+    lazy_setup = True
+
     def __init__(self, cube_id=None):
         self.object_id = cube_id
         super().__init__()
@@ -486,7 +500,7 @@ class PickUpCubeForeign(StateNode):
             end: Say("Done") =C=> ParentCompletes()
         """
         
-        # Code generated by genfsm on Sun Nov 19 18:48:58 2017:
+        # Code generated by genfsm on Sun Oct 18 23:55:01 2026:
         
         goto_cube = self.GoToSide() .set_name("goto_cube") .set_parent(self)
         one = self.Pick() .set_name("one") .set_parent(self)
@@ -503,3 +517,5 @@ class PickUpCubeForeign(StateNode):
         completiontrans18 .add_sources(end) .add_destinations(parentcompletes3)
         
         return self
+
+    fsm_events = ('CompletionEvent',)
@@ -61,6 +61,9 @@ class PilotBase(StateNode):
         self.arc_radius = 40
         self.max_turn = pi
 
+    def has_action_to_cancel(self):
+        return self.handle is not None or super().has_action_to_cancel()
+
     def stop(self):
         if self.handle:
             self.handle.cancel()
@@ -276,6 +279,8 @@ class PilotToPoseOld(PilotBase):
 """
 
 class PilotToPose(StateNode):
+    lazy_setup = True
+
     def __init__(self, target_pose=None, verbose=False):
         super().__init__()
         self.target_pose = target_pose
@@ -0,0 +1,200 @@
+"""
+Staged camera image pipeline.
+
+StateMachineProgram normally handles each EvtNewCameraImage in one pass
+on the SDK event loop.  With pipelined_vision=True the work is split
+into stages instead:
+
+   capture -+-> detect --> map
+            +-> user
+            +-> display
+
+Each stage has a small bounded queue; when a stage falls behind, its
+oldest frames are dropped, so a slow user processor or a slow display
+never holds up Aruco detection, localization, or FSM transitions.
+The capture, detect, user, and display stages run on worker threads.
+The map stage runs on the event loop, because the world map and
+particle filter belong to it; at most one map update is pending at a
+time.
+
+Every stage keeps latency statistics; use robot.world.vision_pipeline.report()
+to print them.
+"""
+
+import threading
+import time
+from collections import deque
+
+from .frames import Frame
+
+class StageStats():
+    def __init__(self):
+        self.processed = 0
+        self.dropped = 0
+        self.last_latency = 0.
+        self.total_latency = 0.
+        self.max_latency = 0.
+        self.last_age = 0.   # time from image receipt to end of this stage
+
+    def record(self, latency, age):
+        self.processed += 1
+        self.last_latency = latency
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+        self.last_age = age
+
+    @property
+    def mean_latency(self):
+        return self.total_latency / max(1, self.processed)
+
+class Stage(threading.Thread):
+    """A worker thread that applies function to each frame it receives
+    and passes the frame on to its successor stages."""
+    def __init__(self, name, function, maxlen=1):
+        threading.Thread.__init__(self, daemon=True)
+        self.name = name
+        self.function = function
+        self.queue = deque(maxlen=maxlen)
+        self.ready = threading.Condition()
+        self.successors = []
+        self.stats = StageStats()
+        self.running = False
+
+    def __repr__(self):
+        return '<%s %s>' % (self.__class__.__name__, self.name)
+
+    def put(self, frame):
+        """Queue a frame; the stage takes over one hold on it."""
+        dropped = None
+        with self.ready:
+            if len(self.queue) == self.queue.maxlen:
+                self.stats.dropped += 1   # deque discards the oldest frame
+                dropped = self.queue[0]
+            self.queue.append(frame)
+            self.ready.notify()
+        if dropped:
+            dropped.release()
+
+    def start(self):
+        # Set running before the thread is scheduled so that an early
+        # stop() isn't overwritten.
+        self.running = True
+        super().start()
+
+    def run(self):
+        while self.running:
+            with self.ready:
+                while self.running and not self.queue:
+                    self.ready.wait()
+                if not self.running: break
+                frame = self.queue.popleft()
+            self.process(frame)
+
+    def process(self, frame):
+        start = time.time()
+        try:
+            self.function(frame)
+        except Exception as e:
+            print('%s stage: %s: %s' % (self.name, e.__class__.__name__, e))
+            frame.release()
+            return
+        end = time.time()
+        self.stats.record(end - start, end - frame.image_recv_time)
+        for stage in self.successors:
+            frame.hold()
+            stage.put(frame)
+        frame.release()
+
+    def stop(self):
+        with self.ready:
+            self.running = False
+            self.ready.notify()
+            queued = list(self.queue)
+            self.queue.clear()
+        for frame in queued:
+            frame.release()
+
+class LoopStage(Stage):
+    """A stage that runs on the event loop instead of a thread.  Only the
+    most recent frame is kept; older pending frames are dropped."""
+    def __init__(self, name, function, loop):
+        super().__init__(name, function)
+        self.loop = loop
+        self.lock = threading.Lock()
+        self.pending = None
+
+    def put(self, frame):
+        with self.lock:
+            (dropped, self.pending) = (self.pending, frame)
+        if dropped is not None:
+            self.stats.dropped += 1
+            dropped.release()
+            return
+        self.loop.call_soon_threadsafe(self.run_pending)
+
+    def run_pending(self):
+        with self.lock:
+            (frame, self.pending) = (self.pending, None)
+        if frame is None:
+            return
+        if self.running:
+            self.process(frame)
+        else:
+            frame.release()
+
+    def start(self):
+        self.running = True
+
+    def stop(self):
+        self.running = False
+        with self.lock:
+            (frame, self.pending) = (self.pending, None)
+        if frame is not None:
+            frame.release()
+
+    def join(self, timeout=None):
+        pass
+
+class VisionPipeline():
+    def __init__(self, robot, program, queue_length=1):
+        self.robot = robot
+        self.program = program
+        self.frame_count = 0
+        self.capture = Stage('capture', program.capture_image, queue_length)
+        self.detect = Stage('detect', program.detect_image, queue_length)
+        self.user = Stage('user', program.user_process_image, queue_length)
+        self.display = Stage('display', program.display_image, queue_length)
+        self.map = LoopStage('map', program.update_world, robot.loop)
+        self.capture.successors = [self.detect, self.user, self.display]
+        self.detect.successors = [self.map]
+        self.stages = [self.capture, self.detect, self.user, self.display, self.map]
+
+    def __repr__(self):
+        return '<VisionPipeline %d frames>' % self.frame_count
+
+    def start(self):
+        for stage in self.stages:
+            stage.start()
+
+    def stop(self):
+        for stage in self.stages:
+            stage.stop()
+        for stage in self.stages:
+            stage.join(timeout=1)
+
+    def submit(self, event, **kwargs):
+        """EvtNewCameraImage handler: hand the image to the capture stage."""
+        self.frame_count += 1
+        self.capture.put(Frame(event, self.frame_count))
+
+    def latencies(self):
+        return dict((stage.name, stage.stats.last_latency) for stage in self.stages)
+
+    def report(self):
+        print('%-8s %9s %8s %10s %10s %10s' %
+              ('stage', 'processed', 'dropped', 'mean ms', 'max ms', 'age ms'))
+        for stage in self.stages:
+            s = stage.stats
+            print('%-8s %9d %8d %10.2f %10.2f %10.2f' %
+                  (stage.name, s.processed, s.dropped, 1000*s.mean_latency,
+                   1000*s.max_latency, 1000*s.last_age))
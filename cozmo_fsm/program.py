@@ -11,16 +11,13 @@ from .base import StateNode
 from .aruco import *
 from .particle import *
 from .cozmo_kin import *
-from .particle_viewer import ParticleViewer
 from .worldmap import WorldMap
+from .mapfile import load_map
 from .rrt import RRT
-from .path_viewer import PathViewer
-from .worldmap_viewer import WorldMapViewer
-from .speech import SpeechListener, Thesaurus
-from . import opengl
 from . import custom_objs
-from .perched import *
-from .sharedmap import *
+from .frames import Frame, FrameRing
+from .pipeline import VisionPipeline
+from .vision import FrameProducts, VisionProcessor, VisionProcessorRegistry
 
 class StateMachineProgram(StateNode):
     def __init__(self,
@@ -29,6 +26,9 @@ class StateMachineProgram(StateNode):
                  force_annotation = False,   # set to True for annotation even without cam_viewer
                  annotate_sdk = True,        # include SDK's own image annotations
                  annotated_scale_factor = 2, # set to 1 to avoid cost of resizing images
+                 lazy_display = False,       # annotate only when the viewer would show a change
+                 max_display_rate = 10,      # frames per second, for lazy_display
+                 pipelined_vision = False,   # process camera images in stages on worker threads
 
                  particle_filter = True,
                  particle_viewer = False,
@@ -36,7 +36,11 @@ class StateMachineProgram(StateNode):
 
                  aruco = True,
                  arucolibname = cv2.aruco.DICT_4X4_250,
+                 aruco_roi_tracking = False, # search only near last-seen markers
                  perched_cameras =True,
+                 shared_map = True,          # allow sharing the world map with other robots
+
+                 map_file = None,            # warm-start the SLAM map from a mapfile.save_map file
 
                  world_map = None,
                  worldmap_viewer = False,
@@ -46,7 +50,7 @@ class StateMachineProgram(StateNode):
 
                  speech = False,
                  speech_debug = False,
-                 thesaurus = Thesaurus()
+                 thesaurus = None            # defaults to a new speech.Thesaurus
                  ):
         super().__init__()
         self.name = self.__class__.__name__.lower()
@@ -69,6 +73,19 @@ class StateMachineProgram(StateNode):
         self.annotate_sdk = annotate_sdk
         self.force_annotation = force_annotation
         self.annotated_scale_factor = annotated_scale_factor
+        self.lazy_display = lazy_display
+        self.max_display_rate = max_display_rate
+        self.annotation_buffer = None
+        self.last_display_time = 0
+        self.last_thumbnail = None
+        self.last_overlays = None
+        self.frames_displayed = 0
+        self.frames_skipped = 0
+        self.pipelined_vision = pipelined_vision
+        self.vision_pipeline = None
+        self.frame_count = 0
+        self.frame_ring = FrameRing()
+        self.vision_processors = VisionProcessorRegistry()
 
         self.particle_filter = particle_filter
         self.particle_viewer = particle_viewer
@@ -79,17 +96,28 @@ class StateMachineProgram(StateNode):
         self.aruco = aruco
         self.perched_cameras = perched_cameras
         if self.aruco:
-            self.robot.world.aruco = Aruco(self.robot,arucolibname)
+            self.robot.world.aruco = Aruco(self.robot,arucolibname,
+                                           roi_tracking=aruco_roi_tracking)
 
+        # The perched camera and map sharing modules are only imported
+        # if they're enabled.
         if self.perched_cameras:
+            from .perched import PerchedCameraThread
             self.robot.world.perched = PerchedCameraThread(self.robot)
 
         self.robot.aruco_id = -1
         self.robot.use_shared_map = False
-        self.robot.world.server = ServerThread(self.robot)
-        self.robot.world.client = ClientThread(self.robot)
+        self.shared_map = shared_map
+        if self.shared_map:
+            from .sharedmap import ServerThread, ClientThread
+            self.robot.world.server = ServerThread(self.robot)
+            self.robot.world.client = ClientThread(self.robot)
+        else:
+            self.robot.world.server = None
+            self.robot.world.client = None
         self.robot.world.is_server = True # Writes directly into perched.camera_pool
 
+        self.map_file = map_file
         self.world_map = world_map
         self.worldmap_viewer = worldmap_viewer
 
@@ -118,6 +146,8 @@ class StateMachineProgram(StateNode):
         self.robot.world.world_map = \
                 self.world_map or WorldMap(self.robot)
         self.robot.world.rrt = self.rrt or RRT(self.robot)
+        if self.map_file:
+            load_map(self.robot, self.map_file)
 
         # Polling
         self.set_polling_interval(0.025)  # for kine and motion model update
@@ -134,8 +164,10 @@ class StateMachineProgram(StateNode):
         else:
             self.windowName = None
 
+        # Viewer modules load OpenGL, so import them only when asked for.
         if self.particle_viewer:
             if self.particle_viewer is True:
+                from .particle_viewer import ParticleViewer
                 self.particle_viewer = \
                     ParticleViewer(self.robot, scale=self.particle_viewer_scale)
             self.particle_viewer.start()
@@ -143,6 +175,7 @@ class StateMachineProgram(StateNode):
 
         if self.path_viewer:
             if self.path_viewer is True:
+                from .path_viewer import PathViewer
                 self.path_viewer = PathViewer(self.robot.world.rrt)
             else:
                 self.path_viewer.set_rrt(self.robot.world.rrt)
@@ -151,20 +184,32 @@ class StateMachineProgram(StateNode):
 
         if self.worldmap_viewer:
             if self.worldmap_viewer is True:
+                from .worldmap_viewer import WorldMapViewer
                 self.worldmap_viewer = WorldMapViewer(self.robot)
             self.worldmap_viewer.start()
         self.robot.world.worldmap_viewer = self.worldmap_viewer
 
         # Request camera image and object streams
+        if self.pipelined_vision:
+            self.vision_pipeline = VisionPipeline(self.robot, self)
+            self.vision_pipeline.start()
+            self.image_handler = self.vision_pipeline.submit
+        else:
+            self.vision_pipeline = None
+            self.image_handler = self.process_image
+        self.robot.world.vision_pipeline = self.vision_pipeline
         self.robot.camera.image_stream_enabled = True
         self.robot.world.add_event_handler(cozmo.world.EvtNewCameraImage,
-                                           self.process_image)
+                                           self.image_handler)
         self.robot.world.add_event_handler(
             cozmo.objects.EvtObjectObserved,
             self.robot.world.world_map.handle_object_observed)
 
         # Start speech recognition if requested
         if self.speech:
+            from .speech import SpeechListener, Thesaurus
+            if self.thesaurus is None:
+                self.thesaurus = Thesaurus()
             self.speech_listener = SpeechListener(self.robot,self.thesaurus,debug=self.speech_debug)
             self.speech_listener.start()
 
@@ -184,8 +229,11 @@ class StateMachineProgram(StateNode):
         super().stop()
         try:
             self.robot.world.remove_event_handler(cozmo.world.EvtNewCameraImage,
-                                                  self.process_image)
+                                                  self.image_handler)
         except: pass
+        if self.vision_pipeline:
+            self.vision_pipeline.stop()
+        self.vision_processors.shutdown()
         #if self.windowName is not None:
         #    cv2.destroyWindow(self.windowName)
 
@@ -208,47 +256,130 @@ class StateMachineProgram(StateNode):
 
     def user_image(self,image,gray): pass
 
+    def add_vision_processor(self,processor):
+        """Run a VisionProcessor on every camera image."""
+        return self.vision_processors.add(processor)
+
+    def remove_vision_processor(self,processor):
+        self.vision_processors.remove(processor)
+
     def user_annotate(self,image):
         return image
 
     def process_image(self,event,**kwargs):
-        curim = numpy.array(event.image.raw_image) #cozmo-raw image
-        gray = cv2.cvtColor(curim,cv2.COLOR_BGR2GRAY)
-
+        self.frame_count += 1
+        frame = Frame(event, self.frame_count)
+        try:
+            self.capture_image(frame)
+            self.detect_image(frame)
+            self.user_process_image(frame)
+            self.display_image(frame)
+            self.update_world(frame)
+        finally:
+            frame.release()
+
+    # The steps below are run in sequence by process_image, or as
+    # separate stages by a VisionPipeline if pipelined_vision is True.
+
+    def capture_image(self,frame):
+        self.frame_ring.ingest(frame) # fills in frame.image and frame.gray
+        frame.products = FrameProducts(frame.image, frame.gray, frame.number)
+
+    def detect_image(self,frame):
         # Aruco image processing
         if self.aruco:
-            self.robot.world.aruco.process_image(gray)
-        # Other image processors can run here if the user supplies them.
-        self.user_image(curim,gray)
-        # Done with image processing
+            self.robot.world.aruco.process_image(frame.gray)
 
+    def user_process_image(self,frame):
+        # Other image processors can run here if the user supplies them.
+        # frame.image is a read-only view of the SDK's image, and user
+        # code may draw on the image it's given, so it gets a copy.
+        if type(self).user_image is not StateMachineProgram.user_image:
+            self.user_image(frame.writable_image(),frame.gray)
+        if self.vision_processors:
+            self.vision_processors.process(frame.products)
+
+    def display_image(self,frame):
         # Annotate and display image if requested
         if self.force_annotation or self.windowName is not None:
+            if self.lazy_display and not self.display_needed(frame):
+                self.frames_skipped += 1
+                return
+            curim = frame.image
             scale = self.annotated_scale_factor
+            shape = (scale*curim.shape[0], scale*curim.shape[1], curim.shape[2])
+            annotated_im = self.display_buffer(shape)
             # Apply Cozmo SDK annotations.
             if self.annotate_sdk:
-                coz_ann = event.image.annotate_image(scale=scale)
-                annotated_im = numpy.array(coz_ann)
+                coz_ann = frame.event.image.annotate_image(scale=scale)
+                numpy.copyto(annotated_im, numpy.asarray(coz_ann))
             elif scale != 1:
-                shape = curim.shape
-                dsize = (scale*shape[1], scale*shape[0])
-                annotated_im = cv2.resize(curim, dsize)
+                cv2.resize(curim, (shape[1],shape[0]), dst=annotated_im)
             else:
-                annotated_im = curim
+                numpy.copyto(annotated_im, curim)
             # Aruco annotation
             if self.aruco and \
                    len(self.robot.world.aruco.seen_marker_ids) > 0:
                 annotated_im = self.robot.world.aruco.annotate(annotated_im,scale)
             # Other annotators can run here if the user supplies them.
             annotated_im = self.user_annotate(annotated_im)
+            annotated_im = self.vision_processors.annotate(annotated_im,scale)
             # Done with annotation
             if self.windowName:
                 cv2.imshow(self.windowName, annotated_im)
-
+            self.frames_displayed += 1
+
+    def display_buffer(self,shape):
+        """Reused output image for annotation.  This is safe because
+        imshow copies the image."""
+        if self.annotation_buffer is None or self.annotation_buffer.shape != shape:
+            self.annotation_buffer = numpy.empty(shape, dtype=numpy.uint8)
+        return self.annotation_buffer
+
+    def display_needed(self,frame):
+        """For lazy_display: should this frame be annotated and shown?"""
+        now = time.time()
+        if now - self.last_display_time < 1 / self.max_display_rate:
+            return False
+        if self.windowName and not self.window_visible():
+            return False
+        thumbnail = cv2.resize(frame.gray, (16,12), interpolation=cv2.INTER_AREA)
+        overlays = self.overlay_signature()
+        if now - self.last_display_time < 1 and \
+               self.last_thumbnail is not None and \
+               overlays == self.last_overlays and \
+               cv2.norm(thumbnail, self.last_thumbnail, cv2.NORM_INF) <= 2:
+            return False   # no visible change since last displayed frame
+        self.last_display_time = now
+        self.last_thumbnail = thumbnail
+        self.last_overlays = overlays
+        return True
+
+    def window_visible(self):
+        try:
+            return cv2.getWindowProperty(self.windowName, cv2.WND_PROP_VISIBLE) > 0
+        except cv2.error:
+            return True   # backend can't tell us
+
+    def overlay_signature(self):
+        """Summary of the overlays drawn on the image; lazy_display redraws
+        when it changes.  Subclasses with their own overlays can extend it."""
+        if not self.aruco:
+            return None
+        (corners, ids) = self.robot.world.aruco.detection
+        if ids is None:
+            return ()
+        return tuple((int(ids[i][0]), tuple(corners[i].round().astype(int).flat))
+                     for i in range(len(ids)))
+
+    def update_world(self,frame):
         # Use this heartbeat signal to look for new landmarks on startup
         pf = self.robot.world.particle_filter
         if pf and not pf.primed:
             pf.look_for_new_landmarks()
+        # After loading a saved map, relocalize without waiting for motion
+        if pf and getattr(pf, 'relocalizing', 0) > 0:
+            pf.relocalize()
 
         # Finally update the world map
         self.robot.world.world_map.update_map()
@@ -61,6 +61,7 @@ class RRT():
         self.bounds = bounds
         self.obstacles = obstacles
         self.auto_obstacles = auto_obstacles
+        self.obstacles_key = None  # world map state the obstacles came from
         self.treeA = []
         self.treeB = []
         self.start = None
@@ -72,6 +73,7 @@ class RRT():
 
     def set_obstacles(self,obstacles):
         self.obstacles = obstacles
+        self.obstacles_key = None
 
     def nearest_node(self, tree, target_node):
         best_distance = inf
@@ -128,11 +130,9 @@ class RRT():
 
     def robot_parts_to_node(self,node):
         parts = []
+        node_tf = transform.SE2(node.x, node.y, node.q)
         for part in self.robot_parts:
-            tmat = transform.aboutZ(part.orient)
-            tmat = transform.translate(part.center[0,0], part.center[1,0]).dot(tmat)
-            tmat = transform.aboutZ(node.q).dot(tmat)
-            tmat = transform.translate(node.x, node.y).dot(tmat)
+            tmat = node_tf.compose(transform.SE2(part.center[0,0], part.center[1,0], part.orient))
             this_part = part.instantiate(tmat)
             parts.append(this_part)
         return parts
@@ -416,19 +416,29 @@ class RRT():
     #---------------- Obstacle Representation ----------------
 
     def generate_obstacles(self):
-        self.robot.world.world_map.update_map()
+        world_map = self.robot.world.world_map
+        world_map.update_map()
+        objects = world_map.objects
+        # Reuse the last obstacles if no object has changed since.
+        key = (world_map.generation,
+               tuple(obj.obstacle for obj in objects.values()))
+        if key == self.obstacles_key:
+            return
         obstacles = []
-        for obj in self.robot.world.world_map.objects.values():
-            if not obj.obstacle: continue
-            if isinstance(obj, WallObj):
+        for obj in objects.of_type(WallObj):
+            if obj.obstacle:
                 obstacles = obstacles + self.generate_wall_obstacles(obj)
-            elif isinstance(obj, (LightCubeObj,CustomCubeObj)):
+        for obj in objects.of_type(LightCubeObj, CustomCubeObj):
+            if obj.obstacle:
                 obstacles.append(self.generate_cube_obstacle(obj))
-            elif isinstance(obj, ChipObj):
+        for obj in objects.of_type(ChipObj):
+            if obj.obstacle:
                 obstacles.append(self.generate_chip_obstacle(obj))
-            elif isinstance(obj, RobotForeignObj):
-               obstacles.append(self.generate_foreign_obstacle(obj))
+        for obj in objects.of_type(RobotForeignObj):
+            if obj.obstacle:
+                obstacles.append(self.generate_foreign_obstacle(obj))
         self.obstacles = obstacles
+        self.obstacles_key = key
 
     def generate_wall_obstacles(self,wall):
         wall_spec = wall_marker_dict[wall.id]
@@ -446,8 +456,7 @@ class RRT():
         edges.append([0., half_length, 0., 1.])
         widths.append(half_length-last_x)
         edges = np.array(edges).T
-        edges = transform.aboutZ(wall.theta).dot(edges)
-        edges = transform.translate(wall.x,wall.y).dot(edges)
+        edges = transform.SE2(wall.x, wall.y, wall.theta).apply(edges)
         obst = []
         for i in range(0,len(widths)):
             center = edges[:,2*i:2*i+2].mean(1).reshape(4,1)
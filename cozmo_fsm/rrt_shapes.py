@@ -1,5 +1,5 @@
 from cozmo_fsm import transform
-from math import sqrt, pi, atan2
+from math import sqrt, pi, atan2, sin, cos
 import numpy as np
 
 class Shape():
@@ -23,6 +23,16 @@ class Shape():
         else:
             raise Exception("%s has no collides() method defined for %s." % (self, shape))
 
+    @staticmethod
+    def transform_center(tmat, center):
+        """Apply tmat, a 4x4 matrix or a transform.SE2, to center.
+        Returns the new center and tmat's rotation about z."""
+        if isinstance(tmat, transform.SE2):
+            (x, y) = tmat.apply_xy(center[0,0], center[1,0])
+            return (transform.point(x, y, center[2,0]), tmat.theta)
+        else:
+            return (tmat.dot(center), atan2(tmat[1,0], tmat[0,0]))
+
 #================ Basic Shapes ================
 
 class Circle(Shape):
@@ -37,7 +47,8 @@ class Circle(Shape):
                (self.center[0,0], self.center[1,0], self.radius)
 
     def instantiate(self, tmat):
-        return Circle(center=tmat.dot(self.center), radius=self.radius)        
+        (center, rot) = self.transform_center(tmat, self.center)
+        return Circle(center=center, radius=self.radius)
 
     def collides_rect(self,rect):
         return rect.collides_circle(self)
@@ -71,20 +82,24 @@ class Rectangle(Polygon):
         self.orient = orient
         dx2 = dimensions[0]/2
         dy2 = dimensions[1]/2
-        vertices = np.array([[-dx2,  dx2, dx2, -dx2 ],
-                             [-dy2, -dy2, dy2,  dy2 ],
-                             [  0,    0,   0,    0  ],
-                             [  1,    1,   1,    1  ]])
+        c = cos(orient)
+        s = sin(orient)
         self.unrot = transform.aboutZ(-orient)
-        center_ex = self.unrot.dot(center)
-        extents = transform.translate(center_ex[0],center_ex[1]).dot(vertices)
+        cx = center[0,0]
+        cy = center[1,0]
         # Extents measured along the rectangle's axes, not world axes
-        self.min_Ex = min(extents[0,:])
-        self.max_Ex = max(extents[0,:])
-        self.min_Ey = min(extents[1,:])
-        self.max_Ey = max(extents[1,:])
-        vertices = transform.aboutZ(orient).dot(vertices)
-        vertices = transform.translate(center[0],center[1]).dot(vertices)
+        ex = c*cx + s*cy
+        ey = c*cy - s*cx
+        self.min_Ex = ex - dx2
+        self.max_Ex = ex + dx2
+        self.min_Ey = ey - dy2
+        self.max_Ey = ey + dy2
+        # Corners rotated by orient about the center
+        (cdx, sdx, cdy, sdy) = (c*dx2, s*dx2, c*dy2, s*dy2)
+        vertices = np.array([[cx - cdx + sdy, cx + cdx + sdy, cx + cdx - sdy, cx - cdx - sdy],
+                             [cy - sdx - cdy, cy + sdx - cdy, cy + sdx + cdy, cy - sdx + cdy],
+                             [0., 0., 0., 0.],
+                             [1., 1., 1., 1.]])
         super().__init__(vertices=vertices)
 
     def __repr__(self):
@@ -94,8 +109,8 @@ class Rectangle(Polygon):
 
     def instantiate(self, tmat):
         dimensions = (self.max_Ex-self.min_Ex, self.max_Ey-self.min_Ey)
-        rot = atan2(tmat[1,0], tmat[0,0])
-        return Rectangle(center = tmat.dot(self.center),
+        (center, rot) = self.transform_center(tmat, self.center)
+        return Rectangle(center = center,
                          orient = rot + self.orient,
                          dimensions = dimensions)
 
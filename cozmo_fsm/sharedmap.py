@@ -2,13 +2,71 @@ import cv2
 import socket
 import pickle
 import threading
+import time
 from time import sleep
 from numpy import inf, arctan2, pi, cos, sin
-from .worldmap import RobotForeignObj, LightCubeForeignObj, WallObj
+from .worldmap import WorldObject, RobotForeignObj, LightCubeForeignObj, WallObj, \
+     LightCubeObj
 from .transform import wrap_angle
-from cozmo.objects import LightCube
 from copy import deepcopy
 
+def send_message(sock, obj):
+    """Pickle obj and send it with the 'end' marker; returns bytes sent."""
+    data = pickle.dumps(obj)+b'end'
+    sock.sendall(data)
+    return len(data)
+
+def recv_message(sock):
+    """Receive one 'end'-terminated message; returns (obj, bytes received)."""
+    # hack to recieve variable size data without crashing
+    data = b''
+    while True:
+        chunk = sock.recv(1024)
+        if not chunk:
+            raise ConnectionError('peer closed connection')
+        data += chunk
+        if data[-3:]==b'end':
+            break
+    return pickle.loads(data[:-3]), len(data)
+
+def close_socket(sock):
+    """Shut down and close a socket, waking any thread blocked on it."""
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+    sock.close()
+
+def unshare(to_send, key, obj):
+    """Stop sending a world map object that has been removed.  Called
+    from the thread that removed it, so hold the to_send lock."""
+    if isinstance(obj, LightCubeObj):
+        to_send.pop("LightCubeForeignObj-"+str(obj.id), None)
+    else:
+        to_send.pop(key, None)
+
+class LinkStats():
+    """Traffic and timing counters for one side of a shared map link."""
+    def __init__(self):
+        self.exchanges = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.last_latency = 0.
+        self.total_latency = 0.
+        self.cpu_time = 0.
+
+    def record(self, sent, received, latency):
+        self.exchanges += 1
+        self.bytes_sent += sent
+        self.bytes_received += received
+        self.last_latency = latency
+        self.total_latency += latency
+        self.cpu_time = time.thread_time()
+
+    def __repr__(self):
+        return '<LinkStats %d exchanges, %d bytes out, %d bytes in>' % \
+               (self.exchanges, self.bytes_sent, self.bytes_received)
+
 class ServerThread(threading.Thread):
     def __init__(self, robot, port=1800):
         threading.Thread.__init__(self)
@@ -18,22 +76,31 @@ class ServerThread(threading.Thread):
         self.camera_landmark_pool = {} # used to find transforms
         self.poses = {}
         self.started = False
+        self.running = False
         self.foreign_objects = {} # foreign walls and cubes
+        self.threads = []
 
     def run(self):
         self.socket = socket.socket(socket.AF_INET,socket.SOCK_STREAM)
         self.socket.setblocking(True) 
         self.socket.setsockopt(socket.SOL_SOCKET,socket.SO_REUSEADDR,True) #enables server restart
         self.socket.bind(("",self.port)) 
+        self.socket.listen(5)   # listen before announcing so clients can connect
         self.threads =[]
         print("Server started")
+        self.running = True
         self.started = True
         self.fusion.start()
         self.robot.world.is_server = True
 
         for i in range(100): # Limit of 100 clients
-            self.socket.listen(5)   # Now wait for client connection.
-            c, addr = self.socket.accept()    # Establish connection with client.
+            try:
+                c, addr = self.socket.accept()    # Establish connection with client.
+            except OSError:
+                break   # socket closed by stop_server_thread
+            if not self.running:
+                c.close()
+                break
             print('Got connection from', addr)
             self.threads.append(ClientHandlerThread(i, c, self.robot))
             self.threads[i].start()
@@ -46,6 +113,15 @@ class ServerThread(threading.Thread):
         self.fusion = FusionThread(self.robot)
         self.start()
 
+    def stop_server_thread(self):
+        self.running = False
+        self.fusion.running = False
+        for thread in self.threads:
+            thread.running = False
+            close_socket(thread.c)
+        if self.socket:
+            close_socket(self.socket)
+
 class ClientHandlerThread(threading.Thread):
     def __init__(self, threadID, client, robot):
         threading.Thread.__init__(self)
@@ -57,29 +133,36 @@ class ClientHandlerThread(threading.Thread):
         self.name = "Client-"+str(self.aruco_id)
         self.robot.world.server.camera_landmark_pool[self.aruco_id]={}
         self.to_send={}
+        self.to_send_lock = threading.Lock()
+        self.running = True
+        self.stats = LinkStats()
+        self.robot.world.world_map.objects.subscribe(self.object_changed)
         print("Started thread for",self.name)
 
+    def object_changed(self, change, key, obj):
+        if change == 'removed':
+            with self.to_send_lock:
+                unshare(self.to_send, key, obj)
+
     def run(self):
         # Send from server to clients
-        while(True):
-            for key, value in self.robot.world.world_map.objects.items():
-                if isinstance(key,LightCube):
-                    self.to_send["LightCubeForeignObj-"+str(value.id)]= LightCubeForeignObj(id=value.id, x=value.x, y=value.y, z=value.z, theta=value.theta)
-                elif isinstance(key,str):
-                    # Send walls and cameras
-                    self.to_send[key] = value         # Fix case when object removed from shared map
-                else:
-                    pass                              # Nothing else in sent
-            # append 'end' to end to mark end
-            self.c.sendall(pickle.dumps([self.robot.world.perched.camera_pool,self.to_send])+b'end')
-            # hack to recieve variable size data without crashing
-            data = b''
-            while True:
-                data += self.c.recv(1024)
-                if data[-3:]==b'end':
-                    break
-
-            cams, landmarks, foreign_objects, pose = pickle.loads(data[:-3])
+        while self.running:
+            start_time = time.time()
+            items = self.robot.world.world_map.objects.items_of_type(WorldObject)
+            with self.to_send_lock:
+                for (key, value) in items:
+                    if isinstance(key,str):
+                        # Send walls, doorways, cameras, markers, ...
+                        self.to_send[key] = value
+                    elif isinstance(value, LightCubeObj):
+                        self.to_send["LightCubeForeignObj-"+str(value.id)]= LightCubeForeignObj(id=value.id, x=value.x, y=value.y, z=value.z, theta=value.theta)
+                to_send = dict(self.to_send)
+            try:
+                sent = send_message(self.c, [self.robot.world.perched.camera_pool,to_send])
+                (cams, landmarks, foreign_objects, pose), received = recv_message(self.c)
+            except OSError:
+                break   # client went away or server is shutting down
+            self.stats.record(sent, received, time.time()-start_time)
             for key, value in cams.items():
                 if key in self.robot.world.perched.camera_pool:
                     self.robot.world.perched.camera_pool[key].update(value)
@@ -88,6 +171,7 @@ class ClientHandlerThread(threading.Thread):
             self.robot.world.server.camera_landmark_pool[self.aruco_id].update(landmarks)
             self.robot.world.server.poses[self.aruco_id] = pose
             self.robot.world.server.foreign_objects[self.aruco_id] = foreign_objects
+        self.robot.world.world_map.objects.unsubscribe(self.object_changed)
 
 class FusionThread(threading.Thread):
     def __init__(self, robot):
@@ -96,9 +180,11 @@ class FusionThread(threading.Thread):
         self.aruco_id = self.robot.aruco_id
         self.accurate = {}
         self.transforms = {}
+        self.running = True
+        self.cpu_time = 0.
 
     def run(self):
-        while(True):
+        while self.running:
             # adding local camera landmarks into camera_landmark_pool
             self.robot.world.server.camera_landmark_pool[self.aruco_id].update( \
                 {k:self.robot.world.particle_filter.sensor_model.landmarks[k] for k in \
@@ -106,11 +192,12 @@ class FusionThread(threading.Thread):
                 if isinstance(x,str) and "Video" in x]})
             flag = False
             # Choose accurate camera
-            for key1, value1 in self.robot.world.server.camera_landmark_pool.items():
-                for key2, value2 in self.robot.world.server.camera_landmark_pool.items():
+            pool = list(self.robot.world.server.camera_landmark_pool.items())
+            for key1, value1 in pool:
+                for key2, value2 in pool:
                     if key1 == key2:
                         continue
-                    for cap, lan in value1.items():
+                    for cap, lan in list(value1.items()):
                         if cap in value2:
                             varsum = lan[2].sum()+value2[cap][2].sum()
                             if varsum < self.accurate.get((key1,key2),(inf,None))[0]:
@@ -129,6 +216,7 @@ class FusionThread(threading.Thread):
                     self.transforms[key] = (x_t, y_t, theta_t, value[1])
             self.update_foreign_robot()
             self.update_foreign_objects()
+            self.cpu_time = time.thread_time()
             sleep(0.01)
 
     def update_foreign_robot(self):
@@ -153,7 +241,8 @@ class FusionThread(threading.Thread):
                         # update wall
                         if k in self.robot.world.world_map.objects:
                             if self.robot.world.world_map.objects[k].foreign:
-                                self.robot.world.world_map.objects[k].update(x=x2, y=y2, theta=wrap_angle(v.theta-theta_t))
+                                self.robot.world.world_map.update_object(self.robot.world.world_map.objects[k],
+                                                                         x=x2, y=y2, theta=wrap_angle(v.theta-theta_t))
                         else:
                             copy_obj = deepcopy(v)
                             copy_obj.x = x2
@@ -165,7 +254,8 @@ class FusionThread(threading.Thread):
                         # update cube
                         if k in self.robot.world.world_map.objects:
                             if self.robot.world.world_map.objects[k].foreign:
-                                self.robot.world.world_map.objects[k].update(x=x2, y=y2, theta=wrap_angle(v.theta-theta_t))
+                                self.robot.world.world_map.update_object(self.robot.world.world_map.objects[k],
+                                                                         x=x2, y=y2, theta=wrap_angle(v.theta-theta_t))
                         else:
                             copy_obj = deepcopy(v)
                             copy_obj.x = x2
@@ -183,6 +273,14 @@ class ClientThread(threading.Thread):
         self.ipaddr = None
         self.robot= robot
         self.to_send = {}
+        self.to_send_lock = threading.Lock()
+        self.running = False
+        self.stats = LinkStats()
+
+    def object_changed(self, change, key, obj):
+        if change == 'removed':
+            with self.to_send_lock:
+                unshare(self.to_send, key, obj)
 
     def start_client_thread(self,ipaddr="",port=1800):
         if self.robot.aruco_id == -1:
@@ -204,8 +302,16 @@ class ClientThread(threading.Thread):
         print("Connected.")
         self.socket.sendall(pickle.dumps(self.robot.aruco_id))
         self.robot.world.is_server = False
+        self.robot.world.world_map.objects.subscribe(self.object_changed)
+        self.running = True
         self.start()
 
+    def stop_client_thread(self):
+        self.running = False
+        self.robot.world.world_map.objects.unsubscribe(self.object_changed)
+        if self.socket:
+            close_socket(self.socket)
+
     def use_shared_map(self):
         # currently affects only worldmap_viewer
         # uses robot.world.world_map.shared_objects instead of robot.world.world_map.objects
@@ -216,28 +322,35 @@ class ClientThread(threading.Thread):
 
     def run(self):
         # Send from client to server
-        while(True):
-            # hack to recieve variable size data without crashing
-            data = b''
-            while True:
-                data += self.socket.recv(1024)
-                if data[-3:]==b'end':
-                    break
-            self.robot.world.perched.camera_pool, self.robot.world.world_map.shared_objects = pickle.loads(data[:-3])
-
-            for key, value in self.robot.world.world_map.objects.items():
-                if isinstance(key,LightCube):
+        while self.running:
+            start_time = time.time()
+            try:
+                (camera_pool, shared_objects), received = recv_message(self.socket)
+            except OSError:
+                break   # server went away or client is shutting down
+            self.robot.world.perched.camera_pool = camera_pool
+            self.robot.world.world_map.shared_objects = shared_objects
+
+            objects = self.robot.world.world_map.objects
+            cubes = objects.of_type(LightCubeObj)
+            walls = objects.items_of_type(WallObj)
+            with self.to_send_lock:
+                for value in cubes:
                     self.to_send["LightCubeForeignObj-"+str(value.id)]= LightCubeForeignObj(id=value.id, cozmo_id=self.robot.aruco_id, x=value.x, y=value.y, z=value.z, theta=value.theta)
-                elif isinstance(key,str) and 'Wall' in key:
+                for (key, value) in walls:
                     # Send walls
-                    self.to_send[key] = value         # Fix case when object removed from shared map
-                else:
-                    pass    
+                    if isinstance(key,str) and 'Wall' in key:
+                        self.to_send[key] = value
+                to_send = dict(self.to_send)
 
             # send cameras, landmarks, objects and pose
-            self.socket.sendall(pickle.dumps([self.robot.world.perched.cameras,
-                {k:self.robot.world.particle_filter.sensor_model.landmarks[k] for k in 
-                [x for x in self.robot.world.particle_filter.sensor_model.landmarks.keys() 
-                if isinstance(x,str) and "Video" in x]},
-                self.to_send,
-                self.robot.world.particle_filter.pose])+b'end')
+            try:
+                sent = send_message(self.socket, [self.robot.world.perched.cameras,
+                    {k:self.robot.world.particle_filter.sensor_model.landmarks[k] for k in
+                    [x for x in self.robot.world.particle_filter.sensor_model.landmarks.keys()
+                    if isinstance(x,str) and "Video" in x]},
+                    to_send,
+                    self.robot.world.particle_filter.pose])
+            except OSError:
+                break
+            self.stats.record(sent, received, time.time()-start_time)
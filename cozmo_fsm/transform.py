@@ -1,9 +1,17 @@
 """
 Transformation matrices for kinematics calculations.
+
+The functions below build 4x4 homogeneous matrices.  SE2 and SE3 are
+rigid transformations kept in factored form (rotation and translation),
+so composing and inverting them is closed form, with no general matrix
+inversion.  Their apply() methods transform a whole array of column
+vectors at once; use matrix() where a 4x4 array is needed.
 """
 
 import numpy as np
-from math import sin, cos, pi
+from math import sin, cos, pi, atan2
+
+_identity = np.identity(4)
 
 def point(x=0,y=0,z=0):
     return np.array([ [x], [y], [z], [1.] ])
@@ -14,36 +22,33 @@ def norm(pt):
 def aboutX(theta):
     c = cos(theta)
     s = sin(theta)
-    return np.array([
-        [ 1,  0,  0, 0],
-        [ 0,  c, -s, 0],
-        [ 0,  s,  c, 0],
-        [ 0,  0,  0, 1]])
+    t = _identity.copy()
+    t[1,1] = c;  t[1,2] = -s
+    t[2,1] = s;  t[2,2] = c
+    return t
 
 def aboutY(theta):
     c = cos(theta)
     s = sin(theta)
-    return np.array([
-        [ c,  0,  s, 0],
-        [ 0,  1,  0, 0],
-        [-s,  0,  c, 0],
-        [ 0,  0,  0, 1]])
+    t = _identity.copy()
+    t[0,0] = c;  t[0,2] = s
+    t[2,0] = -s; t[2,2] = c
+    return t
 
 def aboutZ(theta):
     c = cos(theta)
     s = sin(theta)
-    return np.array([
-        [ c, -s,  0, 0],
-        [ s,  c,  0, 0],
-        [ 0,  0,  1, 0],
-        [ 0,  0,  0, 1.]])
+    t = _identity.copy()
+    t[0,0] = c;  t[0,1] = -s
+    t[1,0] = s;  t[1,1] = c
+    return t
 
 def translate(x,y,z=0):
-    return np.array([
-        [ 1, 0, 0, x],
-        [ 0, 1, 0, y],
-        [ 0, 0, 1, z],
-        [ 0, 0, 0, 1.]])
+    t = _identity.copy()
+    t[0,3] = x
+    t[1,3] = y
+    t[2,3] = z
+    return t
 
 def normalize(v):
     s = v[3,0]
@@ -53,32 +58,131 @@ def normalize(v):
         return v/s
 
 def identity():
-    return np.array([
-        [1, 0, 0, 0],
-        [0, 1, 0, 0],
-        [0, 0, 1, 0],
-        [0, 0, 0, 1.]])
+    return _identity.copy()
 
 def dh_matrix(d,theta,r,alpha):
     """Denavit-Hartenberg transformation from joint i to joint i+1."""
     return aboutX(alpha).dot(translate(r,0,d).dot(aboutZ(theta)))
 
+class SE2():
+    """Rigid transformation in the plane: rotate by theta, then
+    translate by (x,y).  a.compose(b), or a @ b, applies b first."""
+    __slots__ = ('x', 'y', 'theta', 'c', 's')
+
+    def __init__(self, x=0., y=0., theta=0.):
+        self.x = x
+        self.y = y
+        self.theta = theta
+        self.c = cos(theta)
+        self.s = sin(theta)
+
+    def __repr__(self):
+        return '<SE2 (%.1f,%.1f) %.1f deg>' % (self.x, self.y, self.theta*180/pi)
+
+    def compose(self, other):
+        (c, s) = (self.c, self.s)
+        return SE2(self.x + c*other.x - s*other.y,
+                   self.y + s*other.x + c*other.y,
+                   wrap_angle(self.theta + other.theta))
+
+    __matmul__ = compose
+
+    def inverse(self):
+        (c, s) = (self.c, self.s)
+        return SE2(-c*self.x - s*self.y, s*self.x - c*self.y, -self.theta)
+
+    def apply_xy(self, x, y):
+        return (self.x + self.c*x - self.s*y, self.y + self.s*x + self.c*y)
+
+    def apply(self, points):
+        """Transform column vectors: points is (2,n), or homogeneous
+        (3,n) or (4,n) whose remaining rows are copied unchanged."""
+        (c, s) = (self.c, self.s)
+        result = np.array(points, dtype=float)
+        x = points[0]
+        y = points[1]
+        result[0] = c*x - s*y + self.x
+        result[1] = s*x + c*y + self.y
+        return result
+
+    def matrix(self):
+        t = _identity.copy()
+        t[0,0] = self.c;  t[0,1] = -self.s;  t[0,3] = self.x
+        t[1,0] = self.s;  t[1,1] = self.c;   t[1,3] = self.y
+        return t
+
+    @staticmethod
+    def from_matrix(t):
+        return SE2(t[0,3], t[1,3], atan2(t[1,0], t[0,0]))
+
+class SE3():
+    """Rigid transformation in space: rotation matrix R followed by
+    translation t.  a.compose(b), or a @ b, applies b first."""
+    __slots__ = ('R', 't')
+
+    def __init__(self, R=None, t=None):
+        self.R = np.identity(3) if R is None else R
+        self.t = np.zeros(3) if t is None else np.asarray(t, dtype=float)
+
+    def __repr__(self):
+        return '<SE3 t=(%.1f,%.1f,%.1f)>' % tuple(self.t)
+
+    def compose(self, other):
+        return SE3(self.R.dot(other.R), self.R.dot(other.t) + self.t)
+
+    __matmul__ = compose
+
+    def inverse(self):
+        Rinv = self.R.T
+        return SE3(Rinv, -Rinv.dot(self.t))
+
+    def apply(self, points):
+        """Transform column vectors: points is (3,n), or homogeneous (4,n)."""
+        result = np.array(points, dtype=float)
+        result[0:3] = self.R.dot(points[0:3]) + self.t.reshape(3,1)
+        return result
+
+    def matrix(self):
+        m = _identity.copy()
+        m[0:3,0:3] = self.R
+        m[0:3,3] = self.t
+        return m
+
+    @staticmethod
+    def from_matrix(m):
+        return SE3(m[0:3,0:3].copy(), m[0:3,3].copy())
+
+def rigid_inverse(t):
+    """Inverse of a rigid transformation matrix (rotation plus
+    translation), as in SE3.inverse."""
+    rinv = t[0:3,0:3].T
+    result = np.empty((4,4))
+    result[0:3,0:3] = rinv
+    result[0:3,3] = -rinv.dot(t[0:3,3])
+    result[3] = (0., 0., 0., 1.)
+    return result
+
 def translation(t):
     return np.array([ [t[0,3]], [t[1,3]], [t[2,3]], [t[3,3]] ])
 
 def wrap_angle(angle_rads):
-    """Keep angle between -pi and pi."""
-    if angle_rads <= -pi:
-        return 2*pi + angle_rads
-    elif angle_rads > pi:
-        return angle_rads - 2*pi
-    else:
-        return angle_rads
+    """Keep angle between -pi and pi.  Also works on numpy arrays."""
+    try:
+        if -pi < angle_rads <= pi:
+            return angle_rads
+    except ValueError:  # array with more than one element
+        return np.where((angle_rads > -pi) & (angle_rads <= pi),
+                        angle_rads,
+                        pi - np.mod(pi - angle_rads, 2*pi))
+    return pi - (pi - angle_rads) % (2*pi)
 
 def wrap_selected_angles(angle_rads, index):
     """Keep angle between -pi and pi for list"""
-    for i in index:
-       angle_rads[i] =  wrap_angle(angle_rads[i])
+    if isinstance(angle_rads, np.ndarray):
+        angle_rads[index] = wrap_angle(angle_rads[index])
+    else:
+        for i in index:
+            angle_rads[i] = wrap_angle(angle_rads[i])
     return angle_rads
 
 def tprint(t):
@@ -1,5 +1,6 @@
 import random
 import re
+import cozmo
 
 from .base import *
 from .events import *
@@ -156,21 +157,61 @@ class ArucoTrans(Transition):
     """Fires if one of the specified markers is visible"""
     def __init__(self,marker_ids=None):
         super().__init__()
-        self.polling_interval = 0.1
         if isinstance(marker_ids,(list,tuple)):
             marker_ids = set(marker_ids)
         self.marker_ids = marker_ids
 
-    def poll(self,event=None):
-        if not self.running: return
+    def start(self):
+        if self.running: return
+        super().start()
         if self.marker_ids is None:
-            if self.robot.world.aruco.seen_marker_ids != []:
-                self.fire()
+            self.robot.erouter.add_listener(self, ArucoEvent, None)
         elif isinstance(self.marker_ids,set):
-            if self.marker_ids.intersection(self.robot.world.aruco.seen_marker_ids) != set():
-                self.fire()
-        elif self.marker_ids in self.robot.world.aruco.seen_marker_ids:
-            self.fire()
+            for marker_id in self.marker_ids:
+                self.robot.erouter.add_listener(self, ArucoEvent, marker_id)
+        else:
+            self.robot.erouter.add_listener(self, ArucoEvent, self.marker_ids)
+
+    def handle_event(self,event):
+        if not self.running: return
+        super().handle_event(event)
+        self.fire(event)
+
+
+class CubeSeenTrans(Transition):
+    """Fires when the specified cube, or any cube, is seen."""
+    def __init__(self,cube=None):
+        super().__init__()
+        self.cube = cube
+
+    def start(self):
+        if self.running: return
+        super().start()
+        self.robot.erouter.add_listener(self, ObjectSeenEvent, self.cube)
+
+    def handle_event(self,event):
+        if not self.running: return
+        super().handle_event(event)
+        if self.cube or isinstance(event.source, cozmo.objects.LightCube):
+            self.fire(event)
+
+
+class FaceSeenTrans(Transition):
+    """Fires when a face is seen; if name is given, only that person's face."""
+    def __init__(self,name=None):
+        super().__init__()
+        self.name = name
+
+    def start(self):
+        if self.running: return
+        super().start()
+        self.robot.erouter.add_listener(self, FaceSeenEvent, None)
+
+    def handle_event(self,event):
+        if not self.running: return
+        super().handle_event(event)
+        if self.name is None or getattr(event.source, 'name', None) == self.name:
+            self.fire(event)
 
 
 class PatternMatchTrans(Transition):
@@ -0,0 +1,170 @@
+"""
+Vision processors with shared per-frame image products.
+
+A VisionProcessor declares the image products it needs (gray, blurred,
+edges, pyramid, hsv, ...) and receives a FrameProducts object from which
+it fetches them.  Each product is computed at most once per frame, no
+matter how many processors ask for it, and processors run concurrently
+on a thread pool.  OpenCV releases the GIL, so independent processors
+really do overlap.
+
+Usage, in a StateMachineProgram subclass:
+
+    class Corners(VisionProcessor):
+        requires = ('blurred',)
+        def process(self, products):
+            self.corners = cv2.goodFeaturesToTrack(products['blurred'], 50, 0.01, 5)
+
+    def start(self):
+        self.add_vision_processor(Corners())
+        super().start()
+
+New products can be defined with FrameProducts.define_product.
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import cv2
+
+class FrameProducts():
+    """Lazily computed, cached images derived from one camera frame.
+    Products may take parameters: products.get('edges', 30, 90) is cached
+    separately from products['edges'], which uses the default thresholds."""
+
+    builders = dict()
+
+    def __init__(self, image, gray, number=None):
+        self.number = number
+        self.cache = {('image',) : image, ('gray',) : gray}
+        self.lock = threading.Lock()
+        self.locks = dict()   # product key -> lock held while computing it
+
+    def __repr__(self):
+        return '<FrameProducts %s %s>' % \
+               (self.number, [key[0] if len(key) == 1 else key for key in self.cache])
+
+    def __getitem__(self, name):
+        return self.get(name)
+
+    def get(self, name, *args):
+        key = (name,) + args
+        try:
+            return self.cache[key]
+        except KeyError:
+            pass
+        with self.lock:
+            product_lock = self.locks.setdefault(key, threading.Lock())
+        with product_lock:
+            if key not in self.cache:
+                try:
+                    builder = self.builders[name]
+                except KeyError:
+                    raise KeyError("Unknown frame product '%s'" % name)
+                self.cache[key] = builder(self, *args)
+        return self.cache[key]
+
+    @classmethod
+    def define_product(cls, name, builder):
+        """builder(products, *args) computes the product from other products."""
+        cls.builders[name] = builder
+
+def _blurred(products, ksize=5):
+    return cv2.GaussianBlur(products['gray'], (ksize,ksize), 0)
+
+def _edges(products, thresh1=50, thresh2=150):
+    return cv2.Canny(products['gray'], thresh1, thresh2, apertureSize=3)
+
+def _pyramid(products, levels=3):
+    pyramid = [products['gray']]
+    for i in range(levels-1):
+        pyramid.append(cv2.pyrDown(pyramid[-1]))
+    return pyramid
+
+def _hsv(products):
+    return cv2.cvtColor(products['image'], cv2.COLOR_BGR2HSV)
+
+FrameProducts.define_product('blurred', _blurred)
+FrameProducts.define_product('edges', _edges)
+FrameProducts.define_product('pyramid', _pyramid)
+FrameProducts.define_product('hsv', _hsv)
+
+class VisionProcessor():
+    """Base class for vision processors.  requires lists the products
+    process() will use; they are computed before it is called, once per
+    frame, and shared with other processors.  An entry may be a product
+    name or a tuple of a name and arguments, such as ('edges', 30, 90)."""
+    requires = ()
+
+    def __init__(self, name=None):
+        self.name = name or self.__class__.__name__
+        self.last_duration = 0.
+
+    def __repr__(self):
+        return '<%s %s>' % (self.__class__.__name__, self.name)
+
+    def process(self, products):
+        pass
+
+    def annotate(self, image, scale):
+        return image
+
+class VisionProcessorRegistry():
+    def __init__(self, max_workers=4):
+        self.processors = []
+        self.max_workers = max_workers
+        self.executor = None
+        self.last_duration = 0.
+
+    def __repr__(self):
+        return '<VisionProcessorRegistry %s>' % self.processors
+
+    def __len__(self):
+        return len(self.processors)
+
+    def add(self, processor):
+        for product in processor.requires:
+            name = product[0] if isinstance(product, tuple) else product
+            if name not in ('image', 'gray') and name not in FrameProducts.builders:
+                raise ValueError("%s requires unknown product '%s'" % (processor, name))
+        self.processors.append(processor)
+        return processor
+
+    def remove(self, processor):
+        self.processors.remove(processor)
+
+    def run(self, processor, products):
+        start = time.time()
+        for product in processor.requires:
+            if isinstance(product, tuple):
+                products.get(*product)
+            else:
+                products[product]
+        processor.process(products)
+        processor.last_duration = time.time() - start
+
+    def process(self, products):
+        processors = list(self.processors)
+        start = time.time()
+        if len(processors) == 1:
+            self.run(processors[0], products)
+        elif processors:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                   thread_name_prefix='vision')
+            futures = [self.executor.submit(self.run, p, products) for p in processors]
+            wait(futures)
+            for future in futures:
+                future.result()   # re-raise any processor's exception
+        self.last_duration = time.time() - start
+
+    def annotate(self, image, scale):
+        for processor in list(self.processors):
+            image = processor.annotate(image, scale)
+        return image
+
+    def shutdown(self):
+        if self.executor:
+            self.executor.shutdown(wait=False)
+            self.executor = None
@@ -1,4 +1,5 @@
-from math import pi, inf, sin, cos, atan2, sqrt
+import threading
+from math import pi, inf, sin, cos, atan2, sqrt, floor
 from cozmo.faces import Face
 from cozmo.objects import CustomObject, LightCube
 
@@ -178,36 +179,357 @@ class FaceObj(WorldObject):
         return "<FaceObj name:'%s' expr:%s (%.1f, %.1f, %.1f) vis:%s>" % \
                (self.name, self.expression, self.x, self.y, self.z, self.sdk_obj.is_visible)
 
+#================ WorldObjectStore ================
+
+class WorldObjectStore(dict):
+    """The world map's objects: a dict from keys (SDK objects, or
+    strings such as 'Wall-3') to WorldObjects, that also maintains
+      - a table per WorldObject class, see of_type() and items_of_type()
+      - an index by class and id, see lookup_id()
+      - an index of faces by name, see lookup_face()
+      - a spatial hash grid, see within() and nearest()
+    and notifies subscribers of changes.  A subscriber is called as
+    callback(change, key, obj), where change is 'added' (new or
+    replaced), 'removed', or 'moved'.  generation counts the changes,
+    so a consumer can skip work if it hasn't moved since last time.
+
+    Objects are moved by assigning to their x and y, which the store
+    can't see; call moved(obj) afterwards to rebin it and notify
+    subscribers.  WorldMap does this for the objects it updates."""
+
+    cell_size = 100.  # mm
+
+    def __init__(self):
+        super().__init__()
+        self.lock = threading.RLock()
+        self.tables = dict()       # WorldObject class -> {key: obj}
+        self.ids = dict()          # (class, id) -> obj
+        self.faces = dict()        # face name -> Face key
+        self.keys_by_obj = dict()  # id(obj) -> key
+        self.cells = dict()        # grid cell -> set of keys
+        self.key_cells = dict()    # key -> grid cell
+        self.bounds = None         # (imin, imax, jmin, jmax) of cells ever used
+        self.subscribers = []
+        self.generation = 0
+
+    def __reduce__(self):
+        return (self.__class__, (), None, None, iter(self.items()))
+
+    #---------------- dict interface ----------------
+
+    def __setitem__(self, key, obj):
+        with self.lock:
+            if key in self:
+                self.unindex(key, dict.__getitem__(self, key))
+            dict.__setitem__(self, key, obj)
+            self.index(key, obj)
+        self.publish('added', key, obj)
+
+    def __delitem__(self, key):
+        with self.lock:
+            obj = dict.__getitem__(self, key)
+            dict.__delitem__(self, key)
+            self.unindex(key, obj)
+        self.publish('removed', key, obj)
+
+    def pop(self, key, *default):
+        with self.lock:
+            if key in self:
+                obj = self[key]
+                del self[key]
+                return obj
+        if default:
+            return default[0]
+        raise KeyError(key)
+
+    def popitem(self):
+        with self.lock:
+            key = next(reversed(self.keys()))
+            return (key, self.pop(key))
+
+    def setdefault(self, key, default=None):
+        with self.lock:
+            if key not in self:
+                self[key] = default
+            return self[key]
+
+    def update(self, *args, **kwargs):
+        for (key, obj) in dict(*args, **kwargs).items():
+            self[key] = obj
+
+    def clear(self):
+        for key in list(self.keys()):
+            del self[key]
+
+    #---------------- Indexing ----------------
+
+    def index(self, key, obj):
+        cls = obj.__class__
+        table = self.tables.get(cls)
+        if table is None:
+            table = self.tables[cls] = dict()
+        table[key] = obj
+        self.keys_by_obj[id(obj)] = key
+        try:
+            self.ids[(cls, obj.id)] = obj
+        except (AttributeError, TypeError):
+            pass
+        if isinstance(key, Face):
+            self.faces[key.name] = key
+        self.bin(key, obj)
+
+    def unindex(self, key, obj):
+        cls = obj.__class__
+        self.tables[cls].pop(key, None)
+        if self.keys_by_obj.get(id(obj)) == key:
+            del self.keys_by_obj[id(obj)]
+        try:
+            if self.ids.get((cls, obj.id)) is obj:
+                del self.ids[(cls, obj.id)]
+        except (AttributeError, TypeError):
+            pass
+        if isinstance(key, Face) and self.faces.get(key.name) is key:
+            del self.faces[key.name]
+        cell = self.key_cells.pop(key, None)
+        if cell is not None:
+            self.discard_from_cell(cell, key)
+
+    def cell(self, x, y):
+        return (floor(x / self.cell_size), floor(y / self.cell_size))
+
+    def bin(self, key, obj):
+        try:
+            cell = self.cell(obj.x, obj.y)
+        except (AttributeError, TypeError, ValueError):
+            return   # no usable position
+        old = self.key_cells.get(key)
+        if old == cell:
+            return
+        if old is not None:
+            self.discard_from_cell(old, key)
+        keys = self.cells.get(cell)
+        if keys is None:
+            keys = self.cells[cell] = set()
+            (i, j) = cell
+            if self.bounds is None:
+                self.bounds = (i, i, j, j)
+            else:
+                (imin, imax, jmin, jmax) = self.bounds
+                self.bounds = (min(i,imin), max(i,imax), min(j,jmin), max(j,jmax))
+        keys.add(key)
+        self.key_cells[key] = cell
+
+    def discard_from_cell(self, cell, key):
+        keys = self.cells[cell]
+        keys.discard(key)
+        if not keys:
+            del self.cells[cell]
+            if not self.cells:
+                self.bounds = None
+
+    def moved(self, obj):
+        """Call after changing obj's position."""
+        key = self.keys_by_obj.get(id(obj))
+        if key is None or dict.get(self, key) is not obj:
+            return
+        with self.lock:
+            self.bin(key, obj)
+        self.publish('moved', key, obj)
+
+    def reindex(self):
+        """Rebin every object.  Only needed after a bulk load or other
+        changes made without moved() calls."""
+        with self.lock:
+            for (key, obj) in self.items():
+                self.bin(key, obj)
+
+    #---------------- Lookups ----------------
+
+    def of_type(self, *classes):
+        """Objects that are instances of any of classes."""
+        return [obj for (key, obj) in self.items_of_type(*classes)]
+
+    def items_of_type(self, *classes):
+        with self.lock:
+            return [item for (cls, table) in self.tables.items()
+                    if issubclass(cls, classes) for item in table.items()]
+
+    def lookup_id(self, cls, id):
+        return self.ids.get((cls, id))
+
+    def lookup_face(self, name):
+        """The Face key for a face name, or None."""
+        key = self.faces.get(name)
+        if key is not None and key.name == name:
+            return key
+        # Faces can be renamed after they're indexed
+        with self.lock:
+            for key in self.tables.get(FaceObj, ()):
+                if key.name == name:
+                    self.faces[name] = key
+                    return key
+        return None
+
+    def within(self, x, y, radius, classes=WorldObject):
+        """Objects whose x,y lies within radius of (x,y), nearest first."""
+        (imin, jmin) = self.cell(x-radius, y-radius)
+        (imax, jmax) = self.cell(x+radius, y+radius)
+        rsq = radius * radius
+        found = []
+        with self.lock:
+            for i in range(imin, imax+1):
+                for j in range(jmin, jmax+1):
+                    for key in self.cells.get((i,j), ()):
+                        obj = dict.__getitem__(self, key)
+                        if not isinstance(obj, classes): continue
+                        dsq = (obj.x-x)**2 + (obj.y-y)**2
+                        if dsq <= rsq:
+                            found.append((dsq, obj))
+        found.sort(key=lambda item: item[0])
+        return [obj for (dsq, obj) in found]
+
+    def nearest(self, x, y, classes=WorldObject, max_distance=inf):
+        """The object of one of classes nearest to (x,y), or None.
+        Searches rings of grid cells outward from (x,y)'s cell."""
+        (ci, cj) = self.cell(x, y)
+        best = None
+        best_dsq = max_distance * max_distance
+        with self.lock:
+            if self.bounds is None:
+                return None
+            (imin, imax, jmin, jmax) = self.bounds
+            last_ring = max(ci-imin, imax-ci, cj-jmin, jmax-cj)
+            for ring in range(max(0,last_ring)+1):
+                # Anything in this ring or beyond is more than (ring-1)
+                # cells away.
+                limit = (ring-1) * self.cell_size
+                if limit > 0 and (best_dsq <= limit*limit or limit > max_distance):
+                    break
+                for cell in self.ring_cells(ci, cj, ring):
+                    for key in self.cells.get(cell, ()):
+                        obj = dict.__getitem__(self, key)
+                        if not isinstance(obj, classes): continue
+                        dsq = (obj.x-x)**2 + (obj.y-y)**2
+                        if dsq < best_dsq:
+                            (best, best_dsq) = (obj, dsq)
+        return best
+
+    @staticmethod
+    def ring_cells(ci, cj, ring):
+        if ring == 0:
+            return [(ci, cj)]
+        cells = []
+        for i in range(ci-ring, ci+ring+1):
+            cells.append((i, cj-ring))
+            cells.append((i, cj+ring))
+        for j in range(cj-ring+1, cj+ring):
+            cells.append((ci-ring, j))
+            cells.append((ci+ring, j))
+        return cells
+
+    #---------------- Change notification ----------------
+
+    def subscribe(self, callback):
+        if callback not in self.subscribers:
+            self.subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        if callback in self.subscribers:
+            self.subscribers.remove(callback)
+
+    def publish(self, change, key, obj):
+        self.generation += 1
+        for callback in tuple(self.subscribers):
+            try:
+                callback(change, key, obj)
+            except Exception as e:
+                print('WorldObjectStore subscriber %s: %s: %s' %
+                      (callback, e.__class__.__name__, e))
+
 #================ WorldMap ================
 
+def placement(obj):
+    """The parts of obj that the WorldMap updates, for change detection."""
+    return (obj.x, obj.y, obj.z, getattr(obj, 'theta', None),
+            getattr(obj, 'phi', None), getattr(obj, 'is_visible', None))
+
 class WorldMap():
     vision_z_fudge = 10  # Cozmo underestimates object z coord by about this much
 
     def __init__(self,robot):
         self.robot = robot
-        self.objects = dict()
+        self.objects = WorldObjectStore()
         self.shared_objects = dict()
-        
+        self.landmarks_version = None
+        self.sdk_tokens = dict()   # sdk object -> state when last applied
+
+    @property
+    def generation(self):
+        """Incremented whenever an object is added, removed, or moved.
+        Consumers can skip work if it hasn't changed since last time."""
+        return self.objects.generation
+
     def update_map(self):
-        """Called to update the map just before the path planner runs.  Cubes,
-        custom objects, and faces are updated automatically in reponse
-        to observation events, but we update them here to get the
-        freshest possible value.  Walls and Cameras are updated from
-        landmarks."""
-        self.update_walls()
-        self.update_perched_cameras()
+        """Called on every camera frame and just before the path planner
+        runs.  Cubes, custom objects, and faces are updated
+        automatically in reponse to observation events, but we update
+        them here to get the freshest possible value, skipping those
+        whose SDK pose hasn't changed.  Walls and Cameras are updated
+        from landmarks only when the sensor model's landmarks have
+        changed."""
+        # Bring the pose estimate up to date, so objects are placed
+        # from the same estimate their change tokens record.
+        self.robot.world.particle_filter.current_pose()
+        sensor_model = self.robot.world.particle_filter.sensor_model
+        landmarks_version = getattr(sensor_model, 'landmarks_version', None)
+        landmarks_changed = landmarks_version is None or \
+                            landmarks_version != self.landmarks_version
+        self.landmarks_version = landmarks_version
+        if landmarks_changed:
+            self.update_walls()
+        server = self.robot.world.server   # None unless map sharing is enabled
+        if landmarks_changed or (server and server.started):
+            self.update_perched_cameras()
         for (id,cube) in self.robot.world.light_cubes.items():
-            self.update_cube(cube)
+            if self.sdk_obj_changed(cube) or \
+               (self.robot.carrying is not None and self.robot.carrying is self.objects.get(cube)):
+                self.update_cube(cube)
         for face in self.robot.world._faces.values():
-            self.update_face(face)
+            if self.sdk_obj_changed(face):
+                self.update_face(face)
+        if len(self.sdk_tokens) > len(self.robot.world.light_cubes) + len(self.robot.world._faces):
+            # Forget faces the SDK no longer has
+            live = set(self.robot.world.light_cubes.values()) | set(self.robot.world._faces.values())
+            self.sdk_tokens = dict((obj, token) for (obj, token) in self.sdk_tokens.items()
+                                   if obj in live)
+
+    def sdk_obj_changed(self, sdk_obj):
+        """True if sdk_obj has a new pose or visibility, or the robot's
+        pose estimate has changed, since we last looked."""
+        # The SDK makes a new Pose whenever an object moves, and Pose
+        # has no __eq__, so == compares poses by identity.
+        token = (sdk_obj.pose, sdk_obj.is_visible,
+                 self.robot.world.particle_filter.estimate_version)
+        if self.sdk_tokens.get(sdk_obj) == token:
+            return False
+        self.sdk_tokens[sdk_obj] = token
+        return True
+
+    def update_object(self, obj, **kwargs):
+        """obj.update(**kwargs), then notify the store if obj moved."""
+        old = placement(obj)
+        obj.update(**kwargs)
+        if placement(obj) != old:
+            self.objects.moved(obj)
 
     def update_perched_cameras(self):
-        if self.robot.world.server.started:
-            for key, val in self.robot.world.server.camera_landmark_pool.get(self.robot.aruco_id,{}).items():
+        server = self.robot.world.server
+        if server and server.started:
+            for key, val in server.camera_landmark_pool.get(self.robot.aruco_id,{}).items():
                 if isinstance(key,str) and 'Video' in key:
                     if key in self.objects:
-                        self.objects[key].update(x=val[0][0,0], y=val[0][1,0], z=val[1][0],
-                                                 theta=val[1][2], phi=val[1][1])
+                        self.update_object(self.objects[key], x=val[0][0,0], y=val[0][1,0], z=val[1][0],
+                                           theta=val[1][2], phi=val[1][1])
                     else:
                         # last digit of capture id as camera key
                         self.objects[key]=CameraObj(id=int(key[-2]), x=val[0][0,0], y=val[0][1,0],
@@ -216,8 +538,8 @@ class WorldMap():
             for key, val in self.robot.world.particle_filter.sensor_model.landmarks.items():
                 if isinstance(key,str) and 'Video' in key:
                     if key in self.objects:
-                        self.objects[key].update(x=val[0][0,0], y=val[0][1,0], z=val[1][0],
-                                                 theta=val[1][2], phi=val[1][1])
+                        self.update_object(self.objects[key], x=val[0][0,0], y=val[0][1,0], z=val[1][0],
+                                           theta=val[1][2], phi=val[1][1])
                     else:
                         # last digit of capture id as camera key
                         self.objects[key]=CameraObj(id=int(key[-2]), x=val[0][0,0], y=val[0][1,0],
@@ -227,7 +549,7 @@ class WorldMap():
         for key, value in self.robot.world.particle_filter.sensor_model.landmarks.items():
             if isinstance(key,str) and 'Wall' in key:
                 if key in self.objects and isinstance(self.objects[key], WallObj) and (not self.objects[key].foreign):
-                    self.objects[key].update(x=value[0][0][0], y=value[0][1][0], theta=value[1])
+                    self.update_object(self.objects[key], x=value[0][0][0], y=value[0][1][0], theta=value[1])
                 else:
                     id = int(key[-(len(key)-5):])
                     wall_spec = wall_marker_dict[id]
@@ -246,8 +568,7 @@ class WorldMap():
         elif cube.pose is None or not cube.pose.is_comparable(self.robot.pose):
             return
         else:
-            id = tuple(key for (key,value) in self.robot.world.light_cubes.items() if value == cube)[0]
-            world_obj = LightCubeObj(cube, id)
+            world_obj = LightCubeObj(cube, cube.cube_id)
             self.objects[cube] = world_obj
         if cube.is_visible:
             world_obj.update_from_sdk = True  # In case we've dropped it; now we see it
@@ -256,14 +577,15 @@ class WorldMap():
 
     def lookup_face_obj(self,face):
         "Look up face by name, not by Face instance."
-        for (key,value) in self.robot.world.world_map.objects.items():
-            if isinstance(key, Face) and key.name == face.name:
-                if key is not face and face.is_visible:
-                    # Older Face object with same name: replace it with new one
-                    self.robot.world.world_map.objects.pop(key)
-                    self.robot.world.world_map.objects[face] = value
-                return value
-        return None
+        key = self.objects.lookup_face(face.name)
+        if key is None:
+            return None
+        value = self.objects[key]
+        if key is not face and face.is_visible:
+            # Older Face object with same name: replace it with new one
+            self.objects.pop(key)
+            self.objects[face] = value
+        return value
 
     def update_face(self,face):
         if face.pose is None:
@@ -273,13 +595,10 @@ class WorldMap():
         if face_obj is None:
             face_obj = FaceObj(face, face.face_id, pos.x, pos.y, pos.z,
                                face.name)
-            self.robot.world.world_map.objects[face] = face_obj
+            self.objects[face] = face_obj
         # now update the face
         face_obj.is_visible = face.is_visible
         if face.is_visible:
-            face_obj.x = pos.x
-            face_obj.y = pos.y
-            face_obj.z = pos.z
             face_obj.expression = face.expression
             self.update_coords(face_obj, face)
 
@@ -305,23 +624,27 @@ class WorldMap():
         # *** HACK *** : width calculation only works for cubes; need to handle custom obj, chips
         half_width = 22 # world_obj.size[0] / 2
         new_pose = tmat.dot(transform.point(half_width,0))
-        theta = self.robot.world.particle_filter.pose[2]
+        theta = self.robot.world.particle_filter.current_pose()[2]
         world_obj.x = new_pose[0,0]
         world_obj.y = new_pose[1,0]
         world_obj.theta = theta
+        self.objects.moved(world_obj)
 
     def update_coords(self, world_obj, sdk_obj):
+        old = placement(world_obj)
         dx = sdk_obj.pose.position.x - self.robot.pose.position.x
         dy = sdk_obj.pose.position.y - self.robot.pose.position.y
         alpha = atan2(dy,dx) - self.robot.pose.rotation.angle_z.radians
         r = sqrt(dx*dx + dy*dy)
-        (rob_x,rob_y,rob_theta) = self.robot.world.particle_filter.pose
+        (rob_x,rob_y,rob_theta) = self.robot.world.particle_filter.current_pose()
         world_obj.x = rob_x + r * cos(alpha + rob_theta)
         world_obj.y = rob_y + r * sin(alpha + rob_theta)
         world_obj.z = sdk_obj.pose.position.z
         orient_diff = wrap_angle(rob_theta - self.robot.pose.rotation.angle_z.radians)
         world_obj.theta = wrap_angle(sdk_obj.pose.rotation.angle_z.radians + orient_diff)
         world_obj.is_visible = sdk_obj.is_visible
+        if placement(world_obj) != old:
+            self.objects.moved(world_obj)
 
     def handle_object_observed(self, evt, **kwargs):
         if isinstance(evt.obj, LightCube):
@@ -337,8 +337,7 @@ class WorldMapViewer():
         edges.append([0., half_length, door_height/2, 1.])
         widths.append(half_length-last_x)
         edges = np.array(edges).T
-        edges = transform.aboutZ(wall_obst.theta).dot(edges)
-        edges = transform.translate(wall_obst.x,wall_obst.y).dot(edges)
+        edges = transform.SE2(wall_obst.x, wall_obst.y, wall_obst.theta).apply(edges)
         c = glGenLists(1)
         glNewList(c, GL_COMPILE)
         if wall_obst.foreign: